@@ -0,0 +1,85 @@
+from typing import Any, Dict, List
+import os
+
+import numpy as np
+import pandas as pd
+
+"""
+Alignment of the parameters of one station on a common time grid, used by the plots
+pairing values of different parameters. Parameters may report at different cadences,
+values are paired by time and never by position.
+ALIGN_METHOD "asof" (default) uses the timestamps of the parameter with the fewest
+observations and takes the nearest observation of every other parameter within a
+tolerance, ALIGN_TOLERANCE (pandas offset, default the median step of that parameter).
+"resample" averages every parameter in buckets of ALIGN_BUCKET (default 1h).
+"""
+ALIGN_METHOD = os.getenv("ALIGN_METHOD", "asof")
+ALIGN_TOLERANCE = os.getenv("ALIGN_TOLERANCE", "")
+ALIGN_BUCKET = os.getenv("ALIGN_BUCKET", "1h")
+
+
+def value_columns(station: Dict[str, Any]) -> List[str]:
+    return [str(x) for x in station if x.endswith("_value") and len(station[x])]
+
+
+def _series(station: Dict[str, Any], column: str) -> pd.DataFrame:
+    frame = pd.DataFrame(
+        {"time": station[f"{column}_time"], column: station[column]}, copy=False
+    )
+    return frame.dropna().sort_values("time", kind="stable")
+
+
+def median_step(times: pd.Series) -> pd.Timedelta | None:
+    if len(times) < 2:
+        return None
+    return pd.Timedelta(np.median(np.diff(times.to_numpy())))
+
+
+def align_asof(
+    station: Dict[str, Any], tolerance: pd.Timedelta | None = None
+) -> pd.DataFrame:
+    columns = value_columns(station)
+    if not columns:
+        return pd.DataFrame({"time": pd.Series([], dtype="datetime64[ns]")})
+    reference = min(columns, key=lambda column: len(station[column]))
+    aligned = _series(station, reference)
+    if tolerance is None:
+        tolerance = median_step(aligned["time"])
+    for column in columns:
+        if column == reference:
+            continue
+        aligned = pd.merge_asof(
+            aligned,
+            _series(station, column),
+            on="time",
+            direction="nearest",
+            tolerance=tolerance,
+        )
+    return aligned[["time"] + columns].reset_index(drop=True)
+
+
+def align_resample(station: Dict[str, Any], bucket: str = ALIGN_BUCKET) -> pd.DataFrame:
+    columns = value_columns(station)
+    if not columns:
+        return pd.DataFrame({"time": pd.Series([], dtype="datetime64[ns]")})
+    resampled = [
+        _series(station, column).set_index("time")[column].resample(bucket).mean()
+        for column in columns
+    ]
+    aligned = pd.concat(resampled, axis=1).dropna(how="all")
+    return aligned.rename_axis("time").reset_index()
+
+
+def align(
+    station: Dict[str, Any],
+    method: str = ALIGN_METHOD,
+    tolerance: str = ALIGN_TOLERANCE,
+    bucket: str = ALIGN_BUCKET,
+) -> pd.DataFrame:
+    """
+    DataFrame with a time column and a {name}_value column per parameter of a station
+    in the columnar format of parse_observations. Missing pairs are NaN.
+    """
+    if method == "resample":
+        return align_resample(station, bucket)
+    return align_asof(station, pd.Timedelta(tolerance) if tolerance else None)
@@ -1,33 +1,99 @@
 from typing import Tuple, Any, Dict
-from time import sleep
+from email.utils import parsedate_to_datetime
+import asyncio
+import logging
+import threading
+import time
+import httpx
 import requests
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry  # type: ignore
 
+from ratelimit import governor
+
 import os
 
+logger = logging.getLogger(__name__)
+
+"""
+One pooled session is shared by all threads in the process so TLS connections to
+hydapi are kept alive and reused. HYDAPI_POOL_SIZE should be at least the number of
+threads calling the api concurrently, connections above the pool size are discarded.
+"""
+HYDAPI_POOL_SIZE = int(os.getenv("HYDAPI_POOL_SIZE", "10"))
+HYDAPI_TIMEOUT = float(os.getenv("HYDAPI_TIMEOUT", "30"))
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+"""
+The async request path uses one httpx.AsyncClient per event loop with the same pool
+size, timeout and retries as the session. Requests waiting for the rate governor wait
+on an asyncio lock, only the first of them occupies a thread in governor.acquire.
+"""
+RETRY_STATUS = (500, 502, 503, 504)
+_async_client: httpx.AsyncClient | None = None
+_async_loop: asyncio.AbstractEventLoop | None = None
+_governor_locks: Dict[asyncio.AbstractEventLoop, asyncio.Lock] = {}
+
+
+class GovernedRetry(Retry):
+    """
+    Retry that takes a token from the rate governor before every retried attempt, the
+    first attempt is charged in api_call. Intermediate responses are observed so their
+    rate limit headers are not lost.
+    """
+
+    def sleep(self, response: Any = None) -> None:
+        if response is not None:
+            governor.observe(response.headers, response.status)
+        super().sleep(response)
+        governor.acquire()
+
 
 def requests_retry_session(
     retries: int = 3,
     backoff_factor: float = 1.5,
-    status_forcelist: Tuple[int, int, int, int] = (500, 502, 503, 504),
+    status_forcelist: Tuple[int, int, int, int] = RETRY_STATUS,
     session: requests.Session | None = None,
+    pool_size: int = HYDAPI_POOL_SIZE,
 ) -> requests.Session:
     session = session or requests.Session()
     # Replace type Any with callable
-    retry: Any = Retry(
+    retry: Any = GovernedRetry(
         total=retries,
         read=retries,
         connect=retries,
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(
+        max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size
+    )
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     return session
 
 
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests_retry_session()
+                session.headers.update({"Connection": "keep-alive"})
+                _session = session
+    return _session
+
+
+def close_session() -> None:
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
 def api_call(url: str) -> Dict[str, Any] | None:
     api_key = os.getenv("API_KEY")
     request_header = {
@@ -35,11 +101,11 @@ def api_call(url: str) -> Dict[str, Any] | None:
         "X-API-Key": api_key,
     }
     try:
-        response = requests_retry_session().get(url, headers=request_header)
-
-        if response.headers.get("X-Rate-Limit-Remaining"):
-            if int(response.headers.get("X-Rate-Limit-Remaining", 0)) == 0:
-                sleep(0.5)
+        governor.acquire()
+        response = get_session().get(
+            url, headers=request_header, timeout=HYDAPI_TIMEOUT
+        )
+        governor.observe(response.headers, response.status_code)
 
         if not response.status_code == 200:
             return None
@@ -49,3 +115,88 @@ def api_call(url: str) -> Dict[str, Any] | None:
         # replace with logging module and httperror
         print(f"Error calling api: {e}")
         return None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client, _async_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_loop is not loop:
+        _async_client = httpx.AsyncClient(
+            timeout=HYDAPI_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=HYDAPI_POOL_SIZE,
+                max_keepalive_connections=HYDAPI_POOL_SIZE,
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=3),
+        )
+        _async_loop = loop
+    return _async_client
+
+
+async def close_async_client() -> None:
+    global _async_client, _async_loop
+    if _async_client is not None and _async_loop is asyncio.get_running_loop():
+        await _async_client.aclose()
+    _async_client = None
+    _async_loop = None
+
+
+async def acquire_async() -> None:
+    if governor.try_acquire():
+        return
+    loop = asyncio.get_running_loop()
+    lock = _governor_locks.get(loop)
+    if lock is None:
+        _governor_locks.clear()
+        lock = _governor_locks[loop] = asyncio.Lock()
+    async with lock:
+        await asyncio.to_thread(governor.acquire)
+
+
+def retry_after(headers: Any) -> float | None:
+    """
+    Seconds to wait from a Retry-After header, in seconds or as an HTTP date.
+    """
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+async def api_call_async(
+    url: str, retries: int = 3, backoff_factor: float = 1.5
+) -> Dict[str, Any] | None:
+    """
+    api_call for the event loop. Connection errors are retried by the transport,
+    RETRY_STATUS responses after Retry-After or the backoff of the session. Every
+    attempt takes a token from the rate governor.
+    """
+    request_header = {
+        "Accept": "application/json",
+        "X-API-Key": os.getenv("API_KEY") or "",
+    }
+    client = get_async_client()
+    try:
+        for attempt in range(retries + 1):
+            await acquire_async()
+            response = await client.get(url, headers=request_header)
+            governor.observe(response.headers, response.status_code)
+            if response.status_code not in RETRY_STATUS or attempt == retries:
+                break
+            delay = retry_after(response.headers)
+            await asyncio.sleep(backoff_factor * 2**attempt if delay is None else delay)
+
+        if not response.status_code == 200:
+            return None
+
+        return response.json()
+    except httpx.HTTPError as e:
+        logger.warning(f"Error calling api: {e}")
+        return None
@@ -0,0 +1,81 @@
+"""
+Microbenchmark of figure construction for the line plots, the plotly express path used
+before against the WebGL traces built directly from the columnar arrays.
+Run from the backend folder: python benchmarks/bench_figure.py
+"""
+
+from typing import Any, Dict, List
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+import plotly.express as px  # type: ignore
+from plotly.graph_objs import Figure  # type: ignore
+from plotly.subplots import make_subplots  # type: ignore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from downsample import downsample  # noqa: E402
+from plottypes import ParametersAll  # noqa: E402
+
+
+def station_series(parameters: int, points: int) -> Dict[str, Any]:
+    times = np.datetime64("2023-01-01T00:00") + np.arange(points).astype(
+        "timedelta64[m]"
+    )
+    station: Dict[str, Any] = {"stationId": "1.15.0"}
+    for para in range(parameters):
+        station[f"Parameter{para}_value_time"] = times
+        station[f"Parameter{para}_value"] = 10 + np.sin(np.arange(points) / 100 + para)
+    return station
+
+
+def legacy_figure(station: Dict[str, Any]) -> Figure:
+    station = dict(station)
+    station.pop("stationId")
+    df_series = pd.DataFrame(
+        {name: pd.Series(column) for name, column in station.items()}
+    )
+    parameters = [str(x) for x in df_series.columns if x.endswith("value")]
+    fig = make_subplots(
+        rows=len(parameters),
+        cols=1,
+        subplot_titles=([str(x).removesuffix("_value") for x in parameters]),
+    )
+    for inc, para in enumerate(parameters, start=1):
+        df_line = df_series[[f"{para}_time", para]].dropna()
+        x, y = downsample(df_line[f"{para}_time"].to_numpy(), df_line[para].to_numpy())
+        fig.append_trace(
+            px.line(x=x, y=y, markers=True)["data"][0], row=inc, col=1  # type: ignore
+        )
+    return fig.update_layout(  # type: ignore
+        height=(100 + (200 * len(parameters))),
+        width=900,
+        title_text="All parameters for Femsjø",
+        template="seaborn",
+    )
+
+
+def webgl_figure(station: Dict[str, Any]) -> Figure:
+    plot = ParametersAll("", ["1.15.0"], None, None)  # type: ignore
+    plot.station_names = ["Femsjø"]
+    return plot.create_fig([dict(station)])
+
+
+if __name__ == "__main__":
+    # One week of minute values (downsampled) and a short 2 day 10 minute series.
+    cases: List[Any] = [(3, 7 * 24 * 60), (2, 2 * 24 * 6)]
+    for parameters, points in cases:
+        station = station_series(parameters, points)
+        webgl_figure(station)
+        runs = 5
+        legacy = min(
+            timeit.repeat(lambda: legacy_figure(station), number=1, repeat=runs)
+        )
+        webgl = min(timeit.repeat(lambda: webgl_figure(station), number=1, repeat=runs))
+        print(
+            f"{parameters} parameters x {points} points: "
+            f"legacy {legacy * 1000:.1f} ms, webgl {webgl * 1000:.1f} ms, "
+            f"speedup {legacy / webgl:.1f}x"
+        )
@@ -0,0 +1,83 @@
+"""
+Microbenchmark of observation parsing, the per value dict-of-lists path used before
+parse_observations against the columnar path.
+Run from the backend folder: python benchmarks/bench_parse.py
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+import os
+import sys
+import timeit
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plottypes import parse_observations  # noqa: E402
+
+
+def hydapi_response(parameters: int, points: int) -> Dict[str, Any]:
+    start = datetime(2023, 1, 1)
+    data: List[Dict[str, Any]] = []
+    for para in range(parameters):
+        data.append(
+            {
+                "stationId": "1.15.0",
+                "parameterName": f"Parameter{para}",
+                "observations": [
+                    {
+                        "time": (start + timedelta(minutes=inc)).strftime(
+                            "%Y-%m-%dT%H:%M:%S.0000000Z"
+                        ),
+                        "value": 10 + (inc % 100) / 10,
+                        "correction": 0,
+                        "quality": 2,
+                    }
+                    for inc in range(points)
+                ],
+            }
+        )
+    return {"data": data}
+
+
+def legacy_parse(observations: Dict[str, Any]) -> pd.DataFrame:
+    obs: Dict[str, Any] = {}
+
+    def pop_obs(name: str, value: float | str) -> None:
+        if name not in obs:
+            obs[name] = []
+        obs[name].append(value)
+
+    for observation in observations["data"]:
+        obs["stationId"] = observation.get("stationId")
+        param_name_value_time = f"{observation.get('parameterName')}_value_time"
+        param_name_value = f"{observation.get('parameterName')}_value"
+        if observation.get("observations"):
+            for timeseries in observation.get("observations"):
+                if timeseries.get("value"):
+                    pop_obs(param_name_value, float(timeseries.get("value")))
+                    pop_obs(param_name_value_time, timeseries.get("time"))
+    obs.pop("stationId")
+    return pd.DataFrame.from_dict(obs, orient="index").transpose()
+
+
+def columnar_parse(observations: Dict[str, Any]) -> Dict[str, Any]:
+    return parse_observations(observations)
+
+
+if __name__ == "__main__":
+    # One week of minute values for 4 parameters, and a short 2 day 10 minute series.
+    for parameters, points in [(4, 7 * 24 * 60), (2, 2 * 24 * 6)]:
+        response = hydapi_response(parameters, points)
+        runs = 5
+        legacy = min(
+            timeit.repeat(lambda: legacy_parse(response), number=1, repeat=runs)
+        )
+        columnar = min(
+            timeit.repeat(lambda: columnar_parse(response), number=1, repeat=runs)
+        )
+        print(
+            f"{parameters} parameters x {points} points: "
+            f"legacy {legacy * 1000:.1f} ms, columnar {columnar * 1000:.1f} ms, "
+            f"speedup {legacy / columnar:.1f}x"
+        )
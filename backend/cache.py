@@ -0,0 +1,297 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Tuple, Type
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+"""
+Cache for hydapi observation responses.
+Responses are keyed on station, parameter list, reference time and resolution, expire after
+a TTL and are evicted least recently used when the cache holds more than max_entries.
+Backend is selected with OBSERVATION_CACHE: "memory" (default), "redis" or "none".
+"""
+CACHE_BACKEND = os.getenv("OBSERVATION_CACHE", "memory")
+CACHE_TTL = float(os.getenv("OBSERVATION_CACHE_TTL", "60"))
+CACHE_SIZE = int(os.getenv("OBSERVATION_CACHE_SIZE", "256"))
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+# A miss is cheaper than waiting for redis, commands are not retried.
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "0.5"))
+
+
+def make_key(
+    station: str, parameters: str, reference_time: str, resolution: int = 0
+) -> str:
+    # Parameter order is kept as requested, hydapi returns series in that order.
+    params = ",".join(p.strip() for p in parameters.split(",") if p.strip())
+    return f"obs:{station}:{params}:{reference_time}:{resolution}"
+
+
+class CacheBackend(ABC):
+    # Backends doing network calls, their async lookups run in a thread.
+    blocking = True
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_SIZE,
+        ttl: float = CACHE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "sets": 0,
+        }
+
+    def _count(self, counter: str, inc: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] += inc
+
+    def get(self, key: str) -> Any | None:
+        value = self._get(key)
+        self._count("misses" if value is None else "hits")
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._set(key, value)
+        self._count("sets")
+
+    async def get_async(self, key: str) -> Any | None:
+        if not self.blocking:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def set_async(self, key: str, value: Any) -> None:
+        if not self.blocking:
+            return self.set(key, value)
+        await asyncio.to_thread(self.set, key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._counters)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        stats["size"] = len(self)
+        stats["max_entries"] = self.max_entries
+        stats["ttl"] = self.ttl
+        stats["backend"] = type(self).__name__
+        return stats
+
+    @abstractmethod
+    def _get(self, key: str) -> Any | None:
+        pass
+
+    @abstractmethod
+    def _set(self, key: str, value: Any) -> None:
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+
+class NullBackend(CacheBackend):
+    """
+    Used when caching is disabled, every lookup is a miss.
+    """
+
+    blocking = False
+
+    def _get(self, key: str) -> Any | None:
+        return None
+
+    def _set(self, key: str, value: Any) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return 0
+
+
+class MemoryBackend(CacheBackend):
+    """
+    In-process LRU cache. The OrderedDict is kept in access order, oldest first.
+    """
+
+    blocking = False
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._entries: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self._entries_lock = threading.Lock()
+
+    def _get(self, key: str) -> Any | None:
+        with self._entries_lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= self.clock():
+                del self._entries[key]
+                expired = True
+            else:
+                self._entries.move_to_end(key)
+                expired = False
+        if expired:
+            self._count("expirations")
+            return None
+        return value
+
+    def _set(self, key: str, value: Any) -> None:
+        evicted = 0
+        with self._entries_lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted:
+            self._count("evictions", evicted)
+
+    def clear(self) -> None:
+        with self._entries_lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisBackend(CacheBackend):
+    """
+    Cache shared between app instances through a redis server (see redis-deployment.yml).
+    Redis expires the values itself, the sorted set keeps last access times so the
+    least recently used keys can be evicted when max_entries is exceeded.
+    Any client speaking the redis-py command interface can be passed in.
+    The client errors in errors (connection errors and timeouts) are logged and counted,
+    a lookup failing with one is a miss and a store is skipped, so a redis outage only
+    disables caching.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        *args: Any,
+        namespace: str = "nve",
+        errors: Tuple[Type[BaseException], ...] = (ConnectionError, TimeoutError),
+        **kwargs: Any,
+    ):
+        # Access times are shared between processes, so wall clock time is used.
+        kwargs.setdefault("clock", time.time)
+        super().__init__(*args, **kwargs)
+        self.client = client
+        self.namespace = namespace
+        self.index = f"{namespace}:lru"
+        self.errors = errors
+        self._counters["errors"] = 0
+
+    def _error(self, action: str, error: BaseException) -> None:
+        self._count("errors")
+        logger.warning(f"Redis {action} failed, cache skipped: {error}")
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _get(self, key: str) -> Any | None:
+        try:
+            return self._get_redis(key)
+        except self.errors as e:
+            self._error("get", e)
+            return None
+
+    def _set(self, key: str, value: Any) -> None:
+        try:
+            self._set_redis(key, value)
+        except self.errors as e:
+            self._error("set", e)
+
+    def _get_redis(self, key: str) -> Any | None:
+        redis_key = self._key(key)
+        raw = self.client.get(redis_key)
+        if raw is None:
+            # Expired by redis, drop it from the access index.
+            self.client.zrem(self.index, redis_key)
+            return None
+        self.client.zadd(self.index, {redis_key: self.clock()})
+        return json.loads(raw)
+
+    def _set_redis(self, key: str, value: Any) -> None:
+        redis_key = self._key(key)
+        self.client.set(redis_key, json.dumps(value), ex=max(1, int(self.ttl)))
+        self.client.zadd(self.index, {redis_key: self.clock()})
+        size = self.client.zcard(self.index)
+        if size > self.max_entries:
+            victims = self.client.zrange(self.index, 0, size - self.max_entries - 1)
+            if victims:
+                self.client.delete(*victims)
+                self.client.zrem(self.index, *victims)
+                self._count("evictions", len(victims))
+
+    def clear(self) -> None:
+        keys = self.client.zrange(self.index, 0, -1)
+        if keys:
+            self.client.delete(*keys)
+        self.client.delete(self.index)
+
+    def __len__(self) -> int:
+        try:
+            return int(self.client.zcard(self.index))
+        except self.errors as e:
+            self._error("zcard", e)
+            return 0
+
+
+def create_cache(
+    backend: str = CACHE_BACKEND,
+    max_entries: int = CACHE_SIZE,
+    ttl: float = CACHE_TTL,
+    namespace: str = "nve",
+) -> CacheBackend:
+    if backend == "none":
+        return NullBackend(max_entries, ttl)
+    if backend == "redis":
+        try:
+            import redis  # type: ignore
+            from redis.backoff import NoBackoff  # type: ignore
+            from redis.retry import Retry  # type: ignore
+
+            client = redis.Redis(
+                host=REDIS_HOST,
+                port=REDIS_PORT,
+                socket_timeout=REDIS_TIMEOUT,
+                socket_connect_timeout=REDIS_TIMEOUT,
+                retry=Retry(NoBackoff(), 0),
+            )
+            return RedisBackend(
+                client,
+                max_entries,
+                ttl,
+                namespace=namespace,
+                errors=(
+                    redis.exceptions.ConnectionError,
+                    redis.exceptions.TimeoutError,
+                ),
+            )
+        except ImportError:
+            logger.warning("redis package not installed, using in-process cache")
+    return MemoryBackend(max_entries, ttl)
+
+
+observation_cache: CacheBackend = create_cache()
@@ -0,0 +1,124 @@
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Tuple
+import hashlib
+import threading
+
+import sqlalchemy.orm as _orm
+import database
+import models
+
+"""
+Read-only in-memory index of the station/parameter catalog.
+The catalog only changes when the nightly refresh swaps in a new database, so dropdown
+lookups are served from this index instead of SQL joins. The index is rebuilt when
+database.catalog_generation changes, which happens on a database swap or when the
+catalog is loaded in this process.
+"""
+
+
+class CatalogIndex:
+    def __init__(
+        self,
+        version: int,
+        generation: int,
+        stations: List[Tuple[str, str]],
+        parameters: List[Tuple[str, str, Any]],
+    ):
+        """
+        stations is a list of (code, name), parameters a list of
+        (station code, parameter name, parameter code), both in database order.
+        """
+        self.version = version
+        self.generation = generation
+        digest = hashlib.sha1(repr((stations, parameters)).encode())
+        # Same catalog gives the same tag in every process, also without a version.
+        self.tag = f"{version}.{digest.hexdigest()[:12]}"
+
+        station_names: Dict[str, str] = {}
+        stations_all: Dict[str, str] = {}
+        for code, name in stations:
+            station_names[code] = name
+            stations_all[name] = code
+
+        parameters_all: Dict[str, Any] = {}
+        by_station: Dict[str, Dict[str, Any]] = {}
+        by_parameter: Dict[str, Dict[str, str]] = {}
+        for station_code, name, code in parameters:
+            parameters_all[name] = code
+            by_station.setdefault(station_code, {})[name] = code
+            if station_code in station_names:
+                by_parameter.setdefault(str(code), {})[
+                    station_names[station_code]
+                ] = station_code
+
+        self._station_names = MappingProxyType(station_names)
+        self._stations_all = MappingProxyType(stations_all)
+        self._parameters_all = MappingProxyType(parameters_all)
+        self._by_station = MappingProxyType(
+            {code: MappingProxyType(params) for code, params in by_station.items()}
+        )
+        self._by_parameter = MappingProxyType(
+            {code: MappingProxyType(names) for code, names in by_parameter.items()}
+        )
+
+    def etag(self, *parts: Any) -> str:
+        """
+        Strong ETag of a response derived from the catalog, parts are the request
+        arguments the response depends on.
+        """
+        key = hashlib.sha1(repr(parts).encode()).hexdigest()[:8]
+        return f'"{self.tag}-{key}"'
+
+    def station_name(self, code: str) -> str | None:
+        return self._station_names.get(code)
+
+    def stations_all(self) -> Mapping[str, str]:
+        return self._stations_all
+
+    def parameters_all(self) -> Mapping[str, Any]:
+        return self._parameters_all
+
+    def parameters_for_station(self, station: str) -> Mapping[str, Any]:
+        return self._by_station.get(station, MappingProxyType({}))
+
+    def stations_for_parameter(self, parameter: str) -> Mapping[str, str]:
+        return self._by_parameter.get(str(parameter), MappingProxyType({}))
+
+
+def load_index(db: _orm.Session, generation: int) -> CatalogIndex:
+    stations = (
+        db.query(models.Station.code, models.Station.name)
+        .order_by(models.Station.id)
+        .all()
+    )
+    parameters = (
+        db.query(models.Station.code, models.Parameter.name, models.Parameter.code)
+        .join(models.Station, models.Parameter.station_id == models.Station.id)
+        .order_by(models.Parameter.id)
+        .all()
+    )
+    return CatalogIndex(
+        models.CatalogVersion.latest(db),
+        generation,
+        [(code, name) for code, name in stations],
+        [(station_code, name, code) for station_code, name, code in parameters],
+    )
+
+
+_index: CatalogIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_index(db: _orm.Session) -> CatalogIndex:
+    """
+    Return the current index, only touching the database when it must be rebuilt.
+    """
+    global _index
+    index = _index
+    generation = database.catalog_generation
+    if index is not None and index.generation == generation:
+        return index
+    with _index_lock:
+        if _index is None or _index.generation != generation:
+            _index = load_index(db, generation)
+        return _index
@@ -0,0 +1,103 @@
+from typing import Any, Dict, List
+import io
+
+import numpy as np
+import plotly as pt  # type: ignore
+
+try:
+    import pyarrow as pa  # type: ignore
+except ImportError:
+    pa = None
+
+"""
+Observations as columns for clients rendering the plots themselves.
+JSON holds per station and parameter a time column (milliseconds since epoch, UTC) and
+a value column. Arrow IPC (stream format, needs pyarrow) is one long table with the
+columns station, station_name, parameter, time and value.
+"""
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def epoch_ms(times: np.ndarray) -> np.ndarray:
+    return times.astype("datetime64[ms]").astype(np.int64)
+
+
+def series_columns(
+    observation_list: List[Dict[str, Any]], station_names: List[str | None]
+) -> Dict[str, Any]:
+    stations: List[Dict[str, Any]] = []
+    for station, name in zip(observation_list, station_names):
+        series: Dict[str, Any] = {}
+        for column in station:
+            if not column.endswith("_value"):
+                continue
+            series[column.removesuffix("_value")] = {
+                "time": epoch_ms(station[f"{column}_time"]),
+                "value": station[column],
+            }
+        stations.append(
+            {"stationId": station["stationId"], "name": name, "series": series}
+        )
+    return {"stations": stations}
+
+
+def to_json(
+    observation_list: List[Dict[str, Any]],
+    station_names: List[str | None],
+    engine: str = "auto",
+) -> str:
+    return pt.io.json.to_json_plotly(  # type: ignore
+        series_columns(observation_list, station_names), pretty=False, engine=engine
+    )
+
+
+def to_arrow(
+    observation_list: List[Dict[str, Any]], station_names: List[str | None]
+) -> bytes:
+    """
+    Arrow IPC stream of the observations, station and parameter columns are
+    dictionary encoded.
+    """
+    codes: List[str] = []
+    names: List[str | None] = []
+    parameters: List[str] = []
+    station_index: List[np.ndarray] = []
+    parameter_index: List[np.ndarray] = []
+    times: List[np.ndarray] = [np.array([], dtype="datetime64[ms]")]
+    values: List[np.ndarray] = [np.array([], dtype=np.float64)]
+    for station, name in zip(observation_list, station_names):
+        codes.append(station["stationId"])
+        names.append(name)
+        for column in station:
+            if not column.endswith("_value"):
+                continue
+            parameter = column.removesuffix("_value")
+            if parameter not in parameters:
+                parameters.append(parameter)
+            length = len(station[column])
+            station_index.append(np.full(length, len(codes) - 1, dtype=np.int32))
+            parameter_index.append(
+                np.full(length, parameters.index(parameter), dtype=np.int32)
+            )
+            times.append(station[f"{column}_time"].astype("datetime64[ms]"))
+            values.append(station[column])
+
+    station_indices = pa.array(np.concatenate([np.array([], np.int32)] + station_index))
+    table = pa.table(
+        {
+            "station": pa.DictionaryArray.from_arrays(station_indices, pa.array(codes)),
+            "station_name": pa.DictionaryArray.from_arrays(
+                station_indices, pa.array(names, type=pa.string())
+            ),
+            "parameter": pa.DictionaryArray.from_arrays(
+                pa.array(np.concatenate([np.array([], np.int32)] + parameter_index)),
+                pa.array(parameters, type=pa.string()),
+            ),
+            "time": pa.array(np.concatenate(times)).cast(pa.timestamp("ms", tz="UTC")),
+            "value": pa.array(np.concatenate(values)),
+        }
+    )
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
@@ -0,0 +1,116 @@
+from typing import List, Set
+import gzip
+import os
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+"""
+Response compression. Bodies of at least COMPRESSION_MINIMUM_SIZE bytes are compressed
+with brotli when the client accepts it and the brotli package is installed, otherwise
+with gzip. Streamed responses and the media types in COMPRESSION_EXCLUDED are sent as
+they are, so every chunk reaches the client as soon as it is written.
+A strong ETag is made weak on compressed responses, the compressed body is not byte for
+byte the identity body the ETag was computed for.
+"""
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1000"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_EXCLUDED = ["text/event-stream", "application/x-ndjson"]
+
+
+def parse_quality(params: List[str]) -> float:
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def select_encoding(accept_encoding: str) -> str | None:
+    accepted: Set[str] = set()
+    for part in accept_encoding.split(","):
+        coding, *params = part.split(";")
+        if parse_quality(params) > 0:
+            accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def weaken_etag(headers: MutableHeaders) -> None:
+    etag = headers.get("ETag")
+    if etag is not None and not etag.startswith("W/"):
+        headers["ETag"] = f"W/{etag}"
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+        excluded_media_types: List[str] = COMPRESSION_EXCLUDED,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.excluded_media_types = excluded_media_types
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = select_encoding(Headers(scope=scope).get("Accept-Encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        initial_message: Message = {}
+        started = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal initial_message, started
+            if message["type"] == "http.response.start":
+                # Held back until the first body message shows whether to compress.
+                initial_message = message
+                return
+            if message["type"] != "http.response.body" or started:
+                await send(message)
+                return
+            started = True
+            headers = MutableHeaders(raw=initial_message["headers"])
+            body = message.get("body", b"")
+            media_type = headers.get("Content-Type", "").split(";")[0].strip()
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or media_type in self.excluded_media_types
+                or "Content-Encoding" in headers
+            ):
+                await send(initial_message)
+                await send(message)
+                return
+            body = compress(body, encoding)
+            weaken_etag(headers)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(initial_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,58 @@
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+"""
+Correlation of the parameters of a station, computed on the output of align.align.
+All pairs are computed at once with matrix products over the observed values, a pair
+only uses the rows where both parameters have a value. Spearman is Pearson on the
+ranks of every parameter's own observations. Pairs with fewer than MIN_PAIRS common
+rows or without variation are NaN.
+"""
+MIN_PAIRS = 3
+
+
+def pairwise_pearson(values: np.ndarray) -> np.ndarray:
+    """
+    Pearson correlation of the columns of values (rows x parameters), NaN is missing.
+    """
+    observed = ~np.isnan(values)
+    mask = observed.astype(np.float64)
+    # Centered first, the sums of products then do not cancel out for large values.
+    # Columns without observations are centered on 0 to keep nanmean quiet.
+    centers = np.nanmean(np.where(observed.any(axis=0), values, 0.0), axis=0)
+    filled = np.where(observed, values - centers, 0.0)
+    count = mask.T @ mask
+    sums = filled.T @ mask  # sums[i, j]: sum of column i where j is observed
+    squares = (filled**2).T @ mask
+    products = filled.T @ filled
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = products - sums * sums.T / count
+        variance = squares - sums**2 / count
+        result = covariance / np.sqrt(variance * variance.T)
+    result[count < MIN_PAIRS] = np.nan
+    np.fill_diagonal(result, np.where(np.isnan(np.diag(result)), np.nan, 1.0))
+    return np.clip(result, -1.0, 1.0)
+
+
+def correlation_matrix(aligned: pd.DataFrame, method: str = "pearson") -> pd.DataFrame:
+    columns = [str(x) for x in aligned.columns if str(x).endswith("_value")]
+    frame = aligned[columns]
+    if method == "spearman":
+        frame = frame.rank()
+    values = pairwise_pearson(frame.to_numpy(dtype=np.float64))
+    return pd.DataFrame(values, index=columns, columns=columns)
+
+
+def top_pairs(matrix: pd.DataFrame, k: int) -> List[Tuple[str, str, float]]:
+    """
+    The k parameter pairs with the strongest correlation, either sign.
+    """
+    upper = np.triu_indices(len(matrix), k=1)
+    values = matrix.to_numpy()[upper]
+    order = [inc for inc in np.argsort(-np.abs(values)) if not np.isnan(values[inc])]
+    return [
+        (matrix.index[upper[0][inc]], matrix.columns[upper[1][inc]], values[inc])
+        for inc in order[:k]
+    ]
@@ -1,12 +1,15 @@
-from typing import Iterator
+from typing import Iterator, Tuple
 import sqlalchemy as _sql
 import sqlalchemy.ext.declarative as _declarative
 import sqlalchemy.orm as _orm
+import os
 import shutil
+import threading
 
 DATABASE_URL = "sqlite:///db/database.db"
 DATABASE_PATH = "./db/database.db"
 DATABASE_PATH_COPY = "./db/database_copy.db"
+DATABASE_PATH_SHADOW = "./db/database_shadow.db"
 
 # For production create user and password as anvironmental variables.
 # This should be fetched from env variables in docker file
@@ -14,21 +17,87 @@ DATABASE_PATH_COPY = "./db/database_copy.db"
 # SQLALCHEMY_DATABASE_URL = "postgresql://fastapi_db:fastapi_db@db:5432/fastapi_db"
 # engine = _sql.create_engine(SQLALCHEMY_DATABASE_URL)
 
-engine = _sql.create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+def create_engine(path: str) -> _sql.Engine:
+    return _sql.create_engine(
+        f"sqlite:///{path}", connect_args={"check_same_thread": False}
+    )
+
+
+engine = create_engine(DATABASE_PATH)
 SessionLocal = _orm.sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = _declarative.declarative_base()
 
+"""
+The nightly refresh builds a new catalog in DATABASE_PATH_SHADOW and renames it over
+DATABASE_PATH. Open connections keep reading the old file until they are returned, new
+sessions are bound to an engine on the new file. catalog_generation is bumped on every
+swap so in-memory users of the catalog know when to reload.
+"""
+catalog_generation = 0
+_swap_lock = threading.Lock()
+
+
+def _file_identity(path: str) -> Tuple[int, int] | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+_db_identity = _file_identity(DATABASE_PATH)
+
 
 def backup_db() -> None:
-    shutil.copy(DATABASE_PATH, DATABASE_PATH_COPY)
+    if os.path.exists(DATABASE_PATH):
+        shutil.copy(DATABASE_PATH, DATABASE_PATH_COPY)
+
+
+def swap_in(shadow_path: str = DATABASE_PATH_SHADOW) -> None:
+    """
+    Atomically replace the live database file with a completed shadow database.
+    """
+    os.replace(shadow_path, DATABASE_PATH)
+
+
+def mark_catalog_changed() -> None:
+    global catalog_generation
+    with _swap_lock:
+        catalog_generation += 1
+
+
+def reload_if_swapped() -> bool:
+    """
+    Rebind SessionLocal to a new engine if the database file has been swapped.
+    Only a stat of the file when nothing changed, reads are never blocked.
+    """
+    global engine, _db_identity, catalog_generation
+    identity = _file_identity(DATABASE_PATH)
+    if identity is None or identity == _db_identity:
+        return False
+    with _swap_lock:
+        if identity == _db_identity:
+            return False
+        old_engine = engine
+        engine = create_engine(DATABASE_PATH)
+        SessionLocal.configure(bind=engine)
+        _db_identity = identity
+        catalog_generation += 1
+    # Checked out connections are closed when returned to the old pool.
+    old_engine.dispose()
+    return True
 
 
 def create_database():
-    return Base.metadata.create_all(bind=engine)
+    global _db_identity
+    Base.metadata.create_all(bind=engine)
+    _db_identity = _file_identity(DATABASE_PATH)
 
 
 def get_db() -> Iterator[_orm.Session]:
+    reload_if_swapped()
     db = SessionLocal()
     try:
         yield db
@@ -0,0 +1,92 @@
+from typing import Tuple
+import os
+
+import numpy as np
+
+"""
+Downsampling of line traces before they are added to a figure.
+PLOT_MAX_POINTS is the target number of points per trace, 0 disables downsampling.
+PLOT_DOWNSAMPLE selects the method, "lttb" (Largest-Triangle-Three-Buckets, default)
+keeps the visual shape, "minmax" keeps the extremes of every bucket.
+"""
+PLOT_MAX_POINTS = int(os.getenv("PLOT_MAX_POINTS", "2000"))
+PLOT_DOWNSAMPLE = os.getenv("PLOT_DOWNSAMPLE", "lttb")
+
+
+def _as_float(x: np.ndarray) -> np.ndarray:
+    if x.dtype.kind == "M":
+        return x.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Return the indices of the points selected by Largest-Triangle-Three-Buckets.
+    First and last points are always kept, x must be sorted.
+    """
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    xf = _as_float(x)
+    yf = y.astype(np.float64)
+    # Bucket edges for the points between first and last.
+    edges = np.linspace(1, length - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = length - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+        else:
+            next_start, next_end = length - 1, length
+        avg_x = xf[next_start:next_end].mean()
+        avg_y = yf[next_start:next_end].mean()
+        # Twice the triangle area, the constant factor does not change the argmax.
+        area = np.abs(
+            (xf[previous] - avg_x) * (yf[start:end] - yf[previous])
+            - (xf[previous] - xf[start:end]) * (avg_y - yf[previous])
+        )
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Return the indices of the min and max point of threshold // 2 buckets, in x order.
+    """
+    length = len(x)
+    buckets = threshold // 2
+    if threshold >= length or buckets < 1:
+        return np.arange(length)
+
+    edges = np.linspace(0, length, buckets + 1).astype(np.int64)
+    yf = y.astype(np.float64)
+    mins = np.minimum.reduceat(yf, edges[:-1])
+    maxs = np.maximum.reduceat(yf, edges[:-1])
+    indices = []
+    for bucket in range(buckets):
+        start, end = edges[bucket], edges[bucket + 1]
+        values = yf[start:end]
+        indices.append(start + int(np.argmax(values == mins[bucket])))
+        indices.append(start + int(np.argmax(values == maxs[bucket])))
+    return np.unique(np.array(indices, dtype=np.int64))
+
+
+def downsample(
+    x: np.ndarray,
+    y: np.ndarray,
+    threshold: int = PLOT_MAX_POINTS,
+    method: str = PLOT_DOWNSAMPLE,
+) -> Tuple[np.ndarray, np.ndarray]:
+    if threshold <= 0 or len(x) <= threshold:
+        return x, y
+    if method == "minmax":
+        indices = minmax(x, y, threshold)
+    else:
+        indices = lttb(x, y, threshold)
+    return x[indices], y[indices]
@@ -1,4 +1,8 @@
-from typing import Dict  # Import typing modules for static type check
+from typing import Any, Dict  # Import typing modules for static type check
+from concurrent.futures import Future
+import asyncio
+import hashlib
+import os
 import fastapi as _fastapi
 from fastapi import HTTPException
 
@@ -8,10 +12,21 @@ from dotenv import load_dotenv
 import schemas
 import services
 import database
+import cache
+import api
+import ratelimit
+import catalog
+import timerange
+import scheduler
+import plottypes
+import columnar
+import summaries
+from compression import CompressionMiddleware
 
 import sqlalchemy.orm as _orm
 
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 
 """
 TODO:
@@ -48,6 +63,17 @@ NB: When this is run from a container then this is not needed, use the app.env f
 """
 load_dotenv()
 
+"""
+Station, parameter and timerange lists only change with the nightly catalog refresh.
+Browsers and the ingress may reuse them for CATALOG_MAX_AGE seconds, after that they
+are revalidated with the ETag.
+"""
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", "3600"))
+CATALOG_CACHE_CONTROL = f"public, max-age={CATALOG_MAX_AGE}"
+TIMERANGE_ETAG = (
+    f'"{hashlib.sha1(repr(timerange.TIMERANGES).encode()).hexdigest()[:12]}"'
+)
+
 """
 Populate database with stations and parameters
 This part will be in a cron job that updates stations and parameter db daily.
@@ -71,74 +97,245 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+
+
+# Prewarming runs on the event loop of the app so it shares renders with /api/series.
+app_loop: asyncio.AbstractEventLoop | None = None
+prewarm_future: Future | None = None
+
+
+async def prewarm_figures_async() -> None:
+    with database.SessionLocal() as db:
+        await services.prewarm_figures(db)
+
+
+def prewarm_figures() -> None:
+    global prewarm_future
+    if app_loop is None:
+        return
+    database.reload_if_swapped()
+    prewarm_future = asyncio.run_coroutine_threadsafe(prewarm_figures_async(), app_loop)
+    prewarm_future.result()
+
+
+prewarm_task = scheduler.PeriodicTask(
+    "prewarm_figures", services.PREWARM_INTERVAL, prewarm_figures
+)
+prefetch_task = scheduler.PeriodicTask(
+    "prefetch_series", plottypes.PREFETCH_INTERVAL, plottypes.prefetch_series
+)
+
+
+@app.on_event("startup")
+def startup() -> None:
+    global app_loop
+    app_loop = asyncio.get_running_loop()
+    with database.SessionLocal() as db:
+        catalog.get_index(db)
+    if services.PREWARM_TOP_N > 0:
+        prewarm_task.start()
+    if plottypes.PREFETCH_TOP_N > 0:
+        prefetch_task.start()
+
+
+@app.on_event("shutdown")
+def shutdown() -> None:
+    # The loop is blocked until shutdown returns, a running prewarm cannot finish.
+    if prewarm_future is not None:
+        prewarm_future.cancel()
+    prewarm_task.stop()
+    prefetch_task.stop()
+    api.close_session()
+
+
+@app.on_event("shutdown")
+async def close_async_client() -> None:
+    await api.close_async_client()
+
+
+def conditional_response(
+    request: _fastapi.Request, etag: str, content: Dict[str, Any]
+) -> _fastapi.Response:
+    """
+    Catalog responses only change when the catalog does. A request repeating the ETag
+    in If-None-Match gets a 304 without body.
+    """
+    headers = {"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL}
+    if_none_match = request.headers.get("If-None-Match", "")
+    if if_none_match.strip() == "*" or etag in [
+        tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+    ]:
+        return _fastapi.Response(status_code=304, headers=headers)
+    return JSONResponse(content=content, headers=headers)
 
 
 @app.post("/api/stations")
 def stations(
     station_obj: schemas.ParametersOnly,
+    request: _fastapi.Request,
     db: _orm.Session = _fastapi.Depends(database.get_db),
-) -> Dict[str, str]:
+) -> _fastapi.Response:
+    # ETag before the content, a catalog swap in between can then only give a
+    # stale ETag with new content, never the other way around.
+    etag = services.catalog_etag(db, "stations", station_obj.parameter)
     all_stations = services.get_stations(station_obj.parameter, db)
     if all_stations == {}:
         raise HTTPException(
             status_code=400, detail=str("List of stations not returned from db")
         )
-    return all_stations
+    return conditional_response(request, etag, all_stations)
 
 
 @app.post("/api/parameters", response_model=dict)
 def parameters(
     station_obj: schemas.StationBase,
+    request: _fastapi.Request,
     db: _orm.Session = _fastapi.Depends(database.get_db),
-) -> Dict[str, int]:
+) -> _fastapi.Response:
+    etag = services.catalog_etag(db, "parameters", station_obj.station)
     all_params = services.get_parameters(station_obj.station, db)
     if all_params == {}:
         raise HTTPException(
             status_code=400, detail=str("List of parameters not returned from db")
         )
-    return all_params
+    return conditional_response(request, etag, all_params)
 
 
 @app.get("/api/parameters_all")
 def parameters_all(
+    request: _fastapi.Request,
     db: _orm.Session = _fastapi.Depends(database.get_db),
-) -> Dict[str, int]:
+) -> _fastapi.Response:
+    etag = services.catalog_etag(db, "parameters_all")
     all_params = services.get_parameters_all(db)
     if all_params == {}:
         raise HTTPException(
             status_code=400, detail=str("List of parameters not returned from db")
         )
-    return all_params
+    return conditional_response(request, etag, all_params)
 
 
 @app.get("/api/stations_all")
 def stations_all(
+    request: _fastapi.Request,
     db: _orm.Session = _fastapi.Depends(database.get_db),
-) -> Dict[str, str]:
+) -> _fastapi.Response:
+    etag = services.catalog_etag(db, "stations_all")
     all_params = services.get_stations_all(db)
     if all_params == {}:
         raise HTTPException(
             status_code=400, detail=str("List of stations not returned from db")
         )
-    return all_params
+    return conditional_response(request, etag, all_params)
 
 
 @app.get("/api/timerange")
-def all_timerange() -> Dict[str, str]:
-    timerange = {"P1D/": "1 Day", "P2D/": "2 Days", "P3D/": "3 Days", "P7D/": "1 Week"}
-    return timerange
+def all_timerange(request: _fastapi.Request) -> _fastapi.Response:
+    return conditional_response(request, TIMERANGE_ETAG, timerange.TIMERANGES)
+
+
+def check_plottype(station_obj: schemas.StationCreate) -> None:
+    if station_obj.plottype not in services.PLOT_CLASSES:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown plot type {station_obj.plottype}"
+        )
 
 
 @app.post("/api/series")
-def series(
+async def series(
     station_obj: schemas.StationCreate,
     db: _orm.Session = _fastapi.Depends(database.get_db),
 ):
     """
     Error handling for this function is handled in the service part of the code.
     Meaning plot is always returned, but could contain error string if no obs exist.
+    The figure is already serialized, it is returned as is instead of as a JSON string.
+    Runs on the event loop, a request waiting for hydapi does not hold a thread.
+    """
+    check_plottype(station_obj)
+    return _fastapi.Response(
+        content=await services.render_plot_async(station_obj, db),
+        media_type="application/json",
+    )
+
+
+@app.post("/api/series/stream")
+def series_stream(
+    station_obj: schemas.StationCreate,
+    db: _orm.Session = _fastapi.Depends(database.get_db),
+) -> StreamingResponse:
     """
-    return services.create_plot(station_obj, db)
+    Newline delimited JSON messages, see StationsCompare.stream_fig. For
+    "Stations compare" each station is sent as soon as it is fetched.
+    """
+    check_plottype(station_obj)
+    return StreamingResponse(
+        services.stream_plot(station_obj, db), media_type="application/x-ndjson"
+    )
+
+
+@app.post("/api/data")
+def data(
+    station_obj: schemas.StationCreate,
+    request: _fastapi.Request,
+    format: str | None = None,
+    db: _orm.Session = _fastapi.Depends(database.get_db),
+) -> _fastapi.Response:
+    """
+    Observations for the same selection as /api/series as columns instead of a
+    figure. Arrow IPC is returned for format=arrow or an Accept header asking for it.
+    """
+    arrow = format == "arrow" or columnar.ARROW_MEDIA_TYPE in request.headers.get(
+        "Accept", ""
+    )
+    if arrow and columnar.pa is None:
+        raise HTTPException(status_code=406, detail="Arrow format is not available")
+    observation_list, names = services.get_data(station_obj, db)
+    if not observation_list:
+        raise HTTPException(status_code=404, detail="No data returned from API")
+    if arrow:
+        return _fastapi.Response(
+            content=columnar.to_arrow(observation_list, names),
+            media_type=columnar.ARROW_MEDIA_TYPE,
+        )
+    return _fastapi.Response(
+        content=columnar.to_json(observation_list, names, plottypes.PLOT_JSON_ENGINE),
+        media_type="application/json",
+    )
+
+
+@app.post("/api/statistics")
+def statistics(request: schemas.StatisticsRequest) -> _fastapi.Response:
+    """
+    Daily count, sum, min, mean, max, percentiles and rolling mean per station,
+    parameter and day, as columns of equal length.
+    """
+    table = services.get_statistics(request)
+    if table is None:
+        raise HTTPException(status_code=404, detail="No data returned from API")
+    return _fastapi.Response(
+        content=plottypes.message_json(table), media_type="application/json"
+    )
+
+
+@app.get("/api/metrics")
+def metrics() -> Dict[str, Any]:
+    return {
+        "observation_cache": cache.observation_cache.stats(),
+        "rate_governor": ratelimit.governor.stats(),
+        "series_singleflight": services.series_flight.stats(),
+        "series_singleflight_async": services.series_flight_async.stats(),
+        "figure_cache": services.figure_cache.stats(),
+        "summary_cache": summaries.summary_cache.stats(),
+        "prewarm": dict(
+            prewarm_task.stats(), tracked_requests=len(services.request_tracker)
+        ),
+        "prefetch": dict(
+            prefetch_task.stats(), tracked_series=len(plottypes.series_tracker)
+        ),
+        "catalog_generation": database.catalog_generation,
+    }
 
 
 @app.get("/")
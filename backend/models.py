@@ -21,3 +21,19 @@ class Parameter(_database.Base):
     code = _sql.Column(_sql.String, index=True)
 
     owner = _orm.relationship("Station", back_populates="param")
+
+
+class CatalogVersion(_database.Base):
+    """
+    One row per catalog change, written by populate_db when stations or parameters
+    are inserted, updated or deleted.
+    """
+
+    __tablename__ = "catalog_versions"
+    version = _sql.Column(_sql.Integer, primary_key=True)
+    created = _sql.Column(_sql.DateTime)
+    summary = _sql.Column(_sql.String)
+
+    @classmethod
+    def latest(cls, db: _orm.Session) -> int:
+        return db.query(_sql.func.max(cls.version)).scalar() or 0
@@ -1,6 +1,16 @@
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Tuple
-
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Tuple
+import asyncio
+import base64
+import copy
+import json
+import logging
+import os
+
+import numpy as np
 import pandas as pd
 import plotly.express as px  # type: ignore
 from plotly.subplots import make_subplots  # type: ignore
@@ -9,8 +19,58 @@ import plotly as pt  # type: ignore
 
 import sqlalchemy.orm as _orm
 import schemas
-import models
-from api import api_call
+import align
+import cache
+import correlation
+import catalog
+import timerange
+import tsstore
+import ratelimit
+from api import api_call, api_call_async
+from popularity import FrequencyTracker
+from downsample import PLOT_MAX_POINTS, downsample
+
+logger = logging.getLogger(__name__)
+
+"""
+Observations for multi station plots are fetched in parallel, SERIES_MAX_WORKERS bounds
+the number of concurrent hydapi calls for the whole process.
+"""
+SERIES_MAX_WORKERS = int(os.getenv("SERIES_MAX_WORKERS", "4"))
+series_executor = ThreadPoolExecutor(
+    max_workers=SERIES_MAX_WORKERS, thread_name_prefix="series"
+)
+# Stations of one request queued on the series executor at the same time.
+SERIES_REQUEST_MAX_PARALLEL = int(
+    os.getenv("SERIES_REQUEST_MAX_PARALLEL", str(SERIES_MAX_WORKERS))
+)
+# Chunks of long time ranges run on their own pool, a station fetch waiting on its
+# chunks can then never starve the series executor.
+CHUNK_MAX_WORKERS = int(os.getenv("CHUNK_MAX_WORKERS", "4"))
+chunk_executor = ThreadPoolExecutor(
+    max_workers=CHUNK_MAX_WORKERS, thread_name_prefix="chunk"
+)
+
+"""
+Figures are serialized without indentation by PLOT_JSON_ENGINE ("auto" uses orjson when
+installed). PLOT_TYPED_ARRAYS=1 sends numeric arrays base64 encoded.
+"""
+PLOT_JSON_ENGINE = os.getenv("PLOT_JSON_ENGINE", "auto")
+PLOT_TYPED_ARRAYS = os.getenv("PLOT_TYPED_ARRAYS", "0") == "1"
+
+"""
+Station/parameter series requested by users are counted in series_tracker. The prefetch
+job refreshes the PREFETCH_TOP_N most requested series every PREFETCH_INTERVAL seconds,
+before their cache entries expire, as long as the rate governor has more than
+PREFETCH_MIN_TOKENS tokens left for user requests.
+"""
+PREFETCH_TOP_N = int(os.getenv("PREFETCH_TOP_N", "20"))
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", str(0.75 * cache.CACHE_TTL)))
+PREFETCH_MIN_TOKENS = float(os.getenv("PREFETCH_MIN_TOKENS", "2"))
+series_tracker = FrequencyTracker()
+# Stored series whose newest observations were requested from hydapi within CACHE_TTL,
+# keyed by station and parameters. Bounded like the observation cache.
+_store_refreshed = cache.MemoryBackend(cache.CACHE_SIZE, cache.CACHE_TTL)
 
 
 class Plot(ABC):
@@ -26,44 +86,132 @@ class Plot(ABC):
         self.db = db
         self.station_obj = station_obj
 
+    def titles(self) -> List[str]:
+        return get_station_name(self.stations, self.db)
+
     def fetch_series(self):
-        self.station_names = get_station_name(self.stations, self.db)
+        self.station_names = self.titles()
         return get_series(self.stations, self.all_params, self.station_obj.timerange)
 
+    async def fetch_series_async(self):
+        """
+        fetch_series for the event loop without catalog lookups, station_names has to
+        be set before.
+        """
+        return await get_series_async(
+            self.stations, self.all_params, self.station_obj.timerange
+        )
+
     @abstractmethod
     def create_fig(self, observation_list: List[Dict[str, Any]]) -> Figure | None:
         pass
 
 
 class StationsCompare(Plot):
+    """
+    One parameter for any number of stations, as a subplot per station ("grid") or
+    all stations on one shared axis ("overlay", one legend entry per station).
+    """
+
+    @property
+    def overlay(self) -> bool:
+        return self.station_obj.layout == "overlay"
+
+    def titles(self) -> List[str]:
+        index = catalog.get_index(self.db)
+        return [index.station_name(code) or code for code in self.stations]
+
+    def base_layout(self, rows: int) -> Dict[str, Any]:
+        if self.overlay:
+            layout = subplot_layout([""], 1)
+            layout.update(height=600, showlegend=True)
+        else:
+            layout = subplot_layout([str(x) for x in self.station_names], rows)
+            layout["height"] = 100 + (200 * rows)
+        return layout
+
+    def station_trace(
+        self,
+        station: Dict[str, Any],
+        inc: int,
+        layout: Dict[str, Any],
+        points: List[Dict[str, Any]],
+    ) -> Tuple[Dict[str, Any] | None, str | None]:
+        """
+        Trace of the station at position inc (from 0) and the parameter name,
+        (None, None) if the station has no observations.
+        """
+        if not station:
+            if not self.overlay:
+                layout["annotations"].append(no_data_annotation(inc + 1))
+            return None, None
+        parameters = [str(x) for x in station if x.endswith("value")]
+        trace = line_trace(
+            station, parameters[0], 1 if self.overlay else inc + 1, points
+        )
+        if self.overlay:
+            trace.update(name=self.station_names[inc], showlegend=True)
+            points[-1]["station"] = self.stations[inc]
+        return trace, parameters[0].removesuffix("_value")
+
+    def finish_layout(
+        self, layout: Dict[str, Any], parameter_name: str, points: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        layout.update(
+            title={"text": f"Stations compared for {parameter_name}"},
+            meta={"points": points},
+        )
+        return layout
 
     def create_fig(self, observation_list: List[Dict[str, Any]]) -> Figure | None:
-        inc = 0
-        fig = make_subplots(
-            rows=len(observation_list),
-            cols=1,
-            subplot_titles=([str(x) for x in self.station_names]),
-        )
-        parameters_name = []
-        for station in observation_list:
+        layout = self.base_layout(len(observation_list))
+        traces: List[Dict[str, Any]] = []
+        points: List[Dict[str, Any]] = []
+        parameter_name = ""
+        for inc, station in enumerate(observation_list):
             _ = station.pop("stationId")
-            if not station:
-                inc += 1
-                continue
-            df_series = create_dataframe(station)
-            parameters, parameters_name = parameters_get_name(df_series)
-            # check if station is missing parameters.
-            if len(set(parameters)) < 0:
-                return None
-            inc += 1
-            line_plot_param(fig, df_series, parameters, inc)
-        fig: Figure = fig.update_layout(  # type: ignore difficult to type check update_layout
-            height=(100 + (200 * len(observation_list))),
-            width=900,
-            title_text=f"Stations compared for {parameters_name[0]}",
-            template="seaborn",
+            trace, name = self.station_trace(station, inc, layout, points)
+            if trace is not None:
+                traces.append(trace)
+                parameter_name = name or parameter_name
+        layout = self.finish_layout(layout, parameter_name, points)
+        return Figure(data=traces, layout=layout, _validate=False)
+
+    def stream_fig(self) -> Iterator[Dict[str, Any]]:
+        """
+        Messages for building the figure in the client while stations are fetched.
+        The layout comes first, then one trace message per station in the order the
+        stations complete, index is the position of the station in the request and
+        trace is None for a station without observations. Last is the complete layout.
+        """
+        self.station_names = self.titles()
+        layout = self.base_layout(len(self.stations))
+        yield {"type": "layout", "final": False, "layout": layout}
+
+        points: List[Dict[str, Any]] = []
+        parameter_name = ""
+        for inc, station in iter_series(
+            self.stations, self.all_params, self.station_obj.timerange
+        ):
+            station_id = station.pop("stationId")
+            trace, name = self.station_trace(station, inc, layout, points)
+            parameter_name = name or parameter_name
+            yield {
+                "type": "trace",
+                "row": inc + 1,
+                "stationId": station_id,
+                "trace": trace,
+            }
+
+        if not points:
+            yield {"type": "error", "figure": json.loads(set_error_string())}
+            return
+        order = {code: inc for inc, code in enumerate(self.stations)}
+        points.sort(
+            key=lambda point: (point["row"], order.get(point.get("station"), 0))
         )
-        return fig
+        layout = self.finish_layout(layout, parameter_name, points)
+        yield {"type": "layout", "final": True, "layout": layout}
 
 
 class ParametersCompare(Plot):
@@ -72,13 +220,13 @@ class ParametersCompare(Plot):
         fig = None
         for station in observation_list:
             _ = station.pop("stationId")
-            df_series: pd.DataFrame = create_dataframe(station, "orient")
-            df_series = df_series.transpose()  # type: ignore # transpose unknown part type
+            df_series = align.align(station)
             parameters, parameters_name = parameters_get_name(df_series)
             # check if parameters are the same or missing. Should not be necessary.
             if len(set(parameters)) < 2:
                 return None
             """ jointplot """
+            df_series = df_series.dropna(subset=parameters[:2])
             fig = scatter_plot(df_series, parameters, parameters_name)
         return fig
 
@@ -89,49 +237,125 @@ class ParameterMatrix(Plot):
         fig = None
         for station in observation_list:
             _ = station.pop("stationId")
-            df_series = create_dataframe(station, "orient")
-            df_series = df_series.transpose()  # type: ignore # transpose unknown part type
-            fig = scatter_matrix(df_series)
+            fig = scatter_matrix(align.align(station))
+        return fig
+
+
+class ParameterCorrelation(Plot):
+    """
+    Pearson and Spearman correlation of all parameters of a station as heatmaps, a
+    compact alternative to the scatter matrix. With top_k set in the request the k
+    most correlated pairs are shown as scatter plots instead.
+    """
+
+    def create_fig(self, observation_list: List[Dict[str, Any]]) -> Figure | None:
+        fig = None
+        for station in observation_list:
+            _ = station.pop("stationId")
+            aligned = align.align(station)
+            pearson = correlation.correlation_matrix(aligned, "pearson")
+            if len(pearson) < 2:
+                return None
+            if self.station_obj.top_k > 0:
+                pairs = correlation.top_pairs(pearson, self.station_obj.top_k)
+                fig = pair_scatter(aligned, pairs)
+            else:
+                spearman = correlation.correlation_matrix(aligned, "spearman")
+                fig = correlation_heatmap(pearson, spearman)
+            fig.update_layout(  # type: ignore
+                title_text=f"Parameter correlation for {self.station_names[0]}"
+            )
         return fig
 
 
 class ParametersAll(Plot):
 
     def create_fig(self, observation_list: List[Dict[str, Any]]) -> Figure | None:
-        parameters = []
+        fig = None
         for station in observation_list:
             _ = station.pop("stationId")
-            df_series = create_dataframe(station, "orient")
-            df_series = df_series.transpose()  # type: ignore # transpose unknown part type
-            parameters = [str(x) for x in df_series.columns if x.endswith("value")]
-            inc = 0
-            fig = make_subplots(
-                rows=len(parameters),
-                cols=1,
-                subplot_titles=([str(x).strip("_value") for x in parameters]),
+            parameters = [str(x) for x in station if x.endswith("value")]
+            layout = subplot_layout([x.removesuffix("_value") for x in parameters])
+            points: List[Dict[str, Any]] = []
+            traces = [
+                line_trace(station, para, inc, points)
+                for inc, para in enumerate(parameters, start=1)
+            ]
+            layout.update(
+                height=(100 + (200 * len(parameters))),
+                title={"text": f"All parameters for {self.station_names[0]}"},
+                meta={"points": points},
             )
-            for para in parameters:
-                inc += 1
-                line_plot_station(fig, df_series, para, inc)
-        fig: Figure = fig.update_layout(  # type: ignore difficult to type check update_layout
-            height=(100 + (200 * len(parameters))),
-            width=900,
-            title_text=f"All parameters for {self.station_names[0]}",
-            template="seaborn",
-        )
+            fig = Figure(data=traces, layout=layout, _validate=False)
         return fig
 
 
-def line_plot_param(
-    fig: Figure, df_series: pd.DataFrame, parameters: List[str], inc: int
-) -> Figure:
-    return fig.append_trace(  # type: ignore
-        px.line(  # type: ignore
-            df_series, x=f"{parameters[0]}_time", y=parameters[0], markers=True
-        )["data"][0],
-        row=inc,
-        col=1,
+@lru_cache(maxsize=32)
+def _subplot_grid(rows: int) -> Dict[str, Any]:
+    """
+    Layout of a one column subplot grid with a placeholder title per row.
+    """
+    grid: Figure = make_subplots(
+        rows=rows, cols=1, subplot_titles=[f"{{{row}}}" for row in range(rows)]
     )
+    return grid.layout.to_plotly_json()  # type: ignore
+
+
+@lru_cache(maxsize=1)
+def _template() -> Dict[str, Any]:
+    return pt.io.templates["seaborn"].to_plotly_json()  # type: ignore
+
+
+def subplot_layout(titles: List[str], rows: int | None = None) -> Dict[str, Any]:
+    """
+    Layout for line subplots, one row per title unless rows is given.
+    The grid is built once per number of rows by make_subplots and copied.
+    """
+    rows = len(titles) if rows is None else rows
+    layout = copy.deepcopy(_subplot_grid(rows)) if rows else {}
+    annotations = layout.get("annotations", [])
+    for inc, annotation in enumerate(annotations):
+        annotation["text"] = titles[inc] if inc < len(titles) else ""
+    layout.update(annotations=annotations, width=900, template=_template())
+    return layout
+
+
+def axis_suffix(row: int) -> str:
+    return "" if row == 1 else str(row)
+
+
+def no_data_annotation(row: int) -> Dict[str, Any]:
+    return {
+        "text": "No data returned from API",
+        "showarrow": False,
+        "x": 0.5,
+        "y": 0.5,
+        "xref": f"x{axis_suffix(row)} domain",
+        "yref": f"y{axis_suffix(row)} domain",
+    }
+
+
+def line_trace(
+    station: Dict[str, Any], para: str, row: int, points: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    WebGL line trace for a parameter of a station, reduced to at most PLOT_MAX_POINTS
+    points. The original and plotted number of points are appended to points.
+    """
+    x, y = downsample(station[f"{para}_time"], station[para])
+    points.append(
+        {"row": row, "trace": para, "original": len(station[para]), "plotted": len(x)}
+    )
+    return {
+        "type": "scattergl",
+        "x": x,
+        "y": y,
+        "mode": "lines+markers",
+        "name": para.removesuffix("_value"),
+        "showlegend": False,
+        "xaxis": f"x{axis_suffix(row)}",
+        "yaxis": f"y{axis_suffix(row)}",
+    }
 
 
 def scatter_plot(
@@ -160,96 +384,546 @@ def scatter_matrix(df_series: pd.DataFrame):
     )
 
 
-def line_plot_station(
-    fig: Figure, df_series: pd.DataFrame, para: str, inc: int
-) -> Figure:
-    return fig.append_trace(  # type: ignore
-        px.line(df_series, x=f"{para}_time", y=para, markers=True)["data"][0],  # type: ignore
-        row=inc,
-        col=1,
+def correlation_heatmap(pearson: pd.DataFrame, spearman: pd.DataFrame) -> Figure:
+    names = [str(x).removesuffix("_value") for x in pearson.columns]
+    fig = make_subplots(
+        rows=1, cols=2, subplot_titles=["Pearson", "Spearman"], horizontal_spacing=0.2
+    )
+    for col, matrix in enumerate([pearson, spearman], start=1):
+        fig.add_trace(  # type: ignore
+            {
+                "type": "heatmap",
+                "z": matrix.to_numpy(),
+                "x": names,
+                "y": names,
+                "coloraxis": "coloraxis",
+                "texttemplate": "%{z:.2f}",
+            },
+            row=1,
+            col=col,
+        )
+    fig.update_yaxes(autorange="reversed")  # type: ignore
+    return fig.update_layout(  # type: ignore
+        coloraxis={"colorscale": "RdBu", "cmin": -1, "cmax": 1},
+        height=450 + 20 * len(names),
+        width=1000,
+        template="seaborn",
     )
 
 
-def create_dataframe(station: Dict[str, Any], index: str = "None") -> pd.DataFrame:
-    if index == "orient":
-        return pd.DataFrame.from_dict(station, orient="index")
-    else:
-        return pd.DataFrame.from_dict(station)
+def pair_scatter(aligned: pd.DataFrame, pairs: List[Tuple[str, str, float]]) -> Figure:
+    """
+    One scatter plot per parameter pair, at most PLOT_MAX_POINTS points each.
+    """
+    cols = max(1, min(3, len(pairs)))
+    rows = max(1, -(-len(pairs) // cols))
+    fig = make_subplots(
+        rows=rows,
+        cols=cols,
+        subplot_titles=[
+            f"{x.removesuffix('_value')} / {y.removesuffix('_value')} (r={r:.2f})"
+            for x, y, r in pairs
+        ],
+    )
+    for inc, (x, y, _) in enumerate(pairs):
+        pair = aligned[[x, y]].dropna()
+        if PLOT_MAX_POINTS > 0 and len(pair) > PLOT_MAX_POINTS:
+            pair = pair.iloc[:: -(-len(pair) // PLOT_MAX_POINTS)]
+        fig.add_trace(  # type: ignore
+            {
+                "type": "scattergl",
+                "x": pair[x].to_numpy(),
+                "y": pair[y].to_numpy(),
+                "mode": "markers",
+                "marker": {"size": 4},
+                "showlegend": False,
+            },
+            row=inc // cols + 1,
+            col=inc % cols + 1,
+        )
+    return fig.update_layout(  # type: ignore
+        height=100 + 300 * rows, width=900, template="seaborn"
+    )
 
 
 def parameters_get_name(df_series: pd.DataFrame) -> Tuple[List[str], List[str]]:
     parameters = [str(x) for x in df_series.columns if x.endswith("value")]
     parameters_name = [
-        str(x).strip("_value") for x in df_series.columns if x.endswith("value")
+        str(x).removesuffix("_value") for x in df_series.columns if x.endswith("value")
     ]
     return parameters, parameters_name
 
 
 def get_station_name(station_id: List[str], db: _orm.Session) -> List[str]:
+    index = catalog.get_index(db)
     station_unique: List[str] = []
     for id in station_id:
-        st_name = (
-            db.query(models.Station.name).filter(models.Station.code == id).first()
-        )
+        st_name = index.station_name(id)
         if st_name:
-            station_unique.append(st_name[0])
-
-    if station_unique:
-        return station_unique
+            station_unique.append(st_name)
+    return station_unique
+
+
+def get_observation_url(
+    station: str, parameter: str, reference_time: str, resolution: int = 0
+) -> str:
+    return f"https://hydapi.nve.no/api/v1/Observations?StationId={station}&Parameter={parameter}&ResolutionTime={resolution}&ReferenceTime={reference_time}"
+
+
+def fetch_observations(
+    station: str,
+    parameters: str,
+    reference_time: str,
+    resolution: int = 0,
+    refresh: bool = False,
+) -> Dict[str, Any] | None:
+    """
+    Observations are served from the observation cache when present, refresh always
+    requests them from hydapi and replaces the cached response.
+    Failed api calls are not cached so they are retried on the next request.
+    """
+    key = cache.make_key(station, parameters, reference_time, resolution)
+    observations = None if refresh else cache.observation_cache.get(key)
+    if observations is None:
+        observation_url = get_observation_url(
+            station, parameters, reference_time, resolution
+        )
+        observations = api_call(observation_url)
+        if observations:
+            cache.observation_cache.set(key, observations)
+    return observations
+
+
+async def fetch_observations_async(
+    station: str, parameters: str, reference_time: str, resolution: int = 0
+) -> Dict[str, Any] | None:
+    key = cache.make_key(station, parameters, reference_time, resolution)
+    observations = await cache.observation_cache.get_async(key)
+    if observations is None:
+        observations = await api_call_async(
+            get_observation_url(station, parameters, reference_time, resolution)
+        )
+        if observations:
+            await cache.observation_cache.set_async(key, observations)
+    return observations
+
+
+def parse_series(observation: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Typed time (datetime64[ns], UTC) and value (float64) arrays of one hydapi series.
+    Missing values and points without a time are dropped.
+    """
+    series = [
+        point for point in observation.get("observations") or [] if point.get("time")
+    ]
+    values = np.array([point.get("value") for point in series], dtype=np.float64)
+    present = ~np.isnan(values)
+    # hydapi times are UTC, "2023-01-01T00:00:00.0000000Z", whole seconds.
+    times = np.array(
+        [point.get("time")[:19] for point in series], dtype="datetime64[s]"
+    )
+    return times[present].astype("datetime64[ns]"), values[present]
+
+
+def parse_observations(observations: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turn a hydapi Observations response into typed columns per parameter,
+    {parameterName}_value as float64 and {parameterName}_value_time as datetime64 (UTC).
+    stationId is kept as a plain string.
+    """
+    obs: Dict[str, Any] = {}
+    for observation in observations["data"]:
+        obs["stationId"] = observation.get("stationId")
+        times, values = parse_series(observation)
+        if not len(values):
+            continue
+        name = observation.get("parameterName")
+        obs[f"{name}_value"] = values
+        obs[f"{name}_value_time"] = times
+    return obs
+
+
+def fetch_station_series(
+    station: str, parameters: str, reference_time: str, refresh: bool = False
+) -> Dict[str, Any] | None:
+    """
+    Resolution is picked from the length of the time range. Long ranges are fetched
+    as parallel chunks on the chunk executor and stitched into one series.
+    With refresh the newest observations are requested from hydapi even when cached,
+    earlier chunks cover fixed intervals and are only fetched when missing.
+    """
+    resolution, chunks = timerange.plan_requests(reference_time)
+    span = timerange.parse_span(reference_time)
+    store = tsstore.observation_store
+    if store is not None and resolution == 0 and span is not None:
+        if span <= store.retention:
+            return fetch_stored_series(
+                store, station, parameters, reference_time, span, refresh
+            )
+    if len(chunks) == 1:
+        observations = fetch_observations(
+            station, parameters, chunks[0], resolution, refresh
+        )
     else:
-        return []
-
-
-def get_observation_url(station: str, parameter: str, reference_time: str) -> str:
-    return f"https://hydapi.nve.no/api/v1/Observations?StationId={station}&Parameter={parameter}&ResolutionTime=0&ReferenceTime={reference_time}"
+        responses = list(
+            chunk_executor.map(
+                lambda chunk: fetch_observations(
+                    station,
+                    parameters,
+                    chunk,
+                    resolution,
+                    refresh and chunk == chunks[-1],
+                ),
+                chunks,
+            )
+        )
+        missing = [chunk for chunk, response in zip(chunks, responses) if not response]
+        if missing:
+            logger.warning(f"No observations returned for {station} in {missing}")
+        fetched = [response for response in responses if response]
+        observations = timerange.merge_observations(fetched) if fetched else None
+    if not observations:
+        return None
+    return parse_observations(observations)
+
+
+async def fetch_station_series_async(
+    station: str, parameters: str, reference_time: str
+) -> Dict[str, Any] | None:
+    """
+    fetch_station_series for the event loop, the chunks of long ranges are requested
+    concurrently.
+    """
+    resolution, chunks = timerange.plan_requests(reference_time)
+    span = timerange.parse_span(reference_time)
+    store = tsstore.observation_store
+    if store is not None and resolution == 0 and span is not None:
+        if span <= store.retention:
+            return await fetch_stored_series_async(
+                store, station, parameters, reference_time, span
+            )
+    responses = await asyncio.gather(
+        *(
+            fetch_observations_async(station, parameters, chunk, resolution)
+            for chunk in chunks
+        )
+    )
+    fetched = [response for response in responses if response]
+    if len(chunks) > 1 and len(fetched) < len(chunks):
+        missing = [chunk for chunk, response in zip(chunks, responses) if not response]
+        logger.warning(f"No observations returned for {station} in {missing}")
+    if not fetched:
+        return None
+    if len(chunks) == 1:
+        return parse_observations(fetched[0])
+    return parse_observations(timerange.merge_observations(fetched))
+
+
+def fetch_stored_series(
+    store: tsstore.ObservationStore,
+    station: str,
+    parameters: str,
+    reference_time: str,
+    span: timedelta,
+    refresh: bool = False,
+) -> Dict[str, Any] | None:
+    """
+    Serve the time range from the local observation store, only requesting
+    observations after the last stored time from hydapi. The full range is requested
+    when the store does not cover the start of the range for every parameter.
+    Stored series refreshed less than OBSERVATION_CACHE_TTL seconds ago, by an earlier
+    request or the prefetch job, are served without calling hydapi unless refresh is set.
+    If hydapi fails the stored observations are returned.
+    """
+    request, stored, window_start = plan_stored_fetch(
+        store, station, parameters, reference_time, span, refresh
+    )
+    observations = None
+    if request is not None and stored:
+        observations = api_call(get_observation_url(station, parameters, request))
+    elif request is not None:
+        observations = fetch_observations(station, parameters, request)
+    return update_store(
+        store, station, parameters, observations, request, stored, window_start
+    )
 
 
-def get_series(
-    stations: List[str], parameters: str, reference_time: str = "P2D/"
-) -> List[Dict[str, Any]]:
+async def fetch_stored_series_async(
+    store: tsstore.ObservationStore,
+    station: str,
+    parameters: str,
+    reference_time: str,
+    span: timedelta,
+) -> Dict[str, Any] | None:
+    """
+    fetch_stored_series for the event loop, only the store's file I/O runs in a thread.
+    """
+    request, stored, window_start = await asyncio.to_thread(
+        plan_stored_fetch, store, station, parameters, reference_time, span
+    )
+    observations = None
+    if request is not None and stored:
+        observations = await api_call_async(
+            get_observation_url(station, parameters, request)
+        )
+    elif request is not None:
+        observations = await fetch_observations_async(station, parameters, request)
+    return await asyncio.to_thread(
+        update_store,
+        store,
+        station,
+        parameters,
+        observations,
+        request,
+        stored,
+        window_start,
+    )
 
-    def pop_obs(name: str, value: float | str) -> None:
-        if name not in obs:
-            obs[name] = []
-        obs[name].append(value)
 
-    def pop_observations(observations: Dict[str, Any]) -> None:
+def plan_stored_fetch(
+    store: tsstore.ObservationStore,
+    station: str,
+    parameters: str,
+    reference_time: str,
+    span: timedelta,
+    refresh: bool = False,
+) -> Tuple[str | None, bool, np.datetime64]:
+    """
+    Reference time to request from hydapi, None when the stored series is fresh,
+    whether the store covers the range (the reference time is then only the delta)
+    and the start of the range.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    window_start = np.datetime64(now - span, "ns")
+    parameter_codes = [p.strip() for p in parameters.split(",") if p.strip()]
+
+    first_times = [store.first_time(station, code) for code in parameter_codes]
+    last_times = [store.last_time(station, code) for code in parameter_codes]
+    # A shorter range stored earlier does not cover the start of a longer one.
+    stored = all(
+        first is not None and last is not None and first <= window_start <= last
+        for first, last in zip(first_times, last_times)
+    )
+    if not stored:
+        return reference_time, False, window_start
+    # Refreshed is per station and parameters for any range, it only says the end of
+    # the covered range is recent. The start is checked by stored.
+    if not refresh and _store_refreshed.get(f"{station}:{parameters}") is not None:
+        return None, True, window_start
+    since = min(last for last in last_times if last is not None)
+    start = f"{since.astype('datetime64[s]')}Z"
+    return f"{start}/{now.strftime(timerange.TIME_FORMAT)}", True, window_start
+
+
+def update_store(
+    store: tsstore.ObservationStore,
+    station: str,
+    parameters: str,
+    observations: Dict[str, Any] | None,
+    request: str | None,
+    stored: bool,
+    window_start: np.datetime64,
+) -> Dict[str, Any] | None:
+    """
+    Append the observations fetched for plan_stored_fetch and read the range.
+    """
+    if observations:
         for observation in observations["data"]:
-            obs["stationId"] = observation.get("stationId")
-            param_name_value_time = f"{observation.get('parameterName')}_value_time"
-            param_name_value = f"{observation.get('parameterName')}_value"
+            times, values = parse_series(observation)
+            store.append(
+                station,
+                str(observation.get("parameter")),
+                observation.get("parameterName"),
+                times,
+                values,
+                None if stored else window_start,
+            )
+        _store_refreshed.set(f"{station}:{parameters}", True)
+    elif request is not None:
+        logger.warning(f"Serving stored observations for {station}, hydapi failed")
+
+    obs: Dict[str, Any] = {"stationId": station}
+    for code in [p.strip() for p in parameters.split(",") if p.strip()]:
+        name = store.name(station, code)
+        times, values = store.read(station, code, since=window_start)
+        if name is None or not len(values):
+            continue
+        obs[f"{name}_value"] = values
+        obs[f"{name}_value_time"] = times
+    return obs if len(obs) > 1 else None
 
-            if observation.get("observations"):
-                for timeseries in observation.get("observations"):
-                    if timeseries.get("value"):
-                        param_value = float(timeseries.get("value"))
-                        param_value_time: str = timeseries.get("time")
-                        pop_obs(param_name_value, param_value)
-                        pop_obs(param_name_value_time, param_value_time)
 
-    observation_list: List[Dict[str, Any]] = []
-    previous_station = None
+def unique_stations(stations: List[str]) -> List[str]:
+    return list(dict.fromkeys(stations))
 
+
+def record_series(stations: List[str], parameters: str, reference_time: str) -> None:
     for station in stations:
-        if previous_station is not None and station == previous_station:
-            continue
-        observation_url = get_observation_url(station, parameters, reference_time)
-        observations = api_call(observation_url)
-        if not observations:
-            # implement logging
-            # somelogger(f"could not find observation for {station}")
-            continue
-        obs: Dict[str, Any] = {}
-        pop_observations(observations)
-        if obs:
-            observation_list.append(obs)
-        previous_station = station
+        series_tracker.record(
+            f"{station}:{parameters}:{reference_time}",
+            (station, parameters, reference_time),
+        )
+
+
+def series_or_placeholder(station: str, obs: Dict[str, Any] | None) -> Dict[str, Any]:
+    # Only stationId set means the station has no observations.
+    if not obs or len(obs) == 1:
+        logger.warning(f"No observations returned for {station}")
+        return {"stationId": station}
+    return obs
+
+
+def iter_series(
+    stations: List[str],
+    parameters: str,
+    reference_time: str = "P2D/",
+    max_parallel: int = SERIES_REQUEST_MAX_PARALLEL,
+) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Fetch stations concurrently on the shared series executor and yield
+    (index in stations, observations) as each station completes. At most max_parallel
+    stations of one call are queued at a time, so a comparison of many stations takes
+    turns with other requests instead of filling the executor queue.
+    A station that fails or returns no observations is logged and yielded as a
+    placeholder holding only its stationId.
+    """
+    record_series(stations, parameters, reference_time)
+    pending = iter(enumerate(stations))
+    futures: Dict[Future, int] = {}
+
+    def submit_next() -> None:
+        for inc, station in pending:
+            future = series_executor.submit(
+                fetch_station_series, station, parameters, reference_time
+            )
+            futures[future] = inc
+            return
+
+    for _ in range(max(1, max_parallel)):
+        submit_next()
+    while futures:
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            inc = futures.pop(future)
+            submit_next()
+            try:
+                obs = future.result()
+            except Exception:
+                logger.exception(f"Fetching observations for {stations[inc]} failed")
+                obs = None
+            yield inc, series_or_placeholder(stations[inc], obs)
 
+
+def get_series(
+    stations: List[str], parameters: str, reference_time: str = "P2D/"
+) -> List[Dict[str, Any]]:
+    """
+    The result keeps the order of stations so it matches the station names used as
+    subplot titles, failed stations are kept as placeholders and shown as an empty
+    subplot. If no station returns observations an empty list is returned.
+    """
+    stations = unique_stations(stations)
+    observation_list: List[Dict[str, Any]] = [{} for _ in stations]
+    for inc, obs in iter_series(stations, parameters, reference_time):
+        observation_list[inc] = obs
+
+    if all(len(obs) == 1 for obs in observation_list):
+        return []
     return observation_list
 
 
+async def get_series_async(
+    stations: List[str],
+    parameters: str,
+    reference_time: str = "P2D/",
+    max_parallel: int = SERIES_REQUEST_MAX_PARALLEL,
+) -> List[Dict[str, Any]]:
+    """
+    get_series for the event loop. At most max_parallel stations of one call are
+    fetched at a time, upstream calls of the whole process are bounded by the rate
+    governor and the connection pool of the async client instead of series_executor.
+    """
+    stations = unique_stations(stations)
+    record_series(stations, parameters, reference_time)
+    semaphore = asyncio.Semaphore(max(1, max_parallel))
+
+    async def fetch(station: str) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                obs = await fetch_station_series_async(
+                    station, parameters, reference_time
+                )
+            except Exception:
+                logger.exception(f"Fetching observations for {station} failed")
+                obs = None
+        return series_or_placeholder(station, obs)
+
+    observation_list = list(await asyncio.gather(*map(fetch, stations)))
+    if all(len(obs) == 1 for obs in observation_list):
+        return []
+    return observation_list
+
+
+def prefetch_series(
+    top_n: int = PREFETCH_TOP_N, min_tokens: float = PREFETCH_MIN_TOKENS
+) -> int:
+    """
+    Refresh the most requested series in the observation cache or store, one at a
+    time so user requests queued at the rate governor go first. The run stops when the
+    governor has min_tokens or fewer left. Returns the number of series refreshed.
+    """
+    refreshed = 0
+    for _, (station, parameters, reference_time) in series_tracker.top(top_n):
+        if ratelimit.governor.available() <= min_tokens:
+            logger.info(f"Prefetch stopped after {refreshed} series, rate limited")
+            break
+        try:
+            fetch_station_series(station, parameters, reference_time, refresh=True)
+            refreshed += 1
+        except Exception:
+            logger.exception(f"Prefetching {station} {parameters} failed")
+    series_tracker.decay()
+    return refreshed
+
+
+@lru_cache(maxsize=1)
 def set_error_string() -> str | None:
-    graphJSON: str | None = pt.io.to_json(  # type: ignore
-        px.line(template="seaborn", title="No data returned from API"), pretty=True  # type: ignore
+    return figure_json(
+        px.line(template="seaborn", title="No data returned from API")  # type: ignore
     )
-    return graphJSON
+
+
+def decode_typed_arrays(obj: Any) -> Any:
+    """
+    Replace plotly.js typed array specs ({"dtype", "bdata"}) by plain arrays.
+    """
+    if isinstance(obj, dict):
+        if "bdata" in obj and "dtype" in obj:
+            values = np.frombuffer(base64.b64decode(obj["bdata"]), dtype=obj["dtype"])
+            if "shape" in obj:
+                values = values.reshape([int(x) for x in obj["shape"].split(",")])
+            return values
+        return {key: decode_typed_arrays(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [decode_typed_arrays(value) for value in obj]
+    return obj
+
+
+def message_json(message: Dict[str, Any]) -> str:
+    """
+    Compact JSON of a message holding figure parts, arrays are always sent plain.
+    """
+    return pt.io.json.to_json_plotly(  # type: ignore
+        message, pretty=False, engine=PLOT_JSON_ENGINE
+    )
+
+
+def figure_json(fig: Figure) -> str:
+    """
+    Compact JSON of a figure. Numeric arrays are sent as base64 typed arrays when
+    PLOT_TYPED_ARRAYS is set, they need plotly.js 2.28 or newer in the frontend.
+    """
+    figure = fig.to_plotly_json()  # type: ignore
+    if not PLOT_TYPED_ARRAYS:
+        figure = decode_typed_arrays(figure)
+    return pt.io.json.to_json_plotly(figure, pretty=False, engine=PLOT_JSON_ENGINE)  # type: ignore
@@ -0,0 +1,52 @@
+from typing import Any, Dict, List, Tuple
+import threading
+
+"""
+Request frequency tracking for the background jobs.
+Every request adds one to the count of its key, decay() scales all counts down so the
+ranking follows recent traffic. Only the max_entries most frequent keys are kept.
+"""
+
+
+class FrequencyTracker:
+    def __init__(self, max_entries: int = 1000, decay: float = 0.9):
+        self.max_entries = max_entries
+        self.decay_factor = decay
+        self._lock = threading.Lock()
+        self._counts: Dict[str, float] = {}
+        self._payloads: Dict[str, Any] = {}
+
+    def record(self, key: str, payload: Any = None) -> None:
+        """
+        Count a request, payload is what top() returns for the key.
+        """
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0.0) + 1
+            self._payloads[key] = payload
+            if len(self._counts) > self.max_entries:
+                # Prune below the limit so the sort is not repeated on every record.
+                self._prune(int(self.max_entries * 0.9))
+
+    def top(self, n: int) -> List[Tuple[str, Any]]:
+        with self._lock:
+            keys = sorted(self._counts, key=self._counts.__getitem__, reverse=True)
+            return [(key, self._payloads[key]) for key in keys[:n]]
+
+    def decay(self) -> None:
+        """
+        Scale all counts down and forget keys that have not been requested lately.
+        """
+        with self._lock:
+            for key in list(self._counts):
+                self._counts[key] *= self.decay_factor
+                if self._counts[key] < 0.05:
+                    del self._counts[key]
+                    del self._payloads[key]
+
+    def _prune(self, size: int) -> None:
+        keep = sorted(self._counts, key=self._counts.__getitem__, reverse=True)[:size]
+        self._counts = {key: self._counts[key] for key in keep}
+        self._payloads = {key: self._payloads[key] for key in keep}
+
+    def __len__(self) -> int:
+        return len(self._counts)
@@ -1,61 +1,325 @@
-from typing import Dict, List, Any
-import schemas
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Tuple
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+import sqlalchemy as _sql
 import models
 import database
 import sqlalchemy.orm as _orm
 from api import api_call
 
+logger = logging.getLogger(__name__)
 
-def all_station_params(stations: Dict[str, Any] | None, db: _orm.Session):
-    unique_station: set[str] = set()
+URL_STATIONS = "https://hydapi.nve.no/api/v1/Stations"
+
+
+def build_catalog_rows(
+    stations: Dict[str, Any],
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Build station and parameter rows from the hydapi Stations response.
+    Parameter rows reference their station by station code, ids are not known yet.
+    """
+    station_rows: Dict[str, Dict[str, Any]] = {}
+    parameter_rows: Dict[Tuple[str, Any], Dict[str, Any]] = {}
+    for station in stations["data"]:
+        code = station["stationId"]
+        if code not in station_rows:
+            station_rows[code] = {"code": code, "name": station["stationName"]}
+        for param in station["seriesList"]:
+            parameter_rows.setdefault(
+                (code, param["parameter"]),
+                {
+                    "station_code": code,
+                    "name": param["parameterName"],
+                    "code": param["parameter"],
+                },
+            )
+    return list(station_rows.values()), list(parameter_rows.values())
+
+
+def all_station_params(
+    stations: Dict[str, Any] | None, db: _orm.Session, live: bool = True
+) -> Dict[str, Any]:
+    """
+    Bulk load stations and their parameters in one transaction.
+    Rows are inserted with executemany, station ids for the parameter rows are resolved
+    from one query of the inserted stations.
+    live is False for a shadow database, the catalog generation is then bumped when
+    it is swapped in.
+    """
+    start = time.perf_counter()
+    station_rows: List[Dict[str, Any]] = []
+    parameter_rows: List[Dict[str, Any]] = []
     if stations:
-        station_list: List[Any] = stations["data"]
-
-        for station in station_list:
-            station_db = schemas.StationDB
-            station_db.name_st = station["stationName"]
-            station_db.code_st = station["stationId"]
-            if station_db.code_st not in unique_station:
-                populate_db_station(station_db, db)
-            for param in station["seriesList"]:
-                param_db = schemas.ParameterDB
-                param_db.name_para = param["parameterName"]
-                param_db.code_para = param["parameter"]
-                populate_db_parameter(station_db, param_db, db)
-
-            unique_station.add(station_db.code_st)
-
-
-def populate_db_station(station_db: schemas.StationDB, db: _orm.Session):
-    # create dict of pydantic model
-    # user_dict = station_db.dict()
-    # vice versa
-    # backtoSchema = schemas.StationDB(**user_dict)
-    stat = models.Station(name=station_db.name_st, code=station_db.code_st)
-    db.add(stat)
-    db.commit()
-    db.refresh(stat)
-
-
-def populate_db_parameter(
-    station_db: schemas.StationDB,
-    param_db: schemas.ParameterDB,
-    db: _orm.Session,
-):
-    st: models.Station = (
-        db.query(models.Station).filter_by(name=station_db.name_st).first()
+        station_rows, parameter_rows = build_catalog_rows(stations)
+
+    try:
+        if station_rows:
+            db.execute(_sql.insert(models.Station), station_rows)
+        station_ids: Dict[str, int] = {
+            code: id for code, id in db.query(models.Station.code, models.Station.id)
+        }
+        if parameter_rows:
+            db.execute(
+                _sql.insert(models.Parameter),
+                [
+                    {
+                        "station_id": station_ids[row["station_code"]],
+                        "name": row["name"],
+                        "code": row["code"],
+                    }
+                    for row in parameter_rows
+                ],
+            )
+        version = record_version(
+            db,
+            {
+                "stations": {"inserted": len(station_rows), "updated": 0, "deleted": 0},
+                "parameters": {
+                    "inserted": len(parameter_rows),
+                    "updated": 0,
+                    "deleted": 0,
+                },
+            },
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    if live:
+        database.mark_catalog_changed()
+
+    seconds = time.perf_counter() - start
+    rows = len(station_rows) + len(parameter_rows)
+    load_stats = {
+        "stations": len(station_rows),
+        "parameters": len(parameter_rows),
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(rows / seconds, 1) if seconds else 0.0,
+        "version": version,
+    }
+    logger.info(f"Catalog loaded: {load_stats}")
+    return load_stats
+
+
+def record_version(db: _orm.Session, summary: Dict[str, Dict[str, int]]) -> int:
+    version = models.CatalogVersion.latest(db) + 1
+    db.add(
+        models.CatalogVersion(
+            version=version,
+            created=datetime.now(timezone.utc),
+            summary=json.dumps(summary),
+        )
     )
-    param = models.Parameter(
-        name=param_db.name_para, code=param_db.code_para, station_id=st.id
+    return version
+
+
+def sync_station_params(
+    stations: Dict[str, Any], db: _orm.Session, live: bool = True
+) -> Dict[str, Any]:
+    """
+    Apply only the differences between the hydapi Stations response and the stored
+    catalog. Stations are matched on code, parameters on station code and parameter
+    code. A new catalog version is recorded only if something changed.
+    live is False for a shadow database, as for all_station_params.
+    """
+    station_rows, parameter_rows = build_catalog_rows(stations)
+    wanted_stations = {row["code"]: row for row in station_rows}
+    wanted_params = {
+        (row["station_code"], str(row["code"])): row for row in parameter_rows
+    }
+
+    try:
+        stored_stations: Dict[str, Tuple[int, str]] = {
+            code: (id, name)
+            for id, code, name in db.query(
+                models.Station.id, models.Station.code, models.Station.name
+            )
+        }
+        stored_params: Dict[Tuple[str, str], Tuple[int, str]] = {
+            (station_code, str(code)): (id, name)
+            for id, station_code, code, name in db.query(
+                models.Parameter.id,
+                models.Station.code,
+                models.Parameter.code,
+                models.Parameter.name,
+            ).join(models.Station, models.Parameter.station_id == models.Station.id)
+        }
+
+        station_inserts = [
+            row for code, row in wanted_stations.items() if code not in stored_stations
+        ]
+        station_updates = [
+            {"id": stored_stations[code][0], "name": row["name"]}
+            for code, row in wanted_stations.items()
+            if code in stored_stations and stored_stations[code][1] != row["name"]
+        ]
+        station_deletes = [
+            id
+            for code, (id, _) in stored_stations.items()
+            if code not in wanted_stations
+        ]
+        param_inserts = [
+            row for key, row in wanted_params.items() if key not in stored_params
+        ]
+        param_updates = [
+            {"id": stored_params[key][0], "name": row["name"]}
+            for key, row in wanted_params.items()
+            if key in stored_params and stored_params[key][1] != row["name"]
+        ]
+        # Parameters of deleted stations are deleted as well.
+        param_deletes = [
+            id for key, (id, _) in stored_params.items() if key not in wanted_params
+        ]
+
+        if param_deletes:
+            db.execute(
+                _sql.delete(models.Parameter).where(
+                    models.Parameter.id.in_(param_deletes)
+                )
+            )
+        if station_deletes:
+            db.execute(
+                _sql.delete(models.Station).where(
+                    models.Station.id.in_(station_deletes)
+                )
+            )
+        if station_inserts:
+            db.execute(_sql.insert(models.Station), station_inserts)
+        if station_updates:
+            db.execute(_sql.update(models.Station), station_updates)
+        if param_inserts:
+            station_ids: Dict[str, int] = {
+                code: id
+                for code, id in db.query(models.Station.code, models.Station.id)
+            }
+            db.execute(
+                _sql.insert(models.Parameter),
+                [
+                    {
+                        "station_id": station_ids[row["station_code"]],
+                        "name": row["name"],
+                        "code": row["code"],
+                    }
+                    for row in param_inserts
+                ],
+            )
+        if param_updates:
+            db.execute(_sql.update(models.Parameter), param_updates)
+
+        summary: Dict[str, Any] = {
+            "stations": {
+                "inserted": len(station_inserts),
+                "updated": len(station_updates),
+                "deleted": len(station_deletes),
+            },
+            "parameters": {
+                "inserted": len(param_inserts),
+                "updated": len(param_updates),
+                "deleted": len(param_deletes),
+            },
+        }
+        changed = any(
+            count for changes in summary.values() for count in changes.values()
+        )
+        if changed:
+            summary["version"] = record_version(db, summary)
+        else:
+            summary["version"] = models.CatalogVersion.latest(db)
+        summary["changed"] = changed
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    if changed and live:
+        database.mark_catalog_changed()
+
+    logger.info(f"Catalog synced: {summary}")
+    return summary
+
+
+def validate_catalog(db: _orm.Session, stations: int, parameters: int) -> None:
+    """
+    Raise ValueError if the new catalog is not complete, the live catalog is then kept.
+    """
+    stored_stations = db.query(models.Station).count()
+    stored_parameters = db.query(models.Parameter).count()
+    orphans = (
+        db.query(models.Parameter)
+        .outerjoin(models.Station, models.Parameter.station_id == models.Station.id)
+        .filter(models.Station.id.is_(None))
+        .count()
     )
-    db.add(param)
-    db.commit()
-    db.refresh(param)
+    integrity = db.execute(_sql.text("PRAGMA integrity_check")).scalar()
+    if stored_stations == 0 or stored_parameters == 0:
+        raise ValueError("Catalog is empty")
+    if stored_stations != stations or stored_parameters != parameters:
+        raise ValueError(
+            f"Catalog has {stored_stations} stations and {stored_parameters} "
+            f"parameters, expected {stations} and {parameters}"
+        )
+    if orphans:
+        raise ValueError(f"{orphans} parameters without station")
+    if integrity != "ok":
+        raise ValueError(f"Integrity check failed: {integrity}")
+
 
+def refresh_catalog(
+    stations: Dict[str, Any] | None,
+    shadow_path: str = database.DATABASE_PATH_SHADOW,
+    incremental: bool = True,
+) -> Dict[str, Any]:
+    """
+    Build the complete catalog in a shadow database, validate it and swap it in.
+    Incremental refresh starts from a copy of the live catalog and applies only the
+    changes, the swap is skipped when nothing changed. Full refresh loads everything
+    into an empty shadow database.
+    The api server keeps reading the old catalog until the swap and picks up the new
+    file on its next session, see database.reload_if_swapped.
+    """
+    if not stations or not stations.get("data"):
+        raise ValueError("No stations returned from API")
+    if os.path.exists(shadow_path):
+        os.remove(shadow_path)
+    if incremental and os.path.exists(database.DATABASE_PATH):
+        shutil.copy(database.DATABASE_PATH, shadow_path)
+
+    station_rows, parameter_rows = build_catalog_rows(stations)
+    shadow_engine = database.create_engine(shadow_path)
+    try:
+        database.Base.metadata.create_all(bind=shadow_engine)
+        with _orm.Session(shadow_engine) as db:
+            if incremental:
+                summary = sync_station_params(stations, db, live=False)
+            else:
+                summary = all_station_params(stations, db, live=False)
+                summary["changed"] = True
+            validate_catalog(db, len(station_rows), len(parameter_rows))
+    finally:
+        shadow_engine.dispose()
+
+    if not summary["changed"]:
+        os.remove(shadow_path)
+        logger.info("Catalog unchanged, keeping live database")
+        return summary
 
-def stations_db(url_stations: str):
     database.backup_db()
+    database.swap_in(shadow_path)
+    logger.info(f"Catalog swapped in from {shadow_path}")
+    return summary
+
+
+def stations_db(url_stations: str = URL_STATIONS, incremental: bool = True):
     stations = api_call(url_stations)
-    db_gen = database.get_db()
-    db = next(db_gen)
-    return all_station_params(stations, db)
+    return refresh_catalog(stations, incremental=incremental)
+
+
+if __name__ == "__main__":
+    # Run with --full to rebuild the catalog from scratch instead of syncing changes.
+    logging.basicConfig(level=logging.INFO)
+    stations_db(URL_STATIONS, incremental="--full" not in sys.argv)
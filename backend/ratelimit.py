@@ -0,0 +1,175 @@
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Mapping
+import os
+import re
+import threading
+import time
+
+"""
+Token bucket governing outgoing hydapi requests.
+Callers take a ticket and are served first come first served, each request consumes one
+token and tokens are refilled at HYDAPI_RATE per second up to HYDAPI_BURST.
+The rate limit headers returned by hydapi are fed back with observe(), so the bucket never
+holds more tokens than the server reports as remaining. The quota belongs to the api key,
+this keeps the api server and the populate_db cron job within the shared quota even though
+each process runs its own governor.
+"""
+HYDAPI_RATE = float(os.getenv("HYDAPI_RATE", "5"))
+HYDAPI_BURST = float(os.getenv("HYDAPI_BURST", "5"))
+# Pause used when the quota is exhausted and the reset header is missing or unreadable.
+DEFAULT_PAUSE = 0.5
+# Python 3.10 only parses fractions of 3 or 6 digits, hydapi sends up to 7.
+FRACTION = re.compile(r"\.(\d+)")
+
+
+def parse_reset(reset: str | None, now: datetime | None = None) -> float | None:
+    """
+    X-Rate-Limit-Reset is a timestamp, return seconds until it or None if not readable.
+    """
+    if not reset:
+        return None
+    try:
+        reset = FRACTION.sub(
+            lambda match: "." + match.group(1)[:6].ljust(6, "0"), reset, count=1
+        )
+        reset_time = datetime.fromisoformat(reset.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if reset_time.tzinfo is None:
+        reset_time = reset_time.replace(tzinfo=timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    return max(0.0, (reset_time - now).total_seconds())
+
+
+class RateGovernor:
+    def __init__(
+        self,
+        rate: float = HYDAPI_RATE,
+        burst: float = HYDAPI_BURST,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._tokens = burst
+        self._updated = clock()
+        self._pause_until = 0.0
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._stats: Dict[str, float] = {
+            "requests": 0,
+            "queued": 0,
+            "throttled": 0,
+            "total_wait": 0.0,
+            "max_wait": 0.0,
+        }
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """
+        Block until the caller may send a request. Returns the time spent waiting.
+        """
+        start = self.clock()
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while True:
+                timeout: float | None = None
+                if ticket == self._serving:
+                    now = self.clock()
+                    self._refill(now)
+                    if self._tokens >= 1 and now >= self._pause_until:
+                        self._tokens -= 1
+                        self._serving += 1
+                        self._cond.notify_all()
+                        break
+                    timeout = max(
+                        self._pause_until - now, (1 - self._tokens) / self.rate
+                    )
+                self._cond.wait(timeout)
+            waited = self.clock() - start
+            self._stats["requests"] += 1
+            self._stats["total_wait"] += waited
+            self._stats["max_wait"] = max(self._stats["max_wait"], waited)
+            if waited > 0.001:
+                self._stats["queued"] += 1
+        return waited
+
+    def try_acquire(self) -> bool:
+        """
+        Take a token without waiting, only when nobody is queued and one is available.
+        """
+        with self._cond:
+            now = self.clock()
+            self._refill(now)
+            if (
+                self._next_ticket != self._serving
+                or self._tokens < 1
+                or now < self._pause_until
+            ):
+                return False
+            self._tokens -= 1
+            self._next_ticket += 1
+            self._serving += 1
+            self._stats["requests"] += 1
+        return True
+
+    def observe(self, headers: Mapping[str, Any], status_code: int = 200) -> None:
+        """
+        Adjust the bucket to the rate limit headers of a hydapi response.
+        """
+        remaining = headers.get("X-Rate-Limit-Remaining")
+        if remaining is None and status_code != 429:
+            return
+        with self._cond:
+            now = self.clock()
+            self._refill(now)
+            exhausted = status_code == 429
+            if remaining is not None:
+                try:
+                    self._tokens = min(self._tokens, float(remaining))
+                    exhausted = exhausted or float(remaining) < 1
+                except ValueError:
+                    return
+            # Local tokens may be spent by requests in flight, only pause when the
+            # server reports the quota as used up.
+            if exhausted:
+                pause = parse_reset(headers.get("X-Rate-Limit-Reset"))
+                self._pause_until = max(
+                    self._pause_until, now + (pause if pause else DEFAULT_PAUSE)
+                )
+                self._stats["throttled"] += 1
+            self._cond.notify_all()
+
+    def available(self) -> float:
+        """
+        Tokens left after the queued requests are served, 0 while paused. Background
+        work only sends requests when this leaves room for user requests.
+        """
+        with self._cond:
+            now = self.clock()
+            if now < self._pause_until:
+                return 0.0
+            self._refill(now)
+            return max(0.0, self._tokens - (self._next_ticket - self._serving))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["waiting"] = self._next_ticket - self._serving
+            stats["tokens"] = round(self._tokens, 2)
+        stats["mean_wait"] = (
+            round(stats["total_wait"] / stats["requests"], 4)
+            if stats["requests"]
+            else 0.0
+        )
+        stats["rate"] = self.rate
+        stats["burst"] = self.burst
+        return stats
+
+
+governor = RateGovernor()
@@ -0,0 +1,79 @@
+from typing import Any, Callable, Dict
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+"""
+Background jobs run inside the api process. A PeriodicTask runs its function in a
+daemon thread every interval seconds, measured from the start of the previous run.
+Failures are logged and counted, the task keeps running.
+"""
+
+
+class PeriodicTask:
+    def __init__(
+        self,
+        name: str,
+        interval: float,
+        fn: Callable[[], Any],
+        initial_delay: float = 0.0,
+    ):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.initial_delay = initial_delay
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._stats: Dict[str, Any] = {
+            "runs": 0,
+            "failures": 0,
+            "last_duration": 0.0,
+            "last_run": None,
+        }
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f"task-{self.name}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self) -> None:
+        start = time.monotonic()
+        try:
+            self.fn()
+        except Exception:
+            self._stats["failures"] += 1
+            logger.exception(f"Background task {self.name} failed")
+        self._stats["runs"] += 1
+        self._stats["last_duration"] = round(time.monotonic() - start, 3)
+        self._stats["last_run"] = time.time()
+
+    def _run(self) -> None:
+        if self._stop.wait(self.initial_delay):
+            return
+        while True:
+            start = time.monotonic()
+            self.run_once()
+            if self._stop.wait(max(0.0, self.interval - (time.monotonic() - start))):
+                return
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["interval"] = self.interval
+        stats["running"] = self.running
+        return stats
@@ -1,4 +1,8 @@
-from pydantic import BaseModel
+from typing import Dict, List, Literal
+from pydantic import BaseModel, Field, conint, validator
+
+# Most scatter plots shown by "Parameter correlation", three per row.
+TOP_K_MAX = 12
 
 
 class StationBase(BaseModel):
@@ -6,12 +10,38 @@ class StationBase(BaseModel):
 
 
 class StationCreate(StationBase):
-    station2: str
-    station3: str
+    station2: str = ""
+    station3: str = ""
     parameter: str
     parameter2: str
     timerange: str
     plottype: str
+    # "Stations compare" of any number of stations, replaces station/station2/station3.
+    stations: List[str] = Field([], max_items=50)
+    # "grid" gives a subplot per station, "overlay" one shared axis for all stations.
+    layout: Literal["grid", "overlay"] = "grid"
+    # "Parameter correlation" shows the top_k most correlated pairs when above 0.
+    top_k: conint(ge=0, le=TOP_K_MAX) = 0  # type: ignore
+
+
+class StatisticsRequest(BaseModel):
+    stations: List[str] = Field(..., min_items=1, max_items=50)
+    # Comma separated parameter codes, as for the plots.
+    parameter: str
+    timerange: str
+    percentiles: List[float] = Field([5, 50, 95], max_items=10)
+    # Days in the rolling mean, 0 leaves it out.
+    rolling_days: int = 7
+
+    @validator("percentiles")
+    def unique_percentiles(cls, percentiles: List[float]) -> List[float]:
+        if any(not 0 <= p <= 100 for p in percentiles):
+            raise ValueError("percentiles must be between 0 and 100")
+        # One per column, the column name p{p:g} is the same for 50 and 50.0.
+        unique: Dict[str, float] = {}
+        for p in percentiles:
+            unique.setdefault(f"{p:g}", p)
+        return list(unique.values())
 
 
 class ParametersOnly(BaseModel):
@@ -1,106 +1,353 @@
-from typing import Any, Dict
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Tuple, Type
+import asyncio
+import json
+import logging
+import os
+import time
+import numpy as np
 import schemas
 import sqlalchemy.orm as _orm
 
-import plotly as pt  # type: ignore
 import plottypes
-import models
+import catalog
+import ratelimit
+import cache
+import summaries
+import timerange
+from popularity import FrequencyTracker
+from singleflight import AsyncSingleFlight, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+series_flight = SingleFlight()
+series_flight_async = AsyncSingleFlight()
+
+"""
+On the async request path figures are created and serialized on figure_executor, at
+most FIGURE_MAX_WORKERS at a time, while the event loop keeps serving hydapi calls.
+"""
+FIGURE_MAX_WORKERS = int(os.getenv("FIGURE_MAX_WORKERS", "2"))
+figure_executor = ThreadPoolExecutor(
+    max_workers=FIGURE_MAX_WORKERS, thread_name_prefix="figure"
+)
+
+"""
+Serialized figures are cached per normalized request and freshness bucket, a bucket is
+FIGURE_FRESHNESS seconds of wall clock time. A figure is therefore never older than one
+bucket, and instances sharing a redis cache use the same keys.
+The PREWARM_TOP_N most requested plots are rendered in the background, also for the next
+bucket shortly before it starts, so the first request in a bucket is a hit. Prewarming
+runs on the event loop and shares series_flight_async with /api/series, it stops while
+the rate governor has PREWARM_MIN_TOKENS or fewer left for user requests.
+"""
+FIGURE_CACHE_BACKEND = os.getenv("FIGURE_CACHE", cache.CACHE_BACKEND)
+FIGURE_CACHE_SIZE = int(os.getenv("FIGURE_CACHE_SIZE", "64"))
+FIGURE_FRESHNESS = float(os.getenv("FIGURE_FRESHNESS", "300"))
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", "10"))
+PREWARM_INTERVAL = float(os.getenv("PREWARM_INTERVAL", "60"))
+PREWARM_MIN_TOKENS = float(os.getenv("PREWARM_MIN_TOKENS", "2"))
+
+# Entries stay past their bucket at most one bucket, the key makes them unreachable.
+figure_cache = cache.create_cache(
+    FIGURE_CACHE_BACKEND, FIGURE_CACHE_SIZE, 2 * FIGURE_FRESHNESS, namespace="nve-fig"
+)
+request_tracker = FrequencyTracker()
 
 
 def get_stations(parameter: str, db: _orm.Session) -> Dict[str, Any]:
-    st_id = (
-        db.query(models.Station.name, models.Station.code)
-        .join(models.Parameter, models.Station.id == models.Parameter.station_id)
-        .filter(models.Parameter.code == parameter)
-        .all()
-    )
-    station_unique: Dict[str, Any] = {}
-    for name, code in st_id:
-        station_unique[name] = code
-    return station_unique
+    return dict(catalog.get_index(db).stations_for_parameter(parameter))
 
 
 def get_parameters(station: str, db: _orm.Session) -> Dict[str, Any]:
-    st_id = (
-        db.query(models.Parameter.name, models.Parameter.code)
-        .join(models.Station, models.Parameter.station_id == models.Station.id)
-        .filter(models.Station.code == station)
-        .all()
-    )
-    parameter_unique: Dict[str, Any] = {}
-    for name, code in st_id:
-        parameter_unique[name] = code
-    return parameter_unique
+    return dict(catalog.get_index(db).parameters_for_station(station))
 
 
 def get_parameters_all(db: _orm.Session) -> Dict[str, Any]:
-    st_id = db.query(models.Parameter.name, models.Parameter.code).all()
-    parameter_unique: Dict[str, Any] = {}
-    for name, code in st_id:
-        parameter_unique[name] = code
-    return parameter_unique
+    return dict(catalog.get_index(db).parameters_all())
 
 
 def get_stations_all(db: _orm.Session) -> Dict[str, Any]:
-    st_id = db.query(models.Station.name, models.Station.code).all()
-    station_unique: Dict[str, Any] = {}
-    for name, code in st_id:
-        station_unique[name] = code
-    return station_unique
+    return dict(catalog.get_index(db).stations_all())
 
 
-def create_plot(station_obj: schemas.StationCreate, db: _orm.Session):
+def catalog_etag(db: _orm.Session, *parts: Any) -> str:
+    return catalog.get_index(db).etag(*parts)
+
+
+def compare_stations(station_obj: schemas.StationCreate) -> List[str]:
+    """
+    Stations of a "Stations compare" request, without duplicates and in request order.
+    The stations list is used when given, otherwise station, station2 and station3.
+    """
+    stations = station_obj.stations or [
+        station_obj.station,
+        station_obj.station2,
+        station_obj.station3,
+    ]
+    return plottypes.unique_stations([s.strip() for s in stations if s.strip()])
+
+
+def normalize_request(station_obj: schemas.StationCreate) -> Dict[str, Any]:
+    """
+    Keep only the fields used by the selected plot type, so requests that render the
+    same plot are equal even if the unused dropdowns differ.
+    """
+    request: Dict[str, Any] = {
+        "plottype": station_obj.plottype,
+        "station": station_obj.station,
+        "timerange": station_obj.timerange,
+    }
+    if station_obj.plottype == "Stations compare":
+        request["stations"] = compare_stations(station_obj)
+        request["parameter"] = station_obj.parameter
+        request["layout"] = station_obj.layout
+    elif station_obj.plottype == "Parameters compare":
+        request["parameters"] = [station_obj.parameter, station_obj.parameter2]
+    elif station_obj.plottype == "Parameter correlation":
+        request["top_k"] = station_obj.top_k
+    return request
+
+
+def request_key(station_obj: schemas.StationCreate) -> str:
+    return json.dumps(normalize_request(station_obj), sort_keys=True)
+
+
+def freshness_bucket(now: float | None = None) -> int:
+    return int((time.time() if now is None else now) // FIGURE_FRESHNESS)
+
+
+def figure_key(
+    station_obj: schemas.StationCreate, db: _orm.Session, bucket: int
+) -> str:
+    # Station names in the figure come from the catalog.
+    return f"fig:{catalog.get_index(db).tag}:{request_key(station_obj)}:{bucket}"
+
+
+def render_plot(station_obj: schemas.StationCreate, db: _orm.Session):
+    """
+    Identical requests arriving while a plot is being created wait for it and share
+    the serialized figure instead of fetching and plotting it again.
+    """
+    figure = cached_plot(station_obj, db, freshness_bucket())
+    record_request(station_obj, figure)
+    return figure
+
+
+def record_request(station_obj: schemas.StationCreate, figure: str | None) -> None:
+    # Only plots that rendered are prewarmed, failing requests are not counted.
+    if figure is not None and figure != plottypes.set_error_string():
+        request_tracker.record(request_key(station_obj), station_obj.dict())
+
+
+async def render_plot_async(station_obj: schemas.StationCreate, db: _orm.Session):
+    """
+    render_plot for the event loop, identical requests share one render. Catalog
+    lookups run in a thread, figures are created on figure_executor.
+    """
+    key = await asyncio.to_thread(figure_key, station_obj, db, freshness_bucket())
+    figure = await cached_plot_async(station_obj, db, key)
+    record_request(station_obj, figure)
+    return figure
+
+
+async def cached_plot_async(
+    station_obj: schemas.StationCreate, db: _orm.Session, key: str
+):
+    figure = await figure_cache.get_async(key)
+    if figure is None:
+        # The session belongs to this request, the render shared with other requests
+        # must not use it, it may be closed when this request is cancelled.
+        plot = await asyncio.to_thread(prepare_plot, station_obj, db)
+        if plot is None:
+            return plottypes.set_error_string()
+        figure = await series_flight_async.do(key, render_to_cache_async, plot, key)
+    return figure
+
+
+def prepare_plot(
+    station_obj: schemas.StationCreate, db: _orm.Session
+) -> plottypes.Plot | None:
+    """
+    Plot with all catalog lookups done, station_names included.
+    """
+    plot_class = PLOT_CLASSES.get(station_obj.plottype)
+    if plot_class is None:
+        return None
+    all_params, stations = plot_selection(station_obj, db)
+    plot = plot_class(all_params, stations, db, station_obj)
+    plot.station_names = plot.titles()
+    return plot
+
+
+async def render_to_cache_async(plot: plottypes.Plot, key: str):
+    observation_list = await plot.fetch_series_async()
+    figure = await asyncio.get_running_loop().run_in_executor(
+        figure_executor, figure_from_series, plot, observation_list
+    )
+    if figure != plottypes.set_error_string():
+        await figure_cache.set_async(key, figure)
+    return figure
+
+
+def cached_plot(station_obj: schemas.StationCreate, db: _orm.Session, bucket: int):
+    key = figure_key(station_obj, db, bucket)
+    figure = figure_cache.get(key)
+    if figure is None:
+        figure = series_flight.do(key, render_to_cache, station_obj, db, key)
+    return figure
+
+
+def render_to_cache(station_obj: schemas.StationCreate, db: _orm.Session, key: str):
+    figure = create_plot(station_obj, db)
+    # Error figures are not cached, the next request tries hydapi again.
+    if figure is not None and figure != plottypes.set_error_string():
+        figure_cache.set(key, figure)
+    return figure
+
+
+async def prewarm_figures(db: _orm.Session, now: float | None = None) -> int:
+    """
+    Render the most requested plots missing from the figure cache for the current
+    bucket, and for the next bucket when it starts within PREWARM_INTERVAL.
+    Returns the number of figures rendered.
+    """
+    now = time.time() if now is None else now
+    buckets = [freshness_bucket(now)]
+    if (buckets[0] + 1) * FIGURE_FRESHNESS - now <= PREWARM_INTERVAL:
+        buckets.append(buckets[0] + 1)
+    rendered = 0
+    for _, payload in request_tracker.top(PREWARM_TOP_N):
+        if ratelimit.governor.available() <= PREWARM_MIN_TOKENS:
+            logger.info(f"Prewarm stopped after {rendered} figures, rate limited")
+            break
+        station_obj = schemas.StationCreate(**payload)
+        for bucket in buckets:
+            key = await asyncio.to_thread(figure_key, station_obj, db, bucket)
+            if await figure_cache.get_async(key) is not None:
+                continue
+            try:
+                await cached_plot_async(station_obj, db, key)
+                rendered += 1
+            except Exception:
+                logger.exception(f"Prewarming {key} failed")
+    request_tracker.decay()
+    return rendered
+
+
+PLOT_CLASSES: Dict[str, Type[plottypes.Plot]] = {
+    "Stations compare": plottypes.StationsCompare,
+    "Parameters compare": plottypes.ParametersCompare,
+    "Parameter matrix": plottypes.ParameterMatrix,
+    "Parameters all": plottypes.ParametersAll,
+    "Parameter correlation": plottypes.ParameterCorrelation,
+}
+
+
+def plot_selection(
+    station_obj: schemas.StationCreate, db: _orm.Session
+) -> Tuple[str, List[str]]:
+    """
+    Parameters (comma separated codes) and stations fetched for the plot type.
+    """
     if station_obj.plottype == "Stations compare":
-        return populate_plot(
-            plottypes.StationsCompare(
-                station_obj.parameter,
-                [station_obj.station, station_obj.station2, station_obj.station3],
-                db,
-                station_obj,
-            )
-        )
+        return station_obj.parameter, compare_stations(station_obj)
     elif station_obj.plottype == "Parameters compare":
-        all_params = ",".join([station_obj.parameter, station_obj.parameter2])
-        return populate_plot(
-            plottypes.ParametersCompare(
-                all_params,
-                [station_obj.station],
-                db,
-                station_obj,
-            )
-        )
-    elif station_obj.plottype == "Parameter matrix":
-        all_params = ",".join(
-            [str(value) for value in get_parameters(station_obj.station, db).values()]
-        )
-        return populate_plot(
-            plottypes.ParameterMatrix(
-                all_params,
-                [station_obj.station],
-                db,
-                station_obj,
-            )
-        )
-    elif station_obj.plottype == "Parameters all":
-        all_params = ",".join(
-            [str(value) for value in get_parameters(station_obj.station, db).values()]
-        )
-        return populate_plot(
-            plottypes.ParametersAll(
-                all_params,
-                [station_obj.station],
-                db,
-                station_obj,
-            )
-        )
+        return ",".join([station_obj.parameter, station_obj.parameter2]), [
+            station_obj.station
+        ]
+    all_params = ",".join(
+        [str(value) for value in get_parameters(station_obj.station, db).values()]
+    )
+    return all_params, [station_obj.station]
+
+
+def create_plot(station_obj: schemas.StationCreate, db: _orm.Session):
+    plot_class = PLOT_CLASSES.get(station_obj.plottype)
+    if plot_class is None:
+        return None
+    all_params, stations = plot_selection(station_obj, db)
+    return populate_plot(plot_class(all_params, stations, db, station_obj))
+
+
+def stream_plot(station_obj: schemas.StationCreate, db: _orm.Session) -> Iterator[str]:
+    """
+    NDJSON lines of StationsCompare.stream_fig. Other plot types hold a single station
+    and are sent as one figure message.
+    """
+    if station_obj.plottype != "Stations compare":
+        yield f'{{"type":"figure","figure":{render_plot(station_obj, db)}}}\n'
+        return
+    all_params, stations = plot_selection(station_obj, db)
+    plot = plottypes.StationsCompare(all_params, stations, db, station_obj)
+    message: Dict[str, Any] = {}
+    for message in plot.stream_fig():
+        yield plottypes.message_json(message) + "\n"
+    if message.get("type") != "error":
+        request_tracker.record(request_key(station_obj), station_obj.dict())
+
+
+def get_data(
+    station_obj: schemas.StationCreate, db: _orm.Session
+) -> Tuple[List[Dict[str, Any]], List[str | None]]:
+    """
+    Observations for the selection of a plot type without creating the figure.
+    Returns the observation list (empty if no station returned observations) and the
+    station names in the same order.
+    """
+    all_params, stations = plot_selection(station_obj, db)
+    observation_list = plottypes.get_series(stations, all_params, station_obj.timerange)
+    index = catalog.get_index(db)
+    names = [index.station_name(obs["stationId"]) for obs in observation_list]
+    return observation_list, names
+
+
+def get_statistics(
+    request: schemas.StatisticsRequest, now: datetime | None = None
+) -> Dict[str, Any] | None:
+    """
+    Daily statistics of the requested stations and parameters, None if no station
+    returned observations. Only days completely inside a relative time range and
+    ended SUMMARY_CACHE_GRACE seconds before now are cached, the first day of the
+    range is partial.
+    """
+    now = now or datetime.now(timezone.utc)
+    observation_list = plottypes.get_series(
+        request.stations, request.parameter, request.timerange
+    )
+    if not observation_list:
+        return None
+    resolution, _ = timerange.plan_requests(request.timerange, now)
+    complete_from = None
+    span = timerange.parse_span(request.timerange)
+    if span is not None:
+        start = now - span
+        first_day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        if first_day < start:
+            first_day += timedelta(days=1)
+        complete_from = np.datetime64(first_day.replace(tzinfo=None), "D")
+    complete_until = now - timedelta(seconds=summaries.SUMMARY_CACHE_GRACE)
+    return summaries.statistics_table(
+        observation_list,
+        request.percentiles,
+        request.rolling_days,
+        resolution,
+        complete_from,
+        np.datetime64(complete_until.replace(tzinfo=None), "s"),
+    )
 
 
 def populate_plot(station_obj: plottypes.Plot):
-    observation_list = station_obj.fetch_series()
+    return figure_from_series(station_obj, station_obj.fetch_series())
+
+
+def figure_from_series(
+    station_obj: plottypes.Plot, observation_list: List[Dict[str, Any]]
+):
     if not observation_list:
         return plottypes.set_error_string()
     fig = station_obj.create_fig(observation_list)
     if not fig:
         return plottypes.set_error_string()
-    graphJSON: str | None = pt.io.to_json(fig, pretty=True)  # type: ignore # todo type safe return to_json
-    return graphJSON
+    return plottypes.figure_json(fig)
@@ -0,0 +1,84 @@
+from typing import Any, Awaitable, Callable, Dict
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key. The first caller runs the function,
+    callers arriving while it runs wait for it and get the same result or exception.
+    The key is released as soon as the call finishes, results are not cached.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._stats: Dict[str, int] = {"executed": 0, "coalesced": 0}
+
+    def do(self, key: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self._stats["executed"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines of one event loop. Waiting callers are shielded, a
+    cancelled caller does not cancel the call the others wait for.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._stats: Dict[str, int] = {"executed": 0, "coalesced": 0}
+
+    async def do(
+        self, key: str, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any
+    ) -> Any:
+        call = self._calls.get(key)
+        if call is not None:
+            self._stats["coalesced"] += 1
+            return await asyncio.shield(call)
+        self._stats["executed"] += 1
+        call = asyncio.ensure_future(fn(*args, **kwargs))
+        self._calls[key] = call
+        call.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(call)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats, in_flight=len(self._calls))
@@ -0,0 +1,177 @@
+from typing import Any, Dict, List, Set
+import os
+
+import numpy as np
+import pandas as pd
+
+import cache
+
+"""
+Daily statistics of observation series. Every day of a series is summarized with
+count, sum, min, mean, max and percentiles, computed for all days at once with a
+pandas groupby. Days lying completely inside the requested range do not change anymore
+once they ended SUMMARY_CACHE_GRACE seconds before the fetch (hydapi publishes late) and
+observations of a later day were received. Their summary is cached per station,
+parameter, resolution and day and not computed again. The rolling mean over the last rolling_days days is derived
+from the daily counts and sums.
+"""
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", str(7 * 24 * 3600)))
+SUMMARY_CACHE_GRACE = float(os.getenv("SUMMARY_CACHE_GRACE", str(6 * 3600)))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "50000"))
+STATISTICS = ["count", "sum", "min", "mean", "max"]
+
+summary_cache = cache.create_cache(
+    os.getenv("SUMMARY_CACHE", cache.CACHE_BACKEND),
+    SUMMARY_CACHE_SIZE,
+    SUMMARY_CACHE_TTL,
+    namespace="nve-stats",
+)
+
+
+def percentile_columns(percentiles: List[float]) -> List[str]:
+    return [f"p{p:g}" for p in percentiles]
+
+
+def daily_summary(
+    times: np.ndarray, values: np.ndarray, percentiles: List[float]
+) -> pd.DataFrame:
+    """
+    One row per UTC day with observations, indexed by day (datetime64[D]).
+    """
+    days = pd.Index(times.astype("datetime64[D]"), name="day")
+    grouped = pd.Series(values, index=days).groupby(level="day")
+    summary = grouped.agg(STATISTICS)
+    if percentiles:
+        quantiles = grouped.quantile([p / 100 for p in percentiles]).unstack()
+        quantiles.columns = percentile_columns(percentiles)
+        summary = summary.join(quantiles)
+    summary["count"] = summary["count"].astype(np.int64)
+    return summary
+
+
+def summary_key(
+    station: str, parameter: str, resolution: int, day: Any, percentiles: List[float]
+) -> str:
+    columns = ",".join(percentile_columns(percentiles))
+    return f"stats:{station}:{parameter}:{resolution}:{day}:{columns}"
+
+
+def cached_daily_summary(
+    station: str,
+    parameter: str,
+    times: np.ndarray,
+    values: np.ndarray,
+    percentiles: List[float],
+    resolution: int = 0,
+    complete_from: np.datetime64 | None = None,
+    complete_until: np.datetime64 | None = None,
+) -> pd.DataFrame:
+    """
+    Daily summary with the days between complete_from and complete_until served from
+    and stored in summary_cache. A day is only complete when a later day has
+    observations, the last day received may still be missing its last observations.
+    Without complete_from nothing is cached.
+    """
+    days = times.astype("datetime64[D]")
+    unique_days = np.unique(days)
+    cacheable: Set[np.datetime64] = set()
+    if complete_from is not None and complete_until is not None and len(days):
+        cacheable = {
+            day
+            for day in unique_days
+            if day >= complete_from
+            and day + np.timedelta64(1, "D") <= complete_until
+            and day < unique_days[-1]
+        }
+    cached: Dict[np.datetime64, Dict[str, Any]] = {}
+    for day in cacheable:
+        summary = summary_cache.get(
+            summary_key(station, parameter, resolution, day, percentiles)
+        )
+        if summary is not None:
+            cached[day] = summary
+
+    columns = STATISTICS + percentile_columns(percentiles)
+    frames: List[pd.DataFrame] = []
+    compute = ~np.isin(days, np.array(list(cached), dtype="datetime64[D]"))
+    if compute.any():
+        computed = daily_summary(times[compute], values[compute], percentiles)
+        for day, row in computed.iterrows():
+            day = np.datetime64(day, "D")
+            if day in cacheable:
+                summary_cache.set(
+                    summary_key(station, parameter, resolution, day, percentiles),
+                    {column: float(value) for column, value in row.items()},
+                )
+        frames.append(computed)
+    if cached:
+        from_cache = pd.DataFrame.from_dict(cached, orient="index")
+        from_cache.index = pd.Index(
+            np.array(list(cached), dtype="datetime64[D]"), name="day"
+        )
+        from_cache["count"] = from_cache["count"].astype(np.int64)
+        frames.append(from_cache[columns])
+    if not frames:
+        return pd.DataFrame(
+            columns=columns,
+            index=pd.DatetimeIndex([], name="day", dtype="datetime64[s]"),
+        )
+    return pd.concat(frames).sort_index()
+
+
+def add_rolling_mean(summary: pd.DataFrame, rolling_days: int) -> pd.DataFrame:
+    """
+    Mean of all observations of the rolling_days days up to and including each day,
+    days without observations inside the window count as empty.
+    """
+    if rolling_days < 1 or summary.empty:
+        summary["rolling_mean"] = np.nan
+        return summary
+    daily = summary[["count", "sum"]].asfreq("D", fill_value=0)
+    window = daily.rolling(rolling_days, min_periods=1).sum()
+    summary["rolling_mean"] = (window["sum"] / window["count"]).reindex(summary.index)
+    return summary
+
+
+def statistics_table(
+    observation_list: List[Dict[str, Any]],
+    percentiles: List[float],
+    rolling_days: int = 7,
+    resolution: int = 0,
+    complete_from: np.datetime64 | None = None,
+    complete_until: np.datetime64 | None = None,
+) -> Dict[str, Any]:
+    """
+    Columnar table with one row per station, parameter and day.
+    """
+    frames: List[pd.DataFrame] = []
+    for station in observation_list:
+        for column in station:
+            if not column.endswith("_value"):
+                continue
+            parameter = column.removesuffix("_value")
+            summary = cached_daily_summary(
+                station["stationId"],
+                parameter,
+                station[f"{column}_time"],
+                station[column],
+                percentiles,
+                resolution,
+                complete_from,
+                complete_until,
+            )
+            summary = add_rolling_mean(summary, rolling_days)
+            summary.insert(0, "parameter", parameter)
+            summary.insert(0, "stationId", station["stationId"])
+            frames.append(summary.reset_index())
+    columns = (
+        ["stationId", "parameter", "day"]
+        + STATISTICS
+        + percentile_columns(percentiles)
+        + ["rolling_mean"]
+    )
+    if not frames:
+        return {column: [] for column in columns}
+    table = pd.concat(frames, ignore_index=True)
+    table["day"] = table["day"].dt.strftime("%Y-%m-%d")
+    return {column: table[column].to_numpy() for column in columns}
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from align import align, align_asof, align_resample
+
+
+def minutes(*offsets: int) -> np.ndarray:
+    return np.datetime64("2023-01-01T00:00", "ns") + np.array(
+        offsets, dtype="timedelta64[m]"
+    ).astype("timedelta64[ns]")
+
+
+# Vannstand every 10 minutes, Vannføring hourly and 2 minutes late.
+STATION = {
+    "Vannstand_value": np.arange(13, dtype=np.float64),
+    "Vannstand_value_time": minutes(*range(0, 130, 10)),
+    "Vannføring_value": np.array([100.0, 160.0, 220.0]),
+    "Vannføring_value_time": minutes(2, 62, 122),
+}
+
+
+def test_asof_pairs_by_time_not_position():
+    aligned = align_asof(STATION)
+
+    assert list(aligned.columns) == ["time", "Vannstand_value", "Vannføring_value"]
+    assert list(aligned["time"]) == list(pd.to_datetime(minutes(2, 62, 122)))
+    # Nearest Vannstand to minute 2, 62 and 122 is at minute 0, 60 and 120.
+    assert list(aligned["Vannstand_value"]) == [0.0, 6.0, 12.0]
+    assert list(aligned["Vannføring_value"]) == [100.0, 160.0, 220.0]
+
+
+def test_asof_tolerance_leaves_gaps():
+    station = dict(STATION, Vannstand_value_time=minutes(*range(30, 160, 10)))
+    aligned = align_asof(station, pd.Timedelta("5min"))
+
+    assert np.isnan(aligned["Vannstand_value"].iloc[0])
+    assert aligned["Vannstand_value"].iloc[1] == 3.0
+
+
+def test_resample_buckets():
+    aligned = align_resample(STATION, "1h")
+
+    assert len(aligned) == 3
+    assert list(aligned["Vannstand_value"]) == [2.5, 8.5, 12.0]
+    assert list(aligned["Vannføring_value"]) == [100.0, 160.0, 220.0]
+
+
+def test_align_selects_method_and_handles_empty():
+    assert len(align(STATION, method="resample", bucket="30min")) == 5
+    assert list(align({}).columns) == ["time"]
@@ -1,13 +1,40 @@
-from typing import Any, Dict
+from typing import Any, Dict, List
+import asyncio
+import json
+import threading
+import time
 from fastapi.testclient import TestClient
 import pytest
 from sqlalchemy.orm import Session, sessionmaker
 import sqlalchemy as sql
 from main import app
+import database
+import models
+from catalog import CatalogIndex
+from cache import MemoryBackend, NullBackend
+from popularity import FrequencyTracker
+from ratelimit import RateGovernor
+import schemas
+import services
+import columnar
 from database import get_db, Base
-from populate_db import all_station_params
-from api import api_call
-from plottypes import set_error_string, get_station_name
+from populate_db import (
+    all_station_params,
+    build_catalog_rows,
+    refresh_catalog,
+    sync_station_params,
+)
+from api import api_call, get_session, close_session
+import api
+import plottypes
+import tsstore
+import align
+import numpy as np
+from plottypes import (
+    get_station_name,
+    parse_observations,
+    set_error_string,
+)
 
 DATABASE_URL = "sqlite:///:memory:.db"
 engine = sql.create_engine(
@@ -81,6 +108,53 @@ def test_api_call_fail():
     assert response is None
 
 
+def test_api_call_retries_take_tokens(monkeypatch: pytest.MonkeyPatch):
+    governor = RateGovernor(rate=100, burst=5)
+    monkeypatch.setattr(api, "governor", governor)
+    adapter = api.requests_retry_session().get_adapter("https://hydapi.nve.no")
+    retry = adapter.max_retries.new(backoff_factor=0)
+    assert isinstance(retry, api.GovernedRetry)
+
+    retry.sleep()
+    retry.sleep()
+    assert governor.stats()["requests"] == 2
+
+
+def test_api_call_async_retries_take_tokens(monkeypatch: pytest.MonkeyPatch):
+    class Response:
+        def __init__(self, status_code: int, headers: Dict[str, str]):
+            self.status_code = status_code
+            self.headers = headers
+
+        def json(self) -> Dict[str, Any]:
+            return {"data": []}
+
+    responses = [Response(503, {"Retry-After": "0"}), Response(200, {})]
+
+    class Client:
+        async def get(self, url: str, headers: Dict[str, str]) -> Response:
+            return responses.pop(0)
+
+    governor = RateGovernor(rate=100, burst=5)
+    monkeypatch.setattr(api, "get_async_client", lambda: Client())
+    monkeypatch.setattr(api, "governor", governor)
+
+    assert asyncio.run(api.api_call_async("https://hydapi.nve.no")) == {"data": []}
+    assert governor.stats()["requests"] == 2
+    assert api.retry_after({"Retry-After": "2"}) == 2.0
+    assert api.retry_after({}) is None
+
+
+def test_session_is_shared():
+    session = get_session()
+
+    assert all(get_session() is session for _ in range(3))
+    adapter = session.get_adapter("https://hydapi.nve.no")
+    assert adapter.poolmanager.connection_pool_kw["maxsize"] == api.HYDAPI_POOL_SIZE
+    close_session()
+    assert get_session() is not session
+
+
 def test_get_station_name_fail(db: Session):
     name = get_station_name(["9.99.9"], db)
 
@@ -112,6 +186,39 @@ def test_parameters_all(db: Session):
     }
 
 
+def test_catalog_etag_not_modified(db: Session):
+    response = client.get("api/stations_all")
+    etag = response.headers["etag"]
+
+    assert response.headers["cache-control"].startswith("public, max-age=")
+    cached = client.get("api/stations_all", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag
+    assert cached.content == b""
+    stale = client.get("api/stations_all", headers={"If-None-Match": '"0.x-y"'})
+    assert stale.status_code == 200
+
+
+def test_catalog_etag_depends_on_request(db: Session):
+    first = client.post("api/stations", json={"parameter": 1000})
+    second = client.post("api/stations", json={"parameter": 1001})
+
+    assert first.headers["etag"] != second.headers["etag"]
+    cached = client.post(
+        "api/stations",
+        json={"parameter": 1000},
+        headers={"If-None-Match": f'W/{first.headers["etag"]}, "other"'},
+    )
+    assert cached.status_code == 304
+    timerange = client.get("api/timerange")
+    assert (
+        client.get(
+            "api/timerange", headers={"If-None-Match": timerange.headers["etag"]}
+        ).status_code
+        == 304
+    )
+
+
 def test_stations_fail(db: Session):
     response = client.post("api/stations", json={"parameter": 99999999})
 
@@ -149,6 +256,9 @@ def test_timerange():
         "P2D/": "2 Days",
         "P3D/": "3 Days",
         "P7D/": "1 Week",
+        "P30D/": "1 Month",
+        "P365D/": "1 Year",
+        "P1825D/": "5 Years",
     }
 
 
@@ -167,7 +277,7 @@ def test_series_stations_compare_fail(db: Session):
     )
 
     assert response.status_code == 200
-    assert response.json() == set_error_string()
+    assert response.text == set_error_string()
 
 
 def test_series_parameters_all_fail(db: Session):
@@ -185,7 +295,7 @@ def test_series_parameters_all_fail(db: Session):
     )
 
     assert response.status_code == 200
-    assert response.json() == set_error_string()
+    assert response.text == set_error_string()
 
 
 def test_series_parameters_all_ok(db: Session):
@@ -203,7 +313,84 @@ def test_series_parameters_all_ok(db: Session):
     )
 
     assert response.status_code == 200
-    assert response.json() != set_error_string()
+    assert response.text != set_error_string()
+
+
+def test_series_parameter_correlation(db: Session):
+    selection = {
+        "station": "1.200.0",
+        "parameter": "1000",
+        "parameter2": "1001",
+        "timerange": "P1D/",
+        "plottype": "Parameter correlation",
+    }
+    figure = client.post("api/series", json=selection).json()
+
+    assert [trace["type"] for trace in figure["data"]] == ["heatmap", "heatmap"]
+    assert figure["data"][0]["x"] == ["Vannstand", "Vannføring", "Vanntemperatur"]
+    assert figure["data"][0]["z"][0][0] == 1.0
+
+    selection["top_k"] = 2
+    figure = client.post("api/series", json=selection).json()
+    assert [trace["type"] for trace in figure["data"]] == ["scattergl", "scattergl"]
+
+    for top_k in (-1, schemas.TOP_K_MAX + 1):
+        selection["top_k"] = top_k
+        assert client.post("api/series", json=selection).status_code == 422
+
+
+def test_series_returns_compact_compressed_figure(db: Session):
+    response = client.post(
+        "api/series",
+        json={
+            "station": "1.15.0",
+            "station2": "1.15.0",
+            "station3": "1.200.0",
+            "parameter": "1000",
+            "parameter2": "1004",
+            "timerange": "P1D/",
+            "plottype": "Parameters all",
+        },
+        headers={"Accept-Encoding": "gzip"},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["content-encoding"] == "gzip"
+    assert "\n" not in response.text
+    figure = response.json()
+    assert isinstance(figure["data"][0]["y"], list)
+
+
+def test_figure_json_typed_arrays(monkeypatch: pytest.MonkeyPatch):
+    fig = plottypes.Figure(
+        data=[{"type": "scattergl", "y": np.array([1.0, 2.0])}], _validate=False
+    )
+
+    assert json.loads(plottypes.figure_json(fig))["data"][0]["y"] == [1.0, 2.0]
+    monkeypatch.setattr(plottypes, "PLOT_TYPED_ARRAYS", True)
+    assert json.loads(plottypes.figure_json(fig))["data"][0]["y"] == {
+        "dtype": "f8",
+        "bdata": "AAAAAAAA8D8AAAAAAAAAQA==",
+    }
+
+
+def test_series_parameters_all_long_range(db: Session):
+    response = client.post(
+        "api/series",
+        json={
+            "station": "1.15.0",
+            "station2": "1.15.0",
+            "station3": "1.200.0",
+            "parameter": "1000",
+            "parameter2": "1004",
+            "timerange": "P1825D/",
+            "plottype": "Parameters all",
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.text != set_error_string()
 
 
 def test_series_parameters_compare(db: Session):
@@ -221,7 +408,7 @@ def test_series_parameters_compare(db: Session):
     )
 
     assert response.status_code == 200
-    assert response.json() != set_error_string()
+    assert response.text != set_error_string()
 
 
 def test_series_parameters_compare_fail(db: Session):
@@ -239,7 +426,7 @@ def test_series_parameters_compare_fail(db: Session):
     )
 
     assert response.status_code == 200
-    assert response.json() == set_error_string()
+    assert response.text == set_error_string()
 
 
 def test_series_parameters_matrix(db: Session):
@@ -257,7 +444,7 @@ def test_series_parameters_matrix(db: Session):
     )
 
     assert response.status_code == 200
-    assert response.json() != set_error_string()
+    assert response.text != set_error_string()
 
 
 def test_series_stations_compare(db: Session):
@@ -275,4 +462,681 @@ def test_series_stations_compare(db: Session):
     )
 
     assert response.status_code == 200
-    assert response.json() != set_error_string()
+    assert response.text != set_error_string()
+
+
+def test_series_async_matches_sync(db: Session, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(services, "figure_cache", MemoryBackend(8, 600))
+    selection = {
+        "station": "1.15.0",
+        "stations": ["1.15.0", "9.99.9", "1.200.0"],
+        "parameter": "1000",
+        "parameter2": "1004",
+        "timerange": "P365D/",
+        "plottype": "Stations compare",
+    }
+    executed = services.series_flight_async.stats()["executed"]
+    response = client.post("api/series", json=selection)
+
+    assert response.status_code == 200
+    assert services.series_flight_async.stats()["executed"] == executed + 1
+    sync = services.create_plot(schemas.StationCreate(**selection), db)
+    assert response.text == sync != set_error_string()
+
+
+def test_shared_async_render_does_not_use_the_session(db: Session):
+    station_obj = schemas.StationCreate(
+        station="1.15.0",
+        parameter="1000",
+        parameter2="1004",
+        timerange="P1D/",
+        plottype="Parameters compare",
+    )
+    plot = services.prepare_plot(station_obj, db)
+    assert plot is not None
+    # The session of the first request may be closed while the render is shared.
+    plot.db = None  # type: ignore
+    figure = asyncio.run(services.render_to_cache_async(plot, "fig:test"))
+
+    assert figure == services.create_plot(station_obj, db) != set_error_string()
+
+
+def test_series_unknown_plottype():
+    selection = {
+        "station": "1.15.0",
+        "parameter": "1000",
+        "parameter2": "1004",
+        "timerange": "P1D/",
+        "plottype": "Pie chart",
+    }
+
+    for url in ["api/series", "api/series/stream"]:
+        response = client.post(url, json=selection)
+        assert response.status_code == 400
+        assert "Pie chart" in response.json()["detail"]
+
+
+def test_series_stream_sends_stations_as_completed(db: Session):
+    selection = {
+        "station": "1.15.0",
+        "station2": "9.99.9",
+        "station3": "1.200.0",
+        "parameter": "1000",
+        "parameter2": "1004",
+        "timerange": "P1D/",
+        "plottype": "Stations compare",
+    }
+    response = client.post("api/series/stream", json=selection)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert "content-encoding" not in response.headers
+    messages = [json.loads(line) for line in response.text.splitlines()]
+    assert [message["type"] for message in messages] == [
+        "layout",
+        "trace",
+        "trace",
+        "trace",
+        "layout",
+    ]
+    assert messages[-1]["final"] is True
+    traces = {message["stationId"]: message for message in messages[1:4]}
+    assert traces["9.99.9"]["trace"] is None
+    assert traces["1.200.0"]["trace"]["yaxis"] == "y3"
+    assert [point["row"] for point in messages[-1]["layout"]["meta"]["points"]] == [
+        1,
+        3,
+    ]
+
+    selection["plottype"] = "Parameters all"
+    response = client.post("api/series/stream", json=selection)
+    messages = [json.loads(line) for line in response.text.splitlines()]
+    assert [message["type"] for message in messages] == ["figure"]
+    assert "layout" in messages[0]["figure"]
+
+
+def test_data_columnar(db: Session, monkeypatch: pytest.MonkeyPatch):
+    selection = {
+        "station": "1.15.0",
+        "station2": "1.15.0",
+        "station3": "1.200.0",
+        "parameter": "1000",
+        "parameter2": "1004",
+        "timerange": "P1D/",
+        "plottype": "Stations compare",
+    }
+    response = client.post("api/data", json=selection)
+
+    assert response.status_code == 200
+    stations = response.json()["stations"]
+    assert [station["stationId"] for station in stations] == ["1.15.0", "1.200.0"]
+    series = stations[0]["series"]["Vannstand"]
+    assert len(series["time"]) == len(series["value"]) > 0
+    monkeypatch.setattr(columnar, "pa", None)
+    response = client.post("api/data?format=arrow", json=selection)
+    assert response.status_code == 406
+
+
+def test_statistics():
+    request = {"stations": ["1.15.0"], "parameter": "1000", "timerange": "P2D/"}
+    response = client.post("api/statistics", json=request)
+
+    assert response.status_code == 200
+    table = response.json()
+    assert set(table["stationId"]) == {"1.15.0"}
+    assert len(table["day"]) == len(table["p50"]) == len(table["rolling_mean"]) > 0
+    response = client.post("api/statistics", json=dict(request, percentiles=[150]))
+    assert response.status_code == 422
+    response = client.post(
+        "api/statistics", json=dict(request, percentiles=[50, 50.0, 95])
+    )
+    assert response.status_code == 200
+    assert "p50" in response.json() and "p95" in response.json()
+
+
+def test_metrics():
+    response = client.get("api/metrics")
+
+    assert response.status_code == 200
+    assert {"hits", "misses", "evictions"} <= set(response.json()["observation_cache"])
+
+
+def test_figure_cache_and_prewarm(db: Session, monkeypatch: pytest.MonkeyPatch):
+    rendered: List[str] = []
+
+    def fake_create_plot(station_obj: schemas.StationCreate, db: Session) -> str:
+        rendered.append(station_obj.station)
+        return f"figure {station_obj.station}"
+
+    async def fake_render_to_cache_async(plot: plottypes.Plot, key: str) -> str:
+        figure = fake_create_plot(plot.station_obj, db)
+        await services.figure_cache.set_async(key, figure)
+        return figure
+
+    monkeypatch.setattr(services, "create_plot", fake_create_plot)
+    monkeypatch.setattr(services, "render_to_cache_async", fake_render_to_cache_async)
+    monkeypatch.setattr(services, "figure_cache", MemoryBackend(8, 600))
+    monkeypatch.setattr(services, "request_tracker", FrequencyTracker())
+    monkeypatch.setattr(services.ratelimit, "governor", RateGovernor(burst=10))
+    station_obj = schemas.StationCreate(
+        station="1.15.0",
+        station2="1.15.0",
+        station3="1.200.0",
+        parameter="1000",
+        parameter2="1004",
+        timerange="P1D/",
+        plottype="Parameters all",
+    )
+
+    assert services.render_plot(station_obj, db) == "figure 1.15.0"
+    assert services.render_plot(station_obj, db) == "figure 1.15.0"
+    assert rendered == ["1.15.0"]
+
+    # Close to the end of the bucket the next bucket is rendered ahead.
+    bucket = services.freshness_bucket()
+    now = (bucket + 1) * services.FIGURE_FRESHNESS - 1
+    assert asyncio.run(services.prewarm_figures(db, now)) == 1
+    assert rendered == ["1.15.0", "1.15.0"]
+    assert services.figure_cache.get(
+        services.figure_key(station_obj, db, bucket + 1)
+    ) == ("figure 1.15.0")
+    assert asyncio.run(services.prewarm_figures(db, now)) == 0
+
+    # Nothing is prewarmed while the rate governor is low on tokens.
+    services.figure_cache.clear()
+    governor = RateGovernor(rate=1, burst=2, clock=lambda: 0.0)
+    monkeypatch.setattr(services.ratelimit, "governor", governor)
+    assert asyncio.run(services.prewarm_figures(db, now)) == 0
+
+
+def test_failed_renders_are_not_tracked(db: Session, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(
+        services, "create_plot", lambda station_obj, db: plottypes.set_error_string()
+    )
+    monkeypatch.setattr(services, "figure_cache", MemoryBackend(8, 600))
+    monkeypatch.setattr(services, "request_tracker", FrequencyTracker())
+    station_obj = schemas.StationCreate(
+        station="1.15.0",
+        parameter="1000",
+        parameter2="1004",
+        timerange="P1D/",
+        plottype="Parameters all",
+    )
+
+    assert services.render_plot(station_obj, db) == plottypes.set_error_string()
+    assert len(services.request_tracker) == 0
+
+
+def test_get_series_keeps_order_and_isolates_failures(monkeypatch: pytest.MonkeyPatch):
+    def fake_fetch(station: str, parameters: str, reference_time: str):
+        if station == "2.2.2":
+            raise ValueError("upstream failure")
+        return {"stationId": station, "Vannstand_value": [1.0]}
+
+    monkeypatch.setattr(plottypes, "fetch_station_series", fake_fetch)
+    series = plottypes.get_series(["1.1.1", "2.2.2", "3.3.3"], "1000")
+
+    assert [obs["stationId"] for obs in series] == ["1.1.1", "2.2.2", "3.3.3"]
+    assert series[1] == {"stationId": "2.2.2"}
+    assert plottypes.get_series(["2.2.2"], "1000") == []
+
+
+def test_iter_series_bounds_parallel_fetches(monkeypatch: pytest.MonkeyPatch):
+    lock = threading.Lock()
+    running: List[int] = [0]
+    peak: List[int] = [0]
+
+    def fake_fetch(station: str, parameters: str, reference_time: str):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.005)
+        with lock:
+            running[0] -= 1
+        return {"stationId": station, "Vannstand_value": [1.0]}
+
+    monkeypatch.setattr(plottypes, "fetch_station_series", fake_fetch)
+    stations = [f"{inc}.1.0" for inc in range(12)]
+    results = dict(plottypes.iter_series(stations, "1000", max_parallel=2))
+
+    assert sorted(results) == list(range(12))
+    assert peak[0] <= 2
+
+
+def test_compare_stations_deduplicates():
+    station_obj = schemas.StationCreate(
+        station="1.15.0",
+        station2="1.200.0",
+        station3="1.15.0",
+        parameter="1000",
+        parameter2="1004",
+        timerange="P1D/",
+        plottype="Stations compare",
+    )
+    assert services.compare_stations(station_obj) == ["1.15.0", "1.200.0"]
+
+    station_obj.stations = ["3.3.3", "1.15.0", "", "3.3.3", "2.2.2"]
+    assert services.compare_stations(station_obj) == ["3.3.3", "1.15.0", "2.2.2"]
+    with pytest.raises(ValueError):
+        schemas.StationCreate(**dict(station_obj.dict(), stations=["1.1.1"] * 51))
+
+
+def test_stations_compare_overlay(db: Session):
+    selection = {
+        "station": "",
+        "parameter": "1000",
+        "parameter2": "",
+        "timerange": "P1D/",
+        "plottype": "Stations compare",
+        "stations": ["1.200.0", "9.99.9", "1.15.0", "1.200.0"],
+        "layout": "overlay",
+    }
+    figure = client.post("api/series", json=selection).json()
+
+    assert [trace["name"] for trace in figure["data"]] == ["Lierelv", "Femsjø"]
+    assert {trace["yaxis"] for trace in figure["data"]} == {"y"}
+    assert figure["layout"]["showlegend"] is True
+    assert figure["layout"]["height"] == 600
+
+    selection["layout"] = "grid"
+    figure = client.post("api/series", json=selection).json()
+    assert [trace["yaxis"] for trace in figure["data"]] == ["y", "y3"]
+    assert [a["text"] for a in figure["layout"]["annotations"]] == [
+        "Lierelv",
+        "9.99.9",
+        "Femsjø",
+        "No data returned from API",
+    ]
+
+    selection["layout"] = "stacked"
+    assert client.post("api/series", json=selection).status_code == 422
+
+
+def test_build_catalog_rows():
+    stations = {
+        "data": [
+            {
+                "stationId": "1.1.1",
+                "stationName": "A",
+                "seriesList": [
+                    {"parameter": 1000, "parameterName": "Vannstand"},
+                    {"parameter": 1001, "parameterName": "Vannføring"},
+                ],
+            },
+            {
+                "stationId": "1.1.1",
+                "stationName": "A",
+                "seriesList": [{"parameter": 1000, "parameterName": "Vannstand"}],
+            },
+        ]
+    }
+    station_rows, parameter_rows = build_catalog_rows(stations)
+
+    assert station_rows == [{"code": "1.1.1", "name": "A"}]
+    assert [row["code"] for row in parameter_rows] == [1000, 1001]
+    assert all(row["station_code"] == "1.1.1" for row in parameter_rows)
+
+
+def test_refresh_catalog_swaps_in_shadow(
+    tmp_path: Any, monkeypatch: pytest.MonkeyPatch
+):
+    engine_before_swap = database.engine
+    monkeypatch.setattr(database, "DATABASE_PATH", str(tmp_path / "database.db"))
+    monkeypatch.setattr(database, "DATABASE_PATH_COPY", str(tmp_path / "copy.db"))
+    monkeypatch.setattr(database, "_db_identity", None)
+    monkeypatch.setattr(database, "engine", engine_before_swap)
+    stations = {
+        "data": [
+            {
+                "stationId": "1.1.1",
+                "stationName": "A",
+                "seriesList": [{"parameter": 1000, "parameterName": "Vannstand"}],
+            }
+        ]
+    }
+    generation = database.catalog_generation
+    try:
+        refresh_catalog(stations, str(tmp_path / "shadow.db"))
+
+        # Building the shadow database leaves the live index alone until the swap.
+        assert database.catalog_generation == generation
+        assert database.reload_if_swapped()
+        assert database.catalog_generation == generation + 1
+        with database.SessionLocal() as session:
+            assert session.query(models.Station.code).all() == [("1.1.1",)]
+        assert not database.reload_if_swapped()
+
+        with pytest.raises(ValueError):
+            refresh_catalog({"data": []}, str(tmp_path / "shadow.db"))
+    finally:
+        database.engine.dispose()
+        database.SessionLocal.configure(bind=engine_before_swap)
+
+
+def test_sync_station_params():
+    sync_engine = sql.create_engine("sqlite://")
+    Base.metadata.create_all(bind=sync_engine)
+
+    def catalog(*stations: Any) -> Dict[str, Any]:
+        return {
+            "data": [
+                {
+                    "stationId": code,
+                    "stationName": name,
+                    "seriesList": [
+                        {"parameter": param, "parameterName": f"p{param}"}
+                        for param in params
+                    ],
+                }
+                for code, name, params in stations
+            ]
+        }
+
+    with Session(sync_engine) as session:
+        first = sync_station_params(catalog(("1.1.1", "A", [1000, 1001])), session)
+        assert first["version"] == 1
+        assert first["stations"]["inserted"] == 1
+        assert first["parameters"]["inserted"] == 2
+
+        unchanged = sync_station_params(catalog(("1.1.1", "A", [1000, 1001])), session)
+        assert not unchanged["changed"]
+        assert unchanged["version"] == 1
+
+        changed = sync_station_params(
+            catalog(("1.1.1", "A renamed", [1000]), ("2.2.2", "B", [1000])), session
+        )
+        assert changed["version"] == 2
+        assert changed["stations"] == {"inserted": 1, "updated": 1, "deleted": 0}
+        assert changed["parameters"] == {"inserted": 1, "updated": 0, "deleted": 1}
+
+        removed = sync_station_params(catalog(("2.2.2", "B", [1000])), session)
+        assert removed["stations"]["deleted"] == 1
+        assert removed["parameters"]["deleted"] == 1
+        assert session.query(models.Parameter).count() == 1
+
+
+def test_catalog_index():
+    index = CatalogIndex(
+        3,
+        0,
+        [("1.1.1", "A"), ("2.2.2", "B")],
+        [
+            ("1.1.1", "Vannstand", "1000"),
+            ("1.1.1", "Vannføring", "1001"),
+            ("2.2.2", "Vannstand", "1000"),
+        ],
+    )
+
+    assert index.version == 3
+    assert index.station_name("2.2.2") == "B"
+    assert index.station_name("9.99.9") is None
+    assert dict(index.stations_all()) == {"A": "1.1.1", "B": "2.2.2"}
+    assert dict(index.parameters_for_station("1.1.1")) == {
+        "Vannstand": "1000",
+        "Vannføring": "1001",
+    }
+    assert dict(index.stations_for_parameter(1000)) == {"A": "1.1.1", "B": "2.2.2"}
+    assert dict(index.stations_for_parameter("1001")) == {"A": "1.1.1"}
+    assert dict(index.parameters_for_station("9.99.9")) == {}
+    with pytest.raises(TypeError):
+        index.stations_all()["C"] = "3.3.3"  # type: ignore
+    assert index.etag("stations", "1000") == index.etag("stations", "1000")
+    assert index.etag("stations", "1000") != index.etag("stations", "1001")
+    assert index.etag("stations_all").startswith('"3.')
+
+
+def test_parse_observations_columnar():
+    observations = {
+        "data": [
+            {
+                "stationId": "1.15.0",
+                "parameterName": "Vannstand",
+                "observations": [
+                    {"time": "2023-01-01T00:00:00.0000000Z", "value": 1.5},
+                    {"time": "2023-01-01T01:00:00.0000000Z", "value": None},
+                    {"time": None, "value": 3.0},
+                    {"value": 4.0},
+                    {"time": "2023-01-01T02:00:00.0000000Z", "value": 0.0},
+                ],
+            },
+            {
+                "stationId": "1.15.0",
+                "parameterName": "Magasinvolum",
+                "observations": [{"time": "2023-01-01T00:00:00Z", "value": 7}],
+            },
+        ]
+    }
+    obs = parse_observations(observations)
+
+    assert obs.pop("stationId") == "1.15.0"
+    assert obs["Vannstand_value"].dtype == "float64"
+    assert obs["Vannstand_value"].tolist() == [1.5, 0.0]
+    assert str(obs["Vannstand_value_time"][1]) == "2023-01-01T02:00:00.000000000"
+
+
+def test_parameter_names_keep_their_letters():
+    times = np.arange("2023-01-01", "2023-01-02", dtype="datetime64[h]")
+    station = {
+        "stationId": "1.15.0",
+        "Snødybde_value_time": times,
+        "Snødybde_value": np.ones(len(times)),
+        "value_Vannstand_value_time": times,
+        "value_Vannstand_value": np.ones(len(times)),
+    }
+    plot = plottypes.ParametersAll("", ["1.15.0"], None, None)  # type: ignore
+    plot.station_names = ["Femsjø"]
+    fig = plot.create_fig([station])
+
+    names = ["Snødybde", "value_Vannstand"]
+    assert [trace.name for trace in fig.data] == names
+    assert [a.text for a in fig.layout.annotations] == names
+    df_series = align.align(station)
+    assert plottypes.parameters_get_name(df_series)[1] == names
+
+
+def test_stations_compare_title_keeps_parameter_name():
+    times = np.arange("2023-01-01", "2023-01-02", dtype="datetime64[h]")
+    station_obj = schemas.StationCreate(
+        station="1.15.0",
+        parameter="2002",
+        parameter2="",
+        timerange="P1D/",
+        plottype="Stations compare",
+    )
+    plot = plottypes.StationsCompare("2002", ["1.15.0"], None, station_obj)  # type: ignore
+    plot.station_names = ["Femsjø"]
+    fig = plot.create_fig(
+        [
+            {
+                "stationId": "1.15.0",
+                "Snødybde_value_time": times,
+                "Snødybde_value": np.ones(len(times)),
+            }
+        ]
+    )
+
+    assert fig.layout.title.text == "Stations compared for Snødybde"
+
+
+def test_parameters_all_downsamples_webgl_traces():
+    times = np.arange("2023-01-01", "2023-01-08", dtype="datetime64[m]")
+    station = {
+        "stationId": "1.15.0",
+        "Vannstand_value_time": times,
+        "Vannstand_value": np.arange(len(times)) * 1.0,
+        "Magasinvolum_value_time": times[:10],
+        "Magasinvolum_value": np.arange(10) * 1.0,
+    }
+    plot = plottypes.ParametersAll("", ["1.15.0"], None, None)  # type: ignore
+    plot.station_names = ["Femsjø"]
+    fig = plot.create_fig([station])
+
+    assert [trace.type for trace in fig.data] == ["scattergl", "scattergl"]
+    assert [trace.yaxis for trace in fig.data] == ["y", "y2"]
+    assert [a.text for a in fig.layout.annotations] == ["Vannstand", "Magasinvolum"]
+    assert len(fig.data[0].x) <= 2000
+    assert fig.layout.meta["points"] == [
+        {
+            "row": 1,
+            "trace": "Vannstand_value",
+            "original": len(times),
+            "plotted": len(fig.data[0].x),
+        },
+        {"row": 2, "trace": "Magasinvolum_value", "original": 10, "plotted": 10},
+    ]
+
+
+def test_stored_series_fetches_delta(tmp_path: Any, monkeypatch: pytest.MonkeyPatch):
+    urls: List[str] = []
+    # Pinned, every call returns the same three observations.
+    now = np.datetime64("now", "s")
+
+    def fake_api_call(url: str) -> Dict[str, Any]:
+        urls.append(url)
+        return {
+            "data": [
+                {
+                    "stationId": "1.15.0",
+                    "parameter": 1000,
+                    "parameterName": "Vannstand",
+                    "observations": [
+                        {"time": f"{now - np.timedelta64(minute, 'm')}Z", "value": 1.0}
+                        for minute in (20, 10, 0)
+                    ],
+                }
+            ]
+        }
+
+    monkeypatch.setattr(plottypes, "api_call", fake_api_call)
+    monkeypatch.setattr(plottypes.cache, "observation_cache", NullBackend())
+    monkeypatch.setattr(
+        tsstore, "observation_store", tsstore.ObservationStore(str(tmp_path))
+    )
+    monkeypatch.setattr(plottypes, "_store_refreshed", MemoryBackend())
+    first = plottypes.fetch_station_series("1.15.0", "1000", "P1D/")
+    second = plottypes.fetch_station_series("1.15.0", "1000", "P1D/", refresh=True)
+    # Refreshed within the cache TTL, served from the store only.
+    third = plottypes.fetch_station_series("1.15.0", "1000", "P1D/")
+
+    assert len(urls) == 2
+    assert "ReferenceTime=P1D/" in urls[0]
+    assert "ReferenceTime=P1D/" not in urls[1]
+    assert first is not None and second is not None and third is not None
+    assert len(first["Vannstand_value"]) == 3
+    # Same minutes fetched again, only stored once.
+    assert len(second["Vannstand_value"]) == 3
+    assert len(third["Vannstand_value"]) == 3
+
+
+def test_stored_series_fetches_head_of_longer_range(
+    tmp_path: Any, monkeypatch: pytest.MonkeyPatch
+):
+    urls: List[str] = []
+    now = np.datetime64("now", "h")
+
+    def fake_api_call(url: str) -> Dict[str, Any]:
+        urls.append(url)
+        hours = 7 * 24 if "ReferenceTime=P7D/" in url else 24
+        return {
+            "data": [
+                {
+                    "stationId": "1.15.0",
+                    "parameter": 1000,
+                    "parameterName": "Vannstand",
+                    "observations": [
+                        {
+                            "time": f"{now - np.timedelta64(hour, 'h')}:00:00Z",
+                            "value": 1.0,
+                        }
+                        for hour in range(hours, -1, -1)
+                    ],
+                }
+            ]
+        }
+
+    monkeypatch.setattr(plottypes, "api_call", fake_api_call)
+    monkeypatch.setattr(plottypes.cache, "observation_cache", NullBackend())
+    monkeypatch.setattr(
+        tsstore, "observation_store", tsstore.ObservationStore(str(tmp_path))
+    )
+    monkeypatch.setattr(plottypes, "_store_refreshed", MemoryBackend())
+    day = plottypes.fetch_station_series("1.15.0", "1000", "P1D/")
+    # Refreshed within the cache TTL, but only for the day.
+    week = plottypes.fetch_station_series("1.15.0", "1000", "P7D/")
+    # Covered and refreshed, served from the store.
+    again = plottypes.fetch_station_series("1.15.0", "1000", "P1D/")
+
+    assert len(urls) == 2
+    assert "ReferenceTime=P7D/" in urls[1]
+    assert day is not None and week is not None and again is not None
+    assert len(again["Vannstand_value"]) == len(day["Vannstand_value"])
+    assert len(day["Vannstand_value"]) <= 25
+    # The week is complete, not only the day stored by the first request.
+    assert len(week["Vannstand_value"]) >= 7 * 24
+    assert len(set(week["Vannstand_value_time"])) == len(week["Vannstand_value_time"])
+
+
+def test_stored_series_async_calls_hydapi_from_the_loop(
+    tmp_path: Any, monkeypatch: pytest.MonkeyPatch
+):
+    urls: List[str] = []
+    now = np.datetime64("now", "s")
+
+    def blocking_api_call(url: str) -> None:
+        raise AssertionError("blocking api_call used")
+
+    async def fake_api_call_async(url: str) -> Dict[str, Any]:
+        urls.append(url)
+        return {
+            "data": [
+                {
+                    "stationId": "1.15.0",
+                    "parameter": 1000,
+                    "parameterName": "Vannstand",
+                    "observations": [
+                        {"time": f"{now - np.timedelta64(minute, 'm')}Z", "value": 1.0}
+                        for minute in (20, 10, 0)
+                    ],
+                }
+            ]
+        }
+
+    monkeypatch.setattr(plottypes, "api_call", blocking_api_call)
+    monkeypatch.setattr(plottypes, "api_call_async", fake_api_call_async)
+    monkeypatch.setattr(plottypes.cache, "observation_cache", NullBackend())
+    monkeypatch.setattr(
+        tsstore, "observation_store", tsstore.ObservationStore(str(tmp_path))
+    )
+    monkeypatch.setattr(plottypes, "_store_refreshed", MemoryBackend())
+
+    async def fetch_twice() -> List[Any]:
+        return [
+            await plottypes.fetch_station_series_async("1.15.0", "1000", "P1D/")
+            for _ in range(2)
+        ]
+
+    first, second = asyncio.run(fetch_twice())
+
+    # The second request is fresh in the store.
+    assert len(urls) == 1 and "ReferenceTime=P1D/" in urls[0]
+    assert len(first["Vannstand_value"]) == len(second["Vannstand_value"]) == 3
+
+
+def test_prefetch_series_refreshes_hot_series(monkeypatch: pytest.MonkeyPatch):
+    fetched: List[Any] = []
+
+    def fake_fetch(station: str, parameters: str, reference_time: str, refresh: bool):
+        fetched.append((station, parameters, reference_time, refresh))
+        governor.acquire()
+
+    monkeypatch.setattr(plottypes, "fetch_station_series", fake_fetch)
+    monkeypatch.setattr(plottypes, "series_tracker", FrequencyTracker())
+    for _ in range(2):
+        plottypes.series_tracker.record("b", ("2.2.2", "1000", "P1D/"))
+    plottypes.series_tracker.record("a", ("1.1.1", "1000", "P1D/"))
+    governor = RateGovernor(rate=1, burst=3, clock=lambda: 0.0)
+    monkeypatch.setattr(plottypes.ratelimit, "governor", governor)
+
+    assert plottypes.prefetch_series(top_n=5, min_tokens=2) == 1
+    assert fetched == [("2.2.2", "1000", "P1D/", True)]
+    assert plottypes.prefetch_series(top_n=5, min_tokens=2) == 0
@@ -0,0 +1,158 @@
+from typing import Any, Dict, List
+import asyncio
+import threading
+import pytest
+import cache as cache_module
+from cache import MemoryBackend, RedisBackend, make_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TickClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        self.now += 1
+        return self.now
+
+
+class FakeRedis:
+    """
+    Local stand-in for a redis server, implementing only the commands used by RedisBackend.
+    """
+
+    def __init__(self):
+        self.values: Dict[str, Any] = {}
+        self.zsets: Dict[str, Dict[str, float]] = {}
+
+    def get(self, key: str) -> Any:
+        return self.values.get(key)
+
+    def set(self, key: str, value: Any, ex: int | None = None) -> None:
+        self.values[key] = value
+
+    def delete(self, *keys: str) -> None:
+        for key in keys:
+            self.values.pop(key, None)
+            self.zsets.pop(key, None)
+
+    def zadd(self, name: str, mapping: Dict[str, float]) -> None:
+        self.zsets.setdefault(name, {}).update(mapping)
+
+    def zrem(self, name: str, *members: str) -> None:
+        for member in members:
+            self.zsets.get(name, {}).pop(member, None)
+
+    def zcard(self, name: str) -> int:
+        return len(self.zsets.get(name, {}))
+
+    def zrange(self, name: str, start: int, end: int) -> List[str]:
+        members = sorted(self.zsets.get(name, {}).items(), key=lambda x: x[1])
+        keys = [key for key, _ in members]
+        return keys[start:] if end == -1 else keys[start : end + 1]
+
+
+def test_make_key_keeps_parameter_order():
+    assert make_key("1.15.0", "1000, 1001", "P1D/") == "obs:1.15.0:1000,1001:P1D/:0"
+    assert make_key("1.15.0", "1001,1000", "P1D/", 60) == "obs:1.15.0:1001,1000:P1D/:60"
+
+
+def test_memory_backend_ttl():
+    clock = FakeClock()
+    cache = MemoryBackend(max_entries=10, ttl=60, clock=clock)
+    cache.set("a", {"data": []})
+    clock.now = 59
+    assert cache.get("a") == {"data": []}
+    clock.now = 61
+    assert cache.get("a") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["expirations"] == 1
+    assert stats["size"] == 0
+
+
+def test_memory_backend_lru_eviction():
+    cache = MemoryBackend(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # Touch a so b becomes least recently used.
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_redis_backend_lru_eviction():
+    cache = RedisBackend(FakeRedis(), max_entries=2, ttl=60, clock=TickClock())
+    cache.set("a", {"data": [1]})
+    cache.set("b", {"data": [2]})
+    assert cache.get("a") == {"data": [1]}
+    cache.set("c", {"data": [3]})
+
+    assert cache.get("b") is None
+    assert cache.get("c") == {"data": [3]}
+    assert len(cache) == 2
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+
+
+class DownRedis:
+    def __getattr__(self, command: str) -> Any:
+        def fail(*args: Any, **kwargs: Any) -> None:
+            raise ConnectionError("Connection refused")
+
+        return fail
+
+
+def test_redis_outage_is_a_miss():
+    cache = RedisBackend(DownRedis(), max_entries=2, ttl=60)
+    cache.set("a", {"data": [1]})
+
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["size"] == 0
+    assert stats["errors"] >= 2
+
+
+def test_create_cache_survives_unreachable_redis(monkeypatch: pytest.MonkeyPatch):
+    pytest.importorskip("redis")
+    monkeypatch.setattr(cache_module, "REDIS_PORT", 1)
+    cache = cache_module.create_cache("redis", 2, 60, namespace="test")
+    cache.set("a", {"data": [1]})
+
+    assert isinstance(cache, RedisBackend)
+    assert cache.get("a") is None
+
+
+def test_async_lookups_of_network_backends_run_in_a_thread():
+    threads: List[str] = []
+
+    class RecordingRedis(FakeRedis):
+        def get(self, key: str) -> Any:
+            threads.append(threading.current_thread().name)
+            return super().get(key)
+
+    cache = RedisBackend(RecordingRedis(), max_entries=2, ttl=60)
+
+    async def main() -> Any:
+        await cache.set_async("a", {"data": [1]})
+        return await cache.get_async("a")
+
+    assert asyncio.run(main()) == {"data": [1]}
+    assert threads and threading.main_thread().name not in threads
+    assert asyncio.run(MemoryBackend(2, 60).get_async("a")) is None
@@ -0,0 +1,53 @@
+import json
+import numpy as np
+import pytest
+import columnar
+
+TIMES = np.array(["2023-01-01T00:00", "2023-01-01T00:10"], dtype="datetime64[ns]")
+OBSERVATIONS = [
+    {
+        "stationId": "1.15.0",
+        "Vannstand_value": np.array([1.0, 2.0]),
+        "Vannstand_value_time": TIMES,
+    },
+    {"stationId": "1.200.0"},
+]
+
+
+def test_series_columns():
+    payload = json.loads(columnar.to_json(OBSERVATIONS, ["Femsjø", None]))
+
+    assert payload == {
+        "stations": [
+            {
+                "stationId": "1.15.0",
+                "name": "Femsjø",
+                "series": {
+                    "Vannstand": {
+                        "time": [1672531200000, 1672531800000],
+                        "value": [1.0, 2.0],
+                    }
+                },
+            },
+            {"stationId": "1.200.0", "name": None, "series": {}},
+        ]
+    }
+
+
+def test_to_arrow():
+    pa = pytest.importorskip("pyarrow")
+    reader = pa.ipc.open_stream(columnar.to_arrow(OBSERVATIONS, ["Femsjø", None]))
+    table = reader.read_all()
+
+    assert table.column_names == [
+        "station",
+        "station_name",
+        "parameter",
+        "time",
+        "value",
+    ]
+    assert table.num_rows == 2
+    assert table.column("station").to_pylist() == ["1.15.0", "1.15.0"]
+    assert table.column("parameter").to_pylist() == ["Vannstand", "Vannstand"]
+    assert table.column("value").to_pylist() == [1.0, 2.0]
+    assert str(table.schema.field("time").type) == "timestamp[ms, tz=UTC]"
@@ -0,0 +1,83 @@
+import gzip
+from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+import compression
+from compression import CompressionMiddleware, select_encoding
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+
+@app.get("/large")
+def large() -> Response:
+    return Response(content="x" * 1000, media_type="application/json")
+
+
+@app.get("/tagged")
+def tagged() -> Response:
+    return Response(
+        content="x" * 1000, media_type="application/json", headers={"ETag": '"1"'}
+    )
+
+
+@app.get("/small")
+def small() -> Response:
+    return Response(content="x" * 10, media_type="application/json")
+
+
+@app.get("/ndjson")
+def ndjson() -> Response:
+    return Response(content="{}\n" * 500, media_type="application/x-ndjson")
+
+
+@app.get("/stream")
+def stream() -> StreamingResponse:
+    return StreamingResponse(iter(["x" * 500, "y" * 500]), media_type="text/plain")
+
+
+client = TestClient(app)
+
+
+def test_large_response_is_gzipped():
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < 1000
+    assert response.text == "x" * 1000
+
+
+def test_small_excluded_and_streamed_responses_are_not_compressed():
+    for path in ["/small", "/ndjson", "/stream"]:
+        response = client.get(path, headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+
+
+def test_compressed_etag_is_weak():
+    identity = client.get("/tagged", headers={"Accept-Encoding": "identity"})
+    assert identity.headers["etag"] == '"1"'
+    response = client.get("/tagged", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["etag"] == 'W/"1"'
+
+
+def test_no_compression_without_accept_encoding():
+    response = client.get("/large", headers={"Accept-Encoding": "identity"})
+
+    assert "content-encoding" not in response.headers
+    assert response.text == "x" * 1000
+
+
+def test_select_encoding(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert select_encoding("gzip, deflate, br") == "gzip"
+    assert select_encoding("gzip;q=0, deflate") is None
+    assert select_encoding("gzip; q=0.0, deflate") is None
+    assert select_encoding("gzip;q=0.5, deflate") == "gzip"
+    assert select_encoding("gzip;q=x") is None
+    monkeypatch.setattr(compression, "brotli", object())
+    assert select_encoding("gzip, deflate, br") == "br"
+
+
+def test_compress_gzip_roundtrip():
+    assert gzip.decompress(compression.compress(b"abc" * 100, "gzip")) == b"abc" * 100
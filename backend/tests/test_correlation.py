@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from correlation import correlation_matrix, pairwise_pearson, top_pairs
+
+rng = np.random.default_rng(0)
+X = rng.normal(size=200) + 1e4
+FRAME = pd.DataFrame(
+    {
+        "time": np.arange(200),
+        "a_value": X,
+        "b_value": 2 * X + rng.normal(size=200) * 0.1,
+        "c_value": rng.normal(size=200),
+        "d_value": -X,
+    }
+)
+FRAME.loc[::7, "b_value"] = np.nan
+
+
+def test_pearson_matches_pandas_pairwise():
+    matrix = correlation_matrix(FRAME)
+
+    assert list(matrix.columns) == ["a_value", "b_value", "c_value", "d_value"]
+    expected = FRAME.drop(columns="time").corr()
+    assert np.allclose(matrix.to_numpy(), expected.to_numpy())
+
+
+def test_spearman_of_monotonic_series():
+    frame = pd.DataFrame({"a_value": np.arange(10.0), "b_value": np.exp(np.arange(10))})
+
+    assert np.allclose(correlation_matrix(frame, "spearman").to_numpy(), 1.0)
+    assert correlation_matrix(frame, "pearson").iloc[0, 1] < 1.0
+
+
+def test_too_few_common_rows_is_nan():
+    values = np.array([[1.0, np.nan], [2.0, np.nan], [3.0, 1.0], [4.0, 2.0]])
+
+    result = pairwise_pearson(values)
+    assert result[0, 0] == 1.0
+    assert np.isnan(result[0, 1])
+
+
+def test_top_pairs_by_strength():
+    pairs = top_pairs(correlation_matrix(FRAME), 2)
+
+    assert [(x, y) for x, y, _ in pairs] == [
+        ("a_value", "d_value"),
+        ("a_value", "b_value"),
+    ]
+    assert pairs[0][2] == -1.0
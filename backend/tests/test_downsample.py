@@ -0,0 +1,31 @@
+import numpy as np
+from downsample import downsample, lttb, minmax
+
+
+def test_lttb_keeps_ends_and_peaks():
+    x = np.arange("2023-01-01", "2023-01-08", dtype="datetime64[m]")
+    y = np.sin(np.arange(len(x)) / 50.0)
+    y[5000] = 10.0
+    indices = lttb(x, y, 500)
+
+    assert len(indices) == 500
+    assert indices[0] == 0 and indices[-1] == len(x) - 1
+    assert np.all(np.diff(indices) > 0)
+    assert 5000 in indices
+
+
+def test_minmax_keeps_extremes():
+    y = np.array([1.0, 5.0, 2.0, 0.0, 3.0, 9.0, 4.0, 4.0])
+    indices = minmax(np.arange(len(y)), y, 4)
+
+    assert indices.tolist() == [1, 3, 4, 5]
+
+
+def test_downsample_short_series_unchanged():
+    x = np.arange(10)
+    y = np.arange(10.0)
+    x_out, y_out = downsample(x, y, threshold=100)
+
+    assert x_out is x and y_out is y
+    assert len(downsample(x, y, threshold=0)[0]) == 10
+    assert len(downsample(x, y, threshold=5, method="minmax")[0]) <= 5
@@ -0,0 +1,33 @@
+from popularity import FrequencyTracker
+
+
+def test_top_orders_by_frequency():
+    tracker = FrequencyTracker()
+    for key in ["a", "b", "b", "c", "c", "c"]:
+        tracker.record(key, {"key": key})
+
+    assert tracker.top(2) == [("c", {"key": "c"}), ("b", {"key": "b"})]
+    assert len(tracker) == 3
+
+
+def test_decay_forgets_old_requests():
+    tracker = FrequencyTracker(decay=0.1)
+    tracker.record("old")
+    tracker.decay()
+    tracker.record("new")
+    tracker.record("new")
+
+    assert [key for key, _ in tracker.top(2)] == ["new", "old"]
+    tracker.decay()
+    assert [key for key, _ in tracker.top(2)] == ["new"]
+
+
+def test_size_is_bounded():
+    tracker = FrequencyTracker(max_entries=10)
+    for _ in range(3):
+        tracker.record("hot")
+    for key in range(20):
+        tracker.record(str(key))
+
+    assert len(tracker) <= 10
+    assert tracker.top(1)[0][0] == "hot"
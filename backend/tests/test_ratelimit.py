@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+import threading
+import time
+from ratelimit import RateGovernor, parse_reset
+
+
+def test_parse_reset():
+    now = datetime(2023, 5, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+    assert parse_reset("2023-05-01T12:00:02Z", now) == 2.0
+    assert parse_reset("2023-05-01T11:59:00Z", now) == 0.0
+    assert parse_reset("2023-05-01T12:00:01.5000000Z", now) == 1.5
+    assert parse_reset("2023-05-01T12:00:01.25+00:00", now) == 1.25
+    assert parse_reset("not a date", now) is None
+    assert parse_reset(None, now) is None
+
+
+def test_burst_then_paced():
+    governor = RateGovernor(rate=50, burst=2)
+    waits = [governor.acquire() for _ in range(4)]
+
+    assert waits[0] < 0.01 and waits[1] < 0.01
+    # Burst is spent, the rest are paced at 50 requests per second.
+    assert sum(waits[2:]) >= 0.03
+    stats = governor.stats()
+    assert stats["requests"] == 4
+    assert stats["queued"] >= 1
+
+
+def test_remaining_header_drains_bucket():
+    governor = RateGovernor(rate=20, burst=5)
+    governor.observe({"X-Rate-Limit-Remaining": "0"})
+
+    # Bucket emptied and paused for the default pause, even though burst was 5.
+    assert governor.acquire() >= 0.04
+    assert governor.stats()["throttled"] == 1
+
+
+def test_callers_served_in_order():
+    governor = RateGovernor(rate=100, burst=1)
+    governor.acquire()
+    served: list[int] = []
+    lock = threading.Lock()
+
+    def call(inc: int) -> None:
+        governor.acquire()
+        with lock:
+            served.append(inc)
+
+    threads = []
+    for inc in range(5):
+        thread = threading.Thread(target=call, args=(inc,))
+        thread.start()
+        threads.append(thread)
+        # Wait for the thread to take its ticket before starting the next.
+        while governor.stats()["waiting"] < inc + 1 and thread.is_alive():
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+
+    assert served == list(range(5))
+    assert governor.stats()["waiting"] == 0
+
+
+def test_remaining_header_does_not_pause_in_flight_burst():
+    governor = RateGovernor(rate=1000, burst=2)
+    governor.acquire()
+    governor.acquire()
+    governor.observe({"X-Rate-Limit-Remaining": "3"})
+
+    assert governor.stats()["throttled"] == 0
+
+
+def test_available_leaves_room_for_queued_and_paused():
+    governor = RateGovernor(rate=1, burst=3, clock=lambda: 0.0)
+
+    assert governor.available() == 3
+    governor.acquire()
+    assert governor.available() == 2
+    governor.observe({"X-Rate-Limit-Remaining": "0"})
+    assert governor.available() == 0
+
+
+def test_try_acquire_does_not_skip_the_queue():
+    governor = RateGovernor(rate=10, burst=1)
+
+    assert governor.try_acquire()
+    assert not governor.try_acquire()
+    waiter = threading.Thread(target=governor.acquire)
+    waiter.start()
+    while governor.stats()["waiting"] < 1:
+        time.sleep(0.001)
+    time.sleep(0.12)
+    # A token is back but belongs to the queued caller.
+    assert not governor.try_acquire()
+    waiter.join()
+    assert governor.stats()["requests"] == 2
@@ -0,0 +1,44 @@
+import threading
+from scheduler import PeriodicTask
+
+
+def test_task_runs_until_stopped():
+    ran = threading.Event()
+    calls: list[int] = []
+
+    def job() -> None:
+        calls.append(1)
+        if len(calls) == 3:
+            ran.set()
+
+    task = PeriodicTask("job", 0.001, job)
+    task.start()
+    assert ran.wait(2)
+    task.stop()
+
+    assert not task.running
+    runs = task.stats()["runs"]
+    assert runs >= 3
+    assert task.stats()["runs"] == runs
+
+
+def test_failures_are_counted_and_task_keeps_running():
+    def job() -> None:
+        raise ValueError("upstream failure")
+
+    task = PeriodicTask("failing", 60, job)
+    task.run_once()
+    task.run_once()
+
+    assert task.stats()["failures"] == 2
+    assert task.stats()["runs"] == 2
+
+
+def test_initial_delay_is_interruptible():
+    calls: list[int] = []
+    task = PeriodicTask("delayed", 60, lambda: calls.append(1), initial_delay=60)
+    task.start()
+    task.stop(timeout=2)
+
+    assert calls == []
+    assert not task.running
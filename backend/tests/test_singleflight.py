@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+import pytest
+from singleflight import AsyncSingleFlight, SingleFlight
+
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls: list[int] = []
+    results: list[str] = []
+
+    def slow() -> str:
+        calls.append(1)
+        release.wait(1)
+        return "figure"
+
+    def worker() -> None:
+        results.append(flight.do("plot", slow))
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while flight.stats()["coalesced"] < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ["figure"] * 5
+    assert flight.stats() == {"executed": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_errors_are_shared_and_key_released():
+    flight = SingleFlight()
+
+    def fail() -> None:
+        raise ValueError("no data")
+
+    with pytest.raises(ValueError):
+        flight.do("plot", fail)
+    assert flight.do("plot", lambda: "ok") == "ok"
+    assert flight.stats()["executed"] == 2
+
+
+def test_async_calls_are_coalesced():
+    flight = AsyncSingleFlight()
+    calls: list[int] = []
+
+    async def slow() -> str:
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "figure"
+
+    async def main() -> list[str]:
+        return await asyncio.gather(*(flight.do("plot", slow) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["figure"] * 5
+    assert calls == [1]
+    assert flight.stats() == {"executed": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_cancelled_caller_does_not_cancel_shared_call():
+    flight = AsyncSingleFlight()
+
+    async def slow() -> str:
+        await asyncio.sleep(0.02)
+        return "figure"
+
+    async def main() -> str:
+        first = asyncio.ensure_future(flight.do("plot", slow))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flight.do("plot", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "figure"
+    assert flight.stats()["executed"] == 1
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+import summaries
+from cache import MemoryBackend
+from summaries import daily_summary, statistics_table
+
+# Vannstand every 10 minutes for three days, value is the index of the observation.
+TIMES = (
+    np.datetime64("2023-01-01T00:00", "ns")
+    + np.arange(3 * 144).astype("timedelta64[m]").astype("timedelta64[ns]") * 10
+)
+STATION = {
+    "stationId": "1.15.0",
+    "Vannstand_value": np.arange(3 * 144, dtype=np.float64),
+    "Vannstand_value_time": TIMES,
+}
+
+
+@pytest.fixture(autouse=True)
+def summary_cache(monkeypatch: pytest.MonkeyPatch) -> MemoryBackend:
+    backend = MemoryBackend(100, 600)
+    monkeypatch.setattr(summaries, "summary_cache", backend)
+    return backend
+
+
+def test_daily_summary():
+    values = STATION["Vannstand_value"].copy()
+    values[0] = np.nan
+    summary = daily_summary(TIMES, values, [50])
+
+    assert list(summary["count"]) == [143, 144, 144]
+    assert list(summary["min"]) == [1.0, 144.0, 288.0]
+    assert list(summary["max"]) == [143.0, 287.0, 431.0]
+    assert list(summary["p50"]) == [72.0, 215.5, 359.5]
+
+
+def test_rolling_mean_spans_days():
+    table = statistics_table([STATION], [], rolling_days=2)
+
+    assert list(table["day"]) == ["2023-01-01", "2023-01-02", "2023-01-03"]
+    assert list(table["rolling_mean"]) == [71.5, 143.5, 287.5]
+
+
+def test_complete_days_are_cached(summary_cache: MemoryBackend):
+    window = {
+        "complete_from": np.datetime64("2023-01-02"),
+        "complete_until": np.datetime64("2023-01-03T12:00"),
+    }
+    first = statistics_table([STATION], [5, 95], **window)
+    # Only 2023-01-02, the first day is before the range and the last one not over.
+    assert summary_cache.stats()["sets"] == 1
+
+    second = statistics_table([STATION], [5, 95], **window)
+    assert summary_cache.stats()["hits"] == 1
+    for column in first:
+        assert list(first[column]) == list(second[column])
+
+    cached = dict(
+        STATION,
+        Vannstand_value=STATION["Vannstand_value"][144:289],
+        Vannstand_value_time=TIMES[144:289],
+    )
+    table = statistics_table([cached], [5, 95], **window)
+    assert summary_cache.stats()["hits"] == 2
+    assert list(table["day"]) == ["2023-01-02", "2023-01-03"]
+    assert list(table["count"]) == [144, 1]
+
+
+def test_last_day_received_is_not_cached(summary_cache: MemoryBackend):
+    window = {
+        "complete_from": np.datetime64("2023-01-01"),
+        "complete_until": np.datetime64("2023-01-10"),
+    }
+    # Observations after noon of 2023-01-02 are not published yet.
+    late = dict(
+        STATION,
+        Vannstand_value=STATION["Vannstand_value"][:216],
+        Vannstand_value_time=TIMES[:216],
+    )
+    table = statistics_table([late], [50], **window)
+    assert list(table["count"]) == [144, 72]
+    assert summary_cache.stats()["sets"] == 1
+
+    table = statistics_table([STATION], [50], **window)
+    assert list(table["count"]) == [144, 144, 144]
+
+
+def test_no_observations():
+    table = statistics_table([{"stationId": "1.15.0"}], [50])
+
+    assert table["day"] == [] and "p50" in table
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta, timezone
+from timerange import merge_observations, parse_span, plan_requests
+
+NOW = datetime(2023, 5, 10, 13, 30, tzinfo=timezone.utc)
+
+
+def test_parse_span():
+    assert parse_span("P7D/") == timedelta(days=7)
+    assert parse_span("P1825D/") == timedelta(days=1825)
+    assert parse_span("2023-01-01/2023-01-02") is None
+
+
+def test_short_ranges_keep_relative_reference_time():
+    assert plan_requests("P2D/", NOW) == (0, ["P2D/"])
+    assert plan_requests("P30D/", NOW) == (60, ["P30D/"])
+    assert plan_requests("2023-01-01/2023-01-02", NOW) == (0, ["2023-01-01/2023-01-02"])
+
+
+def test_long_ranges_are_chunked():
+    resolution, chunks = plan_requests("P1825D/", NOW)
+
+    assert resolution == 1440
+    assert len(chunks) == 5
+    assert chunks[0].startswith("2018-05-11T00:00:00Z/")
+    # Ends at the next day boundary, the same for every call during the day.
+    assert chunks[-1].endswith("/2023-05-11T00:00:00Z")
+    assert plan_requests("P1825D/", NOW + timedelta(hours=5))[1] == chunks
+    # Consecutive chunks share their boundary.
+    for first, second in zip(chunks, chunks[1:]):
+        assert first.split("/")[1] == second.split("/")[0]
+
+
+def test_hourly_ranges_end_at_the_next_hour():
+    resolution, chunks = plan_requests("P90D/", NOW)
+
+    assert resolution == 60
+    assert chunks[-1].endswith("/2023-05-10T14:00:00Z")
+
+
+def test_merge_observations_drops_boundary_duplicates():
+    def response(times):
+        return {
+            "data": [
+                {
+                    "stationId": "1.15.0",
+                    "parameter": 1000,
+                    "observations": [{"time": time, "value": 1.0} for time in times],
+                }
+            ]
+        }
+
+    merged = merge_observations(
+        [response(["2023-01-01", "2023-01-02"]), response(["2023-01-02", "2023-01-03"])]
+        + [response([None, "2023-01-04"])]
+    )
+
+    assert len(merged["data"]) == 1
+    assert [point["time"] for point in merged["data"][0]["observations"]] == [
+        "2023-01-01",
+        "2023-01-02",
+        "2023-01-03",
+        "2023-01-04",
+    ]
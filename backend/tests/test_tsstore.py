@@ -0,0 +1,80 @@
+from datetime import timedelta
+import os
+import numpy as np
+import pytest
+from tsstore import ObservationStore
+
+
+def minutes(*values: int) -> np.ndarray:
+    return np.datetime64("2023-01-01T00:00", "ns") + np.array(
+        values, dtype="timedelta64[m]"
+    )
+
+
+def test_append_only_stores_new_observations(tmp_path: str):
+    store = ObservationStore(str(tmp_path))
+
+    assert store.append("1.15.0", "1000", "Vannstand", minutes(0, 10), np.ones(2)) == 2
+    assert store.append("1.15.0", "1000", "Vannstand", minutes(10, 20), np.ones(2)) == 1
+    times, values = store.read("1.15.0", "1000")
+
+    assert times.tolist() == minutes(0, 10, 20).tolist()
+    assert store.last_time("1.15.0", "1000") == minutes(20)[0]
+    assert store.name("1.15.0", "1000") == "Vannstand"
+    assert store.read("1.15.0", "1000", since=minutes(10)[0])[0].tolist() == (
+        minutes(10, 20).tolist()
+    )
+    assert store.last_time("1.15.0", "1001") is None
+
+
+def test_compaction_merges_segments_and_applies_retention(tmp_path: str):
+    store = ObservationStore(str(tmp_path), timedelta(minutes=30), max_segments=3)
+    for minute in range(0, 60, 10):
+        store.append("1.15.0", "1000", "Vannstand", minutes(minute), np.ones(1))
+    series_dir = os.path.join(str(tmp_path), "1.15.0_1000")
+    segments = [name for name in os.listdir(series_dir) if name.endswith(".npz")]
+
+    assert len(segments) <= 3
+    store.compact("1.15.0", "1000")
+    times, _ = store.read("1.15.0", "1000")
+    assert times.tolist() == minutes(20, 30, 40, 50).tolist()
+
+
+def test_covered_range(tmp_path: str):
+    store = ObservationStore(str(tmp_path))
+    store.append(
+        "1.15.0", "1000", "Vannstand", minutes(30, 40), np.ones(2), minutes(25)[0]
+    )
+
+    assert store.first_time("1.15.0", "1000") == minutes(25)[0]
+    # A delta continues the covered range.
+    store.append("1.15.0", "1000", "Vannstand", minutes(40, 50), np.ones(2))
+    assert store.first_time("1.15.0", "1000") == minutes(25)[0]
+    # A longer range fills the head, observations already stored are kept once.
+    assert (
+        store.append(
+            "1.15.0",
+            "1000",
+            "Vannstand",
+            minutes(0, 10, 20, 30),
+            np.ones(4),
+            minutes(0)[0],
+        )
+        == 3
+    )
+    assert store.first_time("1.15.0", "1000") == minutes(0)[0]
+    assert store.last_time("1.15.0", "1000") == minutes(50)[0]
+    assert store.read("1.15.0", "1000")[0].tolist() == sorted(
+        minutes(0, 10, 20, 30, 40, 50).tolist()
+    )
+
+
+def test_series_ids_cannot_leave_the_store(tmp_path: str):
+    store = ObservationStore(os.path.join(tmp_path, "store"))
+
+    for station in ["../1.15.0", "1.15.0/..", "..", "1..15", "/etc", ""]:
+        with pytest.raises(ValueError):
+            store.append(station, "1000", "Vannstand", minutes(0), np.ones(1))
+    with pytest.raises(ValueError):
+        store.read("1.15.0", "../1000")
+    assert os.listdir(tmp_path) == ["store"]
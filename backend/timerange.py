@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple
+import re
+
+"""
+Time ranges offered in the frontend and how they are fetched from hydapi.
+Raw observations are only used for short ranges, longer ranges use hourly or daily
+values (hydapi ResolutionTime in minutes). Ranges longer than the chunk size of the
+resolution are split in explicit intervals fetched in parallel and stitched together.
+"""
+TIMERANGES: Dict[str, str] = {
+    "P1D/": "1 Day",
+    "P2D/": "2 Days",
+    "P3D/": "3 Days",
+    "P7D/": "1 Week",
+    "P30D/": "1 Month",
+    "P365D/": "1 Year",
+    "P1825D/": "5 Years",
+}
+
+# (longest span, resolution in minutes, longest span of one upstream request)
+RESOLUTIONS: List[Tuple[timedelta, int, timedelta]] = [
+    (timedelta(days=7), 0, timedelta(days=7)),
+    (timedelta(days=90), 60, timedelta(days=31)),
+    (timedelta.max, 1440, timedelta(days=366)),
+]
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def parse_span(reference_time: str) -> timedelta | None:
+    """
+    Span of a relative reference time like "P7D/", None for anything else.
+    """
+    match = re.fullmatch(r"P(\d+)D/", reference_time)
+    if not match:
+        return None
+    return timedelta(days=int(match.group(1)))
+
+
+def select_resolution(span: timedelta) -> Tuple[int, timedelta]:
+    for longest, resolution, chunk in RESOLUTIONS:
+        if span <= longest:
+            return resolution, chunk
+    return RESOLUTIONS[-1][1], RESOLUTIONS[-1][2]
+
+
+def ceil_time(moment: datetime, step: timedelta) -> datetime:
+    if not step:
+        return moment
+    remainder = (moment - datetime(1970, 1, 1, tzinfo=moment.tzinfo)) % step
+    return moment + (step - remainder) if remainder else moment
+
+
+def plan_requests(
+    reference_time: str, now: datetime | None = None
+) -> Tuple[int, List[str]]:
+    """
+    Return the resolution and the reference times to request for a time range.
+    A range fitting in one request keeps its relative reference time. Longer ranges
+    are split in intervals aligned to whole days, the last one ending at the next
+    resolution boundary, so the intervals are the same between calls within an hour
+    or day and can be served from the observation cache.
+    """
+    span = parse_span(reference_time)
+    if span is None:
+        return 0, [reference_time]
+    resolution, chunk = select_resolution(span)
+    if span <= chunk:
+        return resolution, [reference_time]
+
+    now = now or datetime.now(timezone.utc)
+    start = (now - span).replace(hour=0, minute=0, second=0, microsecond=0)
+    # The last interval ends at the next resolution boundary instead of now, so its
+    # reference time and cache key stay the same within that hour or day.
+    until = ceil_time(now, timedelta(minutes=resolution))
+    chunks: List[str] = []
+    while start < until:
+        end = min(start + chunk, until)
+        chunks.append(f"{start.strftime(TIME_FORMAT)}/{end.strftime(TIME_FORMAT)}")
+        start = end
+    return resolution, chunks
+
+
+def merge_observations(responses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Stitch hydapi Observations responses for consecutive intervals into one response.
+    Series are matched on station and parameter, points at an interval boundary that
+    are returned by both intervals are only kept once.
+    """
+    merged: Dict[Tuple[Any, Any], Dict[str, Any]] = {}
+    for response in responses:
+        for observation in response.get("data") or []:
+            key = (observation.get("stationId"), observation.get("parameter"))
+            # Points without a time can not be ordered, they are dropped.
+            points = [
+                point
+                for point in observation.get("observations") or []
+                if point.get("time")
+            ]
+            if key not in merged:
+                merged[key] = dict(observation, observations=list(points))
+                continue
+            series = merged[key]["observations"]
+            last = series[-1]["time"] if series else ""
+            series.extend(point for point in points if point.get("time") > last)
+    return {"data": list(merged.values())}
@@ -0,0 +1,200 @@
+from datetime import timedelta
+from typing import Dict, List, Tuple
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+"""
+Local store of raw observations per station and parameter, used to fetch only the new
+observations from hydapi. Every series is a folder of .npz segments with a time
+(datetime64[ns]) and a value (float64) column, plus meta.json with the parameter name
+and the time range covered by the stored observations, first to last. Appends write a
+new segment, when a series has more than max_segments they are compacted into one and
+observations older than the retention are dropped.
+The store is enabled by setting OBSERVATION_STORE_PATH.
+"""
+OBSERVATION_STORE_PATH = os.getenv("OBSERVATION_STORE_PATH", "")
+OBSERVATION_STORE_RETENTION_DAYS = int(
+    os.getenv("OBSERVATION_STORE_RETENTION_DAYS", "8")
+)
+OBSERVATION_STORE_MAX_SEGMENTS = int(os.getenv("OBSERVATION_STORE_MAX_SEGMENTS", "16"))
+# Station ids ("1.15.0") and parameter codes name the series folders.
+SERIES_ID = re.compile(r"[A-Za-z0-9]+(\.[A-Za-z0-9]+)*")
+
+Series = Tuple[np.ndarray, np.ndarray]
+
+
+def _empty() -> Series:
+    return np.array([], dtype="datetime64[ns]"), np.array([], dtype=np.float64)
+
+
+class ObservationStore:
+    def __init__(
+        self,
+        path: str,
+        retention: timedelta = timedelta(days=OBSERVATION_STORE_RETENTION_DAYS),
+        max_segments: int = OBSERVATION_STORE_MAX_SEGMENTS,
+    ):
+        self.path = path
+        self.retention = np.timedelta64(int(retention.total_seconds()), "s")
+        self.max_segments = max_segments
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _series_dir(self, station: str, parameter: str) -> str:
+        for part in (station, parameter):
+            if not SERIES_ID.fullmatch(part):
+                raise ValueError(f"Invalid station or parameter {part!r}")
+        return os.path.join(self.path, f"{station}_{parameter}")
+
+    def _lock(self, station: str, parameter: str) -> threading.Lock:
+        key = f"{station}_{parameter}"
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _segments(self, series_dir: str) -> List[str]:
+        if not os.path.isdir(series_dir):
+            return []
+        return sorted(
+            os.path.join(series_dir, name)
+            for name in os.listdir(series_dir)
+            if name.endswith(".npz")
+        )
+
+    def _meta(self, series_dir: str) -> Dict[str, str]:
+        try:
+            with open(os.path.join(series_dir, "meta.json")) as meta_file:
+                return json.load(meta_file)
+        except FileNotFoundError:
+            return {}
+
+    def _write_meta(self, series_dir: str, meta: Dict[str, str]) -> None:
+        tmp_path = os.path.join(series_dir, "meta.json.tmp")
+        with open(tmp_path, "w") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(tmp_path, os.path.join(series_dir, "meta.json"))
+
+    def _write_segment(self, series_dir: str, times: np.ndarray, values: np.ndarray):
+        name = f"{time.time_ns():020d}-{os.getpid()}"
+        tmp_path = os.path.join(series_dir, f"{name}.tmp")
+        with open(tmp_path, "wb") as segment:
+            np.savez(segment, time=times, value=values)
+        os.replace(tmp_path, os.path.join(series_dir, f"{name}.npz"))
+
+    def _read_segments(self, segments: List[str]) -> Series:
+        times: List[np.ndarray] = []
+        values: List[np.ndarray] = []
+        for segment in segments:
+            try:
+                with np.load(segment) as data:
+                    times.append(data["time"])
+                    values.append(data["value"])
+            except FileNotFoundError:
+                # Removed by a compaction in another process.
+                continue
+        if not times:
+            return _empty()
+        return np.concatenate(times), np.concatenate(values)
+
+    def name(self, station: str, parameter: str) -> str | None:
+        return self._meta(self._series_dir(station, parameter)).get("name")
+
+    def last_time(self, station: str, parameter: str) -> np.datetime64 | None:
+        last = self._meta(self._series_dir(station, parameter)).get("last")
+        return np.datetime64(last, "ns") if last else None
+
+    def first_time(self, station: str, parameter: str) -> np.datetime64 | None:
+        """
+        Start of the time range the stored observations cover, not necessarily the
+        time of the first observation.
+        """
+        first = self._meta(self._series_dir(station, parameter)).get("first")
+        return np.datetime64(first, "ns") if first else None
+
+    def read(
+        self, station: str, parameter: str, since: np.datetime64 | None = None
+    ) -> Series:
+        times, values = self._read_segments(
+            self._segments(self._series_dir(station, parameter))
+        )
+        if since is not None:
+            keep = times >= since
+            times, values = times[keep], values[keep]
+        # Segments filling the head of the covered range are older and may overlap.
+        times, unique = np.unique(times, return_index=True)
+        return times, values[unique]
+
+    def append(
+        self,
+        station: str,
+        parameter: str,
+        name: str,
+        times: np.ndarray,
+        values: np.ndarray,
+        covered_from: np.datetime64 | None = None,
+    ) -> int:
+        """
+        Store observations outside the covered range, returns the number stored.
+        covered_from is the start of the requested range when the observations are a
+        complete range, the covered range then reaches back to it. Without it the
+        observations continue the covered range.
+        """
+        series_dir = self._series_dir(station, parameter)
+        with self._lock(station, parameter):
+            os.makedirs(series_dir, exist_ok=True)
+            meta = self._meta(series_dir)
+            first = self.first_time(station, parameter)
+            last = self.last_time(station, parameter)
+            if last is not None:
+                outside = times > last
+                if first is not None:
+                    outside |= times < first
+                times, values = times[outside], values[outside]
+            if covered_from is not None:
+                # A range not overlapping the stored one leaves a gap, coverage then
+                # starts again at covered_from.
+                if first is None or last is None or last < covered_from:
+                    first = covered_from
+                else:
+                    first = min(first, covered_from)
+            if len(times):
+                self._write_segment(series_dir, times, values)
+                last = max(times.max(), last) if last is not None else times.max()
+                first = min(times.min(), first) if first is not None else times.min()
+            if first is not None and last is not None:
+                meta.update(name=name, first=str(first), last=str(last))
+                self._write_meta(series_dir, meta)
+            if len(self._segments(series_dir)) > self.max_segments:
+                self._compact(series_dir)
+        return len(times)
+
+    def compact(self, station: str, parameter: str) -> None:
+        with self._lock(station, parameter):
+            self._compact(self._series_dir(station, parameter))
+
+    def _compact(self, series_dir: str) -> None:
+        segments = self._segments(series_dir)
+        times, values = self._read_segments(segments)
+        meta = self._meta(series_dir)
+        if len(times):
+            times, unique = np.unique(times, return_index=True)
+            values = values[unique]
+            cutoff = times.max() - self.retention
+            keep = times >= cutoff
+            times, values = times[keep], values[keep]
+            if "first" in meta:
+                meta["first"] = str(max(np.datetime64(meta["first"], "ns"), cutoff))
+                self._write_meta(series_dir, meta)
+        self._write_segment(series_dir, times, values)
+        for segment in segments:
+            os.remove(segment)
+
+
+observation_store: ObservationStore | None = (
+    ObservationStore(OBSERVATION_STORE_PATH) if OBSERVATION_STORE_PATH else None
+)
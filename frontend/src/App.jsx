@@ -5,7 +5,7 @@ import ErrorMessage from "./ErrorMessage";
 
 const App = () => {
   const [errorMessage, setErrorMessage] = useState("");
-  const [plot, setPlot] = useState("[]");
+  const [plot, setPlot] = useState({});
   const [station, setStation] = useState("12.534.0");
   const [station2, setStation2] = useState("12.193.0");
   const [station3, setStation3] = useState("12.192.0");
@@ -16,7 +16,7 @@ const App = () => {
   const [stations, setStations] = useState([]);
   const [parameters, setParameters] = useState([]);
   const [timeranges, setTimeranges] = useState([]);
-  const [plottypes, setPlottypes] = useState(["Parameters all", "Parameters compare", "Parameter matrix", "Stations compare"]);
+  const [plottypes, setPlottypes] = useState(["Parameters all", "Parameters compare", "Parameter matrix", "Parameter correlation", "Stations compare"]);
 
 
   const getTimeseries = async () => {
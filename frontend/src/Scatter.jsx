@@ -8,7 +8,7 @@ export default function Scatter(plot ) {
 //     type: "scatter",
 //   };
 //  const data = [trace];
-const data_json = JSON.parse(plot.data);
+const data_json = plot.data;
 
   return (
     <div>